@@ -0,0 +1,258 @@
+"""
+Deterministic synthetic input data for the benchmarks.
+Every generator takes a seed, the same arguments always produce the same files.
+"""
+import base64
+import os
+
+import numpy as np
+
+g_amino_acids = "ACDEFGHIKLMNPQRSTVWY"
+# rough amino acid frequencies of the human proteome, same order as g_amino_acids
+g_aa_frequencies = np.array([7.0, 2.3, 4.7, 7.1, 3.7, 6.6, 2.6, 4.3, 5.7, 10.0,
+                             2.1, 3.6, 6.3, 4.8, 5.6, 8.3, 5.4, 6.0, 1.2, 2.7])
+g_aa_frequencies = g_aa_frequencies / g_aa_frequencies.sum()
+
+g_filter_strings = [
+    "FTMS + p NSI d Full ms2 {:.2f}@hcd30.00 [100.00-2000.00]",
+    "ITMS + c NSI d Full ms2 {:.2f}@cid35.00 [100.00-2000.00]",
+    "FTMS + p NSI d Full ms2 {:.2f}@etd50.00@hcd20.00 [100.00-2000.00]",
+]
+
+g_xifdr_summary_name = "FDR_rep{}_1.000000_0.050000_1.000000_1.000000_1.000000_10000.000000_false_summary_xiFDR1.1.25.55.csv"
+
+
+def protein_ids(n_proteins):
+    """uniprot like accessions, P00001 ... Pnnnnn"""
+    return ["P{:05d}".format(i + 1) for i in range(n_proteins)]
+
+
+def random_sequences(n_proteins, seed=0, mean_length=450):
+    rng = np.random.RandomState(seed)
+    lengths = np.clip(rng.lognormal(np.log(mean_length), 0.6, n_proteins), 30, 5000).astype(int)
+    residues = rng.choice(len(g_amino_acids), size=lengths.sum(), p=g_aa_frequencies)
+    letters = np.array(list(g_amino_acids))[residues]
+    bounds = np.concatenate([[0], np.cumsum(lengths)])
+    return ["".join(letters[bounds[i]:bounds[i + 1]]) for i in range(n_proteins)]
+
+
+def write_fasta(filename, n_proteins, seed=0, line_width=60):
+    """
+    writes a uniprot style fasta file, i.e.
+    >sp|P00001|PROT1_HUMAN Protein 1 OS=Homo sapiens OX=9606 GN=GENE1 PE=1 SV=1
+    :return: list of protein ids in file order
+    """
+    ids = protein_ids(n_proteins)
+    sequences = random_sequences(n_proteins, seed)
+    with open(filename, "w") as f:
+        for i, (protein_id, seq) in enumerate(zip(ids, sequences)):
+            f.write(">sp|{0}|PROT{1}_HUMAN Protein {1} OS=Homo sapiens OX=9606 GN=GENE{1} PE=1 SV=1\n"
+                    .format(protein_id, i + 1))
+            for start in range(0, len(seq), line_width):
+                f.write(seq[start:start + line_width] + "\n")
+    return ids
+
+
+def write_protein_groups(filename, ids, n_groups, seed=0):
+    """
+    writes a MaxQuant proteinGroups.txt like table for n_groups groups of the given protein ids,
+    including contaminants and reverse hits
+    """
+    rng = np.random.RandomState(seed)
+    chosen = rng.permutation(len(ids))
+    pos = 0
+    rows = []
+    for i in range(n_groups):
+        group_size = 1 + rng.poisson(0.3)
+        members = [ids[j] for j in chosen[pos:pos + group_size]]
+        pos += group_size
+        if not members:
+            break
+        contaminant, reverse = "", ""
+        draw = rng.rand()
+        if draw < 0.02:
+            members = ["CON__" + m for m in members]
+            contaminant = "+"
+        elif draw < 0.04:
+            members = ["REV__" + m for m in members]
+            reverse = "+"
+        ibaq = 0. if rng.rand() < 0.05 else rng.lognormal(16, 2.5)
+        rows.append((";".join(members), ";".join(members[:1]), ibaq, contaminant, reverse))
+    with open(filename, "w") as f:
+        f.write("\t".join(["Protein IDs", "Majority protein IDs", "iBAQ", "Potential contaminant", "Reverse"]) + "\n")
+        for row in rows:
+            f.write("{}\t{}\t{!r}\t{}\t{}\n".format(*row))
+    return len(rows)
+
+
+def write_evidence(filename, ids, n_rows, n_raw_files=4, seed=0):
+    """writes a MaxQuant evidence.txt like table"""
+    rng = np.random.RandomState(seed)
+    columns = ["Proteins", "Raw file", "Intensity", "Intensity L", "Intensity M", "Intensity H",
+               "MS/MS count", "Potential contaminant", "Reverse"]
+    with open(filename, "w") as f:
+        f.write("\t".join(columns) + "\n")
+        proteins = rng.randint(0, len(ids), n_rows)
+        raw_files = rng.randint(0, n_raw_files, n_rows)
+        intensities = rng.lognormal(14, 2, (n_rows, 3)).tolist()
+        flags = rng.rand(n_rows)
+        for i in range(n_rows):
+            l, m, h = intensities[i]
+            f.write("{}\traw_{:02d}\t{!r}\t{!r}\t{!r}\t{!r}\t{}\t{}\t{}\n".format(
+                ids[proteins[i]], raw_files[i], l + m + h, l, m, h, 1 + int(flags[i] * 5),
+                "+" if flags[i] < 0.01 else "", "+" if 0.01 <= flags[i] < 0.02 else ""))
+
+
+def random_spectra(n_spectra, mean_peaks=150, seed=0):
+    """
+    :return: list of dicts with title, rt, pepmass, pepint, charge, mz (array), intensity (array), filter_string
+    """
+    rng = np.random.RandomState(seed)
+    spectra = []
+    for i in range(n_spectra):
+        n_peaks = max(5, rng.poisson(mean_peaks))
+        pepmass = rng.uniform(350, 1500)
+        spectra.append({
+            "title": "bench.{0}.{0}.{1}".format(i + 1, 0),
+            "rt": i * 0.6,
+            "pepmass": pepmass,
+            "pepint": rng.lognormal(12, 1.5),
+            "charge": int(rng.randint(2, 7)),
+            "mz": np.sort(rng.uniform(100, 2000, n_peaks)),
+            "intensity": rng.lognormal(6, 1.5, n_peaks),
+            "filter_string": g_filter_strings[i % len(g_filter_strings)].format(pepmass),
+        })
+    return spectra
+
+
+def write_mgf(filename, n_spectra, mean_peaks=150, seed=0):
+    """writes a MGF file that MGF_Reader can read"""
+    with open(filename, "w") as f:
+        for s in random_spectra(n_spectra, mean_peaks, seed):
+            f.write("BEGIN IONS\nTITLE={}\nRTINSECONDS={!r}\nPEPMASS={!r} {!r}\nCHARGE={}+\n".format(
+                s["title"], s["rt"], s["pepmass"], s["pepint"], s["charge"]))
+            f.write("".join("{!r} {!r}\n".format(m, i) for m, i in zip(s["mz"].tolist(), s["intensity"].tolist())))
+            f.write("END IONS\n")
+
+
+def _binary_data_array(values, name, unit):
+    encoded = base64.b64encode(np.asarray(values, dtype="<f8").tobytes()).decode("ascii")
+    return (
+        '<binaryDataArray encodedLength="{}">'
+        '<cvParam cvRef="MS" accession="MS:1000523" name="64-bit float" value=""/>'
+        '<cvParam cvRef="MS" accession="MS:1000576" name="no compression" value=""/>'
+        '<cvParam cvRef="MS" accession="{}" name="{}" value=""/>'
+        '<binary>{}</binary></binaryDataArray>'
+    ).format(len(encoded), unit, name, encoded)
+
+
+def write_mzml(filename, n_spectra, mean_peaks=150, ms1_every=10, seed=0):
+    """
+    writes a centroided, indexed mzML file with thermo like filter strings,
+    one MS1 scan is inserted every ms1_every scans
+    """
+    header = (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<indexedmzML xmlns="http://psi.hupo.org/ms/mzml" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">\n'
+        '<mzML xmlns="http://psi.hupo.org/ms/mzml" version="1.1.0" id="bench">\n'
+        '<cvList count="2">'
+        '<cv id="MS" fullName="Proteomics Standards Initiative Mass Spectrometry Ontology" version="4.1.0" '
+        'URI="https://raw.githubusercontent.com/HUPO-PSI/psi-ms-CV/master/psi-ms.obo"/>'
+        '<cv id="UO" fullName="Unit Ontology" version="releases/2020-03-10" '
+        'URI="http://ontologies.berkeleybop.org/uo.obo"/></cvList>\n'
+        '<run id="bench">\n'
+        '<spectrumList count="{}">\n'
+    )
+    spectra = random_spectra(n_spectra, mean_peaks, seed)
+    # one MS1 scan precedes every ms1_step MS2 scans
+    ms1_step = max(1, ms1_every - 1) if ms1_every else 0
+    n_total = n_spectra + ((n_spectra + ms1_step - 1) // ms1_step if ms1_step else 0)
+    offsets = []
+    with open(filename, "wb") as f:
+        f.write(header.format(n_total).encode("ascii"))
+        index = 0
+        for i, s in enumerate(spectra):
+            if ms1_step and i % ms1_step == 0:
+                ms1 = ('<spectrum index="{0}" id="scan={1}" defaultArrayLength="{2}">'
+                       '<cvParam cvRef="MS" accession="MS:1000511" name="ms level" value="1"/>'
+                       '<cvParam cvRef="MS" accession="MS:1000127" name="centroid spectrum" value=""/>'
+                       '<scanList count="1"><scan>'
+                       '<cvParam cvRef="MS" accession="MS:1000016" name="scan start time" value="{3!r}" '
+                       'unitCvRef="UO" unitAccession="UO:0000031" unitName="minute"/>'
+                       '<cvParam cvRef="MS" accession="MS:1000512" name="filter string" '
+                       'value="FTMS + p NSI Full ms [350.00-1800.00]"/>'
+                       '</scan></scanList><binaryDataArrayList count="2">{4}{5}</binaryDataArrayList></spectrum>\n'
+                       ).format(index, index + 1, len(s["mz"]), s["rt"] / 60.,
+                                _binary_data_array(s["mz"], "m/z array", "MS:1000514"),
+                                _binary_data_array(s["intensity"], "intensity array", "MS:1000515"))
+                offsets.append((index + 1, f.tell()))
+                f.write(ms1.encode("ascii"))
+                index += 1
+            ms2 = ('<spectrum index="{0}" id="scan={1}" defaultArrayLength="{2}">'
+                   '<cvParam cvRef="MS" accession="MS:1000511" name="ms level" value="2"/>'
+                   '<cvParam cvRef="MS" accession="MS:1000127" name="centroid spectrum" value=""/>'
+                   '<scanList count="1"><scan>'
+                   '<cvParam cvRef="MS" accession="MS:1000016" name="scan start time" value="{3!r}" '
+                   'unitCvRef="UO" unitAccession="UO:0000031" unitName="minute"/>'
+                   '<cvParam cvRef="MS" accession="MS:1000512" name="filter string" value="{4}"/>'
+                   '</scan></scanList>'
+                   '<precursorList count="1"><precursor><selectedIonList count="1"><selectedIon>'
+                   '<cvParam cvRef="MS" accession="MS:1000744" name="selected ion m/z" value="{5!r}"/>'
+                   '<cvParam cvRef="MS" accession="MS:1000041" name="charge state" value="{6}"/>'
+                   '<cvParam cvRef="MS" accession="MS:1000042" name="peak intensity" value="{7!r}"/>'
+                   '</selectedIon></selectedIonList></precursor></precursorList>'
+                   '<binaryDataArrayList count="2">{8}{9}</binaryDataArrayList></spectrum>\n'
+                   ).format(index, index + 1, len(s["mz"]), s["rt"] / 60., s["filter_string"],
+                            s["pepmass"], s["charge"], s["pepint"],
+                            _binary_data_array(s["mz"], "m/z array", "MS:1000514"),
+                            _binary_data_array(s["intensity"], "intensity array", "MS:1000515"))
+            offsets.append((index + 1, f.tell()))
+            f.write(ms2.encode("ascii"))
+            index += 1
+        f.write(b'</spectrumList>\n</run>\n</mzML>\n')
+        index_offset = f.tell()
+        f.write(b'<indexList count="1">\n<index name="spectrum">\n')
+        for scan, offset in offsets:
+            f.write('<offset idRef="scan={}">{}</offset>\n'.format(scan, offset).encode("ascii"))
+        f.write('</index>\n</indexList>\n<indexListOffset>{}</indexListOffset>\n</indexedmzML>\n'
+                .format(index_offset).encode("ascii"))
+
+
+def write_xifdr_csv(filename, n_rows, seed=0):
+    """writes a xiFDR result like csv with Score, TT/TD/DD flags, fdrGroup, proteins and peptides"""
+    rng = np.random.RandomState(seed)
+    peptides = ["K.PEPTIDEK.R", "R.PEPbs3KTIDE.K", "K.LMoxVEKR.A", "R.AAKLSTR.G", "K.VVbs3KSPER.L"]
+    decoy_type = rng.choice(["TT", "TD", "DD"], size=n_rows, p=[0.9, 0.07, 0.03])
+    internal = rng.rand(n_rows) < 0.6
+    scores = rng.gamma(4, 3, n_rows).tolist()
+    with open(filename, "w") as f:
+        f.write("Score,isTT,isTD,isDD,fdrGroup,Protein1,Protein2,Peptide1,Peptide2\n")
+        for i in range(n_rows):
+            p1 = rng.randint(1, 500)
+            p2 = p1 if internal[i] else rng.randint(1, 500)
+            f.write("{!r},{},{},{},{},P{:05d},P{:05d},{},{}\n".format(
+                scores[i],
+                str(decoy_type[i] == "TT").lower(), str(decoy_type[i] == "TD").lower(),
+                str(decoy_type[i] == "DD").lower(),
+                "Within" if internal[i] else "Between", p1, p2,
+                peptides[rng.randint(len(peptides))], peptides[rng.randint(len(peptides))]))
+
+
+def write_xifdr_sweep(base_dir, db_sizes, replicates, n_rows, seed=0):
+    """
+    writes xiFDR result csvs for a search space sweep, one directory per 'db_<n1>_random_<n2>' key
+    :param db_sizes: list of (n1, n2) tuples
+    :return: dict {key: [files]} as used by xifdr_result_reading.scores_from_filedict
+    """
+    dct_files = {}
+    for i, (n1, n2) in enumerate(db_sizes):
+        key = "db_{}_random_{}".format(n1, n2)
+        exp_dir = os.path.join(base_dir, key)
+        if not os.path.exists(exp_dir):
+            os.makedirs(exp_dir)
+        dct_files[key] = []
+        for rep in range(replicates):
+            f = os.path.join(exp_dir, g_xifdr_summary_name.format(rep + 1))
+            write_xifdr_csv(f, n_rows, seed=seed + 1000 * i + rep)
+            dct_files[key].append(f)
+    return dct_files
@@ -0,0 +1,244 @@
+"""
+Load test of the Xi/xiFDR orchestration layer without a JVM.
+
+A 'java' shim on PATH runs benchmarks/stub_jvm.py instead of XiSearch and xiFDR, so hundreds of simulated
+searches can be pushed through XiWrapper, XiFdrWrapper and pipeline.execute_pipeline concurrently.
+Reported: wall time against the simulated tool runtime (scheduling and wrapper overhead), logged tool
+output lines per second, and failures by exception type, including failures that were not detected.
+
+The wrappers compare the subprocess output with '' to detect its end, so this has to run on python 2.
+
+Usage:
+python -m benchmarks.loadtest --searches 200 --concurrency 8 --lines 1000 --failure-rate 0.1
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+g_repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+g_lib_dir = os.path.join(g_repo_dir, "xlSearchSpaceLibs")
+g_stub_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_jvm.py")
+
+# failure mode of the stub -> name of the exception the wrappers are expected to raise
+g_expected_exceptions = {
+    "none": None,
+    "oom": "XiSearchOutOfMemoryException",
+    "daemonise": "XiSearchDaemoniseFailureException",
+    "exit": "XiSearchException",
+}
+
+
+class LineCounter(logging.Handler):
+    """counts the tool output lines the wrappers log"""
+    def __init__(self):
+        logging.Handler.__init__(self, logging.DEBUG)
+        self.count = 0
+        self.count_lock = threading.Lock()
+
+    def emit(self, record):
+        if record.levelno == logging.DEBUG:
+            with self.count_lock:
+                self.count += 1
+
+
+def install_java_shim(bin_dir):
+    """writes a 'java' executable into bin_dir that runs the stub and puts bin_dir first on PATH"""
+    java = os.path.join(bin_dir, "java")
+    with open(java, "w") as f:
+        f.write('#!/bin/sh\nexec "{}" "{}" "$@"\n'.format(sys.executable, g_stub_script))
+    os.chmod(java, os.stat(java).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ.get("PATH", "")
+    return java
+
+
+def create_inputs(work_dir, n_fasta=3, n_peaks=2):
+    """creates the files the wrappers check for, the stub does not read their content"""
+    inputs = {"fasta": [], "peaks": []}
+    for i in range(n_fasta):
+        inputs["fasta"].append(os.path.join(work_dir, "db_{}.fasta".format(i)))
+    for i in range(n_peaks):
+        inputs["peaks"].append(os.path.join(work_dir, "run_{}.mgf".format(i)))
+    inputs["config"] = os.path.join(work_dir, "xi_config.conf")
+    inputs["xi_jar"] = os.path.join(work_dir, "XiSearch.jar")
+    inputs["xifdr_jar"] = os.path.join(work_dir, "xiFDR.jar")
+    for filename in inputs["fasta"] + inputs["peaks"] + [inputs["config"], inputs["xi_jar"], inputs["xifdr_jar"]]:
+        with open(filename, "w") as f:
+            f.write("\n")
+    return inputs
+
+
+def search_plan(n_searches, failure_rate, seed):
+    """:return: list of failure modes, one per simulated search"""
+    rng = random.Random(seed)
+    failures = ["oom", "daemonise", "exit"]
+    return [rng.choice(failures) if rng.random() < failure_rate else "none" for _ in range(n_searches)]
+
+
+def stub_argument(runtime, lines, failure, rows):
+    return "--stub=runtime:{},lines:{},failure:{},rows:{}".format(runtime, lines, failure, rows)
+
+
+def run_search(args):
+    """runs one simulated search through the wrappers, never raises"""
+    i, failure, mode, inputs, work_dir, settings = args
+    xi_stub = stub_argument(settings["xi_runtime"], settings["lines"], failure, settings["rows"])
+    fdr_stub = stub_argument(settings["xifdr_runtime"], settings["lines"] // 10, "none", settings["rows"])
+    output_dir = os.path.join(work_dir, "search_{:05d}".format(i))
+    result = {"index": i, "failure": failure, "mode": mode, "exception": None}
+    start = time.time()
+    try:
+        if mode == "pipeline":
+            import pipeline
+            pipeline.execute_pipeline(
+                list_of_fasta_dbs=inputs["fasta"], xi_config=inputs["config"], peak_files=inputs["peaks"],
+                output_basedir=output_dir, additional_xi_parameters=[xi_stub], xi_path=inputs["xi_jar"],
+                additional_xifdr_arguments=[fdr_stub], xifdr_filename=inputs["xifdr_jar"])
+        elif mode == "xi":
+            from XiWrapper import XiWrapper
+            XiWrapper.xi_execution(
+                xi_config=inputs["config"], peak_files=inputs["peaks"], fasta_files=inputs["fasta"],
+                output_file=os.path.join(output_dir, "xi_results"), additional_parameters=[xi_stub],
+                xi_path=inputs["xi_jar"])
+        else:
+            from XiFdrWrapper import XiFdrWrapper
+            xi_csv = os.path.join(output_dir, "xi_results.csv")
+            if not os.path.exists(output_dir):
+                os.makedirs(output_dir)
+            with open(xi_csv, "w") as f:
+                f.write("\n")
+            XiFdrWrapper.xifdr_execution(
+                xifdr_input_csv=xi_csv, xifdr_output_dir=os.path.join(output_dir, "xifdr_output"),
+                additional_xifdr_arguments=[fdr_stub], xifdr_filename=inputs["xifdr_jar"])
+    except Exception as e:
+        result["exception"] = type(e).__name__
+    result["seconds"] = time.time() - start
+    return result
+
+
+def simulated_runtime(result, settings):
+    """runtime the stub spent sleeping for this search"""
+    if result["mode"] == "xifdr":
+        return settings["xifdr_runtime"]
+    if result["failure"] in ("oom", "daemonise"):
+        # the wrapper kills the process when the error line shows up half way through
+        return settings["xi_runtime"] / 2.
+    if result["mode"] == "pipeline" and result["failure"] == "none":
+        return settings["xi_runtime"] + settings["xifdr_runtime"]
+    return settings["xi_runtime"]
+
+
+def summarize(results, settings, wall_seconds, logged_lines):
+    failures = {}
+    undetected = 0
+    misclassified = 0
+    overheads = []
+    for r in results:
+        if r["exception"]:
+            failures[r["exception"]] = failures.get(r["exception"], 0) + 1
+        expected = g_expected_exceptions[r["failure"]] if r["mode"] != "xifdr" else None
+        if expected and r["exception"] is None:
+            undetected += 1
+        elif r["exception"] != expected:
+            misclassified += 1
+        overheads.append(r["seconds"] - simulated_runtime(r, settings))
+    overheads.sort()
+    simulated_total = sum(simulated_runtime(r, settings) for r in results)
+    return {
+        "searches": len(results),
+        "concurrency": settings["concurrency"],
+        "wall_seconds": wall_seconds,
+        "ideal_wall_seconds": simulated_total / settings["concurrency"],
+        "searches_per_second": len(results) / wall_seconds,
+        "overhead_seconds_median": overheads[len(overheads) // 2],
+        "overhead_seconds_p95": overheads[int(len(overheads) * 0.95)],
+        "overhead_seconds_max": overheads[-1],
+        "logged_lines": logged_lines,
+        "logged_lines_per_second": logged_lines / wall_seconds,
+        "failures": failures,
+        "undetected_failures": undetected,
+        "misclassified_failures": misclassified,
+    }
+
+
+def run_loadtest(n_searches=200, concurrency=8, mode="pipeline", xi_runtime=0.2, xifdr_runtime=0.05,
+                 lines=200, rows=100, failure_rate=0.1, seed=0, work_dir=None):
+    """
+    drives n_searches simulated searches through the wrappers
+
+    :param mode: 'pipeline', 'xi' or 'xifdr', the entry point that is exercised
+    :return: dict of summary statistics
+    """
+    if g_lib_dir not in sys.path:
+        sys.path.insert(0, g_lib_dir)
+    settings = {"xi_runtime": xi_runtime, "xifdr_runtime": xifdr_runtime, "lines": lines, "rows": rows,
+                "concurrency": concurrency}
+    remove_work_dir = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix="xl_loadtest_")
+    old_path = os.environ.get("PATH", "")
+    counter = LineCounter()
+    loggers = [logging.getLogger(name) for name in ("XiWrapper", "XiFdrWrapper")]
+    old_levels = [l.level for l in loggers]
+    try:
+        bin_dir = os.path.join(work_dir, "bin")
+        if not os.path.exists(bin_dir):
+            os.makedirs(bin_dir)
+        install_java_shim(bin_dir)
+        inputs = create_inputs(work_dir)
+        for l in loggers:
+            l.setLevel(logging.DEBUG)
+            l.addHandler(counter)
+        tasks = [(i, failure, mode, inputs, work_dir, settings)
+                 for i, failure in enumerate(search_plan(n_searches, failure_rate, seed))]
+        pool = ThreadPool(concurrency)
+        start = time.time()
+        results = pool.map(run_search, tasks, chunksize=1)
+        wall_seconds = time.time() - start
+        pool.close()
+        pool.join()
+    finally:
+        for l, level in zip(loggers, old_levels):
+            l.removeHandler(counter)
+            l.setLevel(level)
+        os.environ["PATH"] = old_path
+        if remove_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return summarize(results, settings, wall_seconds, counter.count)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--searches", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mode", choices=["pipeline", "xi", "xifdr"], default="pipeline")
+    parser.add_argument("--xi-runtime", type=float, default=0.2, help="simulated XiSearch runtime in seconds")
+    parser.add_argument("--xifdr-runtime", type=float, default=0.05, help="simulated xiFDR runtime in seconds")
+    parser.add_argument("--lines", type=int, default=200, help="stdout lines per simulated XiSearch run")
+    parser.add_argument("--rows", type=int, default=100, help="result rows per simulated run")
+    parser.add_argument("--failure-rate", type=float, default=0.1,
+                        help="fraction of searches that fail with an OOM, daemonise or exit code error")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", help="keep the simulated outputs in this directory")
+    parser.add_argument("--output", help="write the summary as json to this file")
+    args = parser.parse_args(argv)
+
+    summary = run_loadtest(n_searches=args.searches, concurrency=args.concurrency, mode=args.mode,
+                           xi_runtime=args.xi_runtime, xifdr_runtime=args.xifdr_runtime, lines=args.lines,
+                           rows=args.rows, failure_rate=args.failure_rate, seed=args.seed, work_dir=args.work_dir)
+    print(json.dumps(summary, indent=2, sort_keys=True))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+    return 0 if summary["undetected_failures"] == 0 and summary["misclassified_failures"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,490 @@
+"""
+Benchmark runner for the hot paths of xlSearchSpaceLibs.
+
+Every benchmark runs in a fresh interpreter, so that peak RSS is not shared between benchmarks.
+Reported per benchmark: wall time (best and mean of the repeats), throughput in items per second,
+peak RSS of the benchmark process and the tracemalloc peak per operation (python 3 only).
+
+Usage:
+python -m benchmarks.runner --scale small --output bench_small.json
+python -m benchmarks.runner --scale medium --only fasta_read,split_mzml --compare bench_small.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    # not available on windows
+    resource = None
+try:
+    import tracemalloc
+except ImportError:
+    # python 2
+    tracemalloc = None
+
+from benchmarks import generators
+
+g_repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+g_lib_dir = os.path.join(g_repo_dir, "xlSearchSpaceLibs")
+g_preprocessing_script = os.path.join(g_lib_dir, "preprocessing-171005.py")
+
+# sizes of the generated inputs, "large" is roughly the scale of a human proteome search space sweep
+g_scales = {
+    "tiny": {"fasta_proteins": 200, "protein_groups": 150, "evidence_rows": 2000, "spectra": 200,
+             "xifdr_rows": 500, "sweep_dbs": 2, "sweep_replicates": 2},
+    "small": {"fasta_proteins": 2000, "protein_groups": 1500, "evidence_rows": 20000, "spectra": 2000,
+              "xifdr_rows": 5000, "sweep_dbs": 4, "sweep_replicates": 3},
+    "medium": {"fasta_proteins": 20000, "protein_groups": 6000, "evidence_rows": 200000, "spectra": 20000,
+               "xifdr_rows": 50000, "sweep_dbs": 8, "sweep_replicates": 3},
+    "large": {"fasta_proteins": 80000, "protein_groups": 10000, "evidence_rows": 1000000, "spectra": 100000,
+              "xifdr_rows": 200000, "sweep_dbs": 16, "sweep_replicates": 3},
+}
+
+
+def import_lib(module_name):
+    """imports a module of xlSearchSpaceLibs the way its own modules import each other"""
+    if g_lib_dir not in sys.path:
+        sys.path.insert(0, g_lib_dir)
+    return __import__(module_name)
+
+
+def import_preprocessing():
+    """loads the preprocessing script, its file name is not a valid module name"""
+    if "preprocessing" in sys.modules:
+        return sys.modules["preprocessing"]
+    # the script imports mgf_utils from its own directory
+    if g_lib_dir not in sys.path:
+        sys.path.insert(0, g_lib_dir)
+    try:
+        import importlib.util
+        spec = importlib.util.spec_from_file_location("preprocessing", g_preprocessing_script)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules["preprocessing"] = module
+        spec.loader.exec_module(module)
+    except ImportError:
+        import imp
+        module = imp.load_source("preprocessing", g_preprocessing_script)
+    return module
+
+
+def input_files(data_dir):
+    return {
+        "fasta": os.path.join(data_dir, "proteome.fasta"),
+        "protein_groups": os.path.join(data_dir, "proteinGroups.txt"),
+        "evidence": os.path.join(data_dir, "evidence.txt"),
+        "mgf": os.path.join(data_dir, "spectra.mgf"),
+        "mzml": os.path.join(data_dir, "run.mzML"),
+        "xifdr_csv": os.path.join(data_dir, "xifdr_result.csv"),
+        "sweep_dir": os.path.join(data_dir, "sweep"),
+        "sweep_dict": os.path.join(data_dir, "sweep.json"),
+    }
+
+
+def generate_inputs(data_dir, sizes, seed=0):
+    """
+    writes all benchmark inputs to data_dir, unless it already holds inputs of the same sizes and seed
+    """
+    marker = os.path.join(data_dir, "inputs.json")
+    description = {"sizes": sizes, "seed": seed}
+    if os.path.exists(marker):
+        with open(marker) as f:
+            if json.load(f) == description:
+                return
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+    files = input_files(data_dir)
+    ids = generators.write_fasta(files["fasta"], sizes["fasta_proteins"], seed=seed)
+    generators.write_protein_groups(files["protein_groups"], ids, sizes["protein_groups"], seed=seed)
+    generators.write_evidence(files["evidence"], ids, sizes["evidence_rows"], seed=seed)
+    generators.write_mgf(files["mgf"], sizes["spectra"], seed=seed)
+    generators.write_mzml(files["mzml"], sizes["spectra"], seed=seed)
+    generators.write_xifdr_csv(files["xifdr_csv"], sizes["xifdr_rows"], seed=seed)
+    db_sizes = [(100 * (i + 1), 100 * (i % 2)) for i in range(sizes["sweep_dbs"])]
+    dct_files = generators.write_xifdr_sweep(files["sweep_dir"], db_sizes, sizes["sweep_replicates"],
+                                             sizes["xifdr_rows"] // sizes["sweep_dbs"], seed=seed)
+    with open(files["sweep_dict"], "w") as f:
+        json.dump(dct_files, f)
+    with open(marker, "w") as f:
+        json.dump(description, f)
+
+
+# # # benchmarks
+# each benchmark is a pair of functions:
+# setup(files, tmp_dir) returns the state, run(state) performs one operation and returns the number of items handled
+
+def setup_fasta_read(files, tmp_dir):
+    return import_lib("iBAQ_FASTA_handler"), files["fasta"]
+
+
+def run_fasta_read(state):
+    handler_module, fasta = state
+    return len(handler_module.FastaHandler(fasta).dict)
+
+
+def setup_fasta_build(files, tmp_dir):
+    handler = import_lib("iBAQ_FASTA_handler").FastaHandler(files["fasta"])
+    protein_ids = sorted(handler.dict)
+    # every second protein plus some that are missing in the reference
+    selection = protein_ids[::2] + ["Q{:05d}".format(i) for i in range(len(protein_ids) // 100)]
+    return handler, selection, os.path.join(tmp_dir, "sub", "sub.fasta")
+
+
+def run_fasta_build(state):
+    handler, selection, out = state
+    handler.build_fasta(selection, out)
+    return len(selection)
+
+
+def setup_ibaq_read(files, tmp_dir):
+    return import_lib("iBAQ_FASTA_handler"), files["protein_groups"]
+
+
+def run_ibaq_read(state):
+    handler_module, protein_groups = state
+    return len(handler_module.IbaqExtraction(protein_groups).results)
+
+
+def setup_ibaq_thresholds(files, tmp_dir):
+    return import_lib("iBAQ_FASTA_handler").IbaqExtraction(files["protein_groups"])
+
+
+def run_ibaq_thresholds(ibaq):
+    n_queries = 0
+    for percentage in [0, 0.01, 0.1, 1, 10, 50]:
+        ibaq.get_perc_higher_than(percentage)
+        n_queries += 1
+    for number in [10, 100, 500, 1000, 5000]:
+        ibaq.get_top_no(number)
+        n_queries += 1
+    for quantile in [0.1, 0.5, 0.9]:
+        ibaq.get_top_quant(quantile)
+        n_queries += 1
+    return n_queries
+
+
+def setup_evidence_extract(files, tmp_dir):
+    return import_lib("iBAQ_FASTA_handler").mq_Evidence(files["evidence"])
+
+
+def run_evidence_extract(evidence):
+    evidence.extract_intensities()
+    evidence.extract_psm_count(raw_file="raw_01")
+    return len(evidence.df_evidence)
+
+
+def setup_mgf_read(files, tmp_dir):
+    return import_preprocessing(), files["mgf"]
+
+
+def run_mgf_read(state):
+    preprocessing, mgf = state
+    reader = preprocessing.MGF_Reader()
+    reader.load(mgf)
+    return sum(1 for _ in reader)
+
+
+def setup_mgf_write(files, tmp_dir):
+    preprocessing = import_preprocessing()
+    reader = preprocessing.MGF_Reader()
+    reader.load(files["mgf"])
+    spectra = list(reader)
+    out = os.path.join(tmp_dir, "out.mgf")
+    check_mgf_round_trip(preprocessing, spectra, out)
+    return preprocessing, spectra, out
+
+
+def check_mgf_round_trip(preprocessing, spectra, out):
+    """writes the spectra and reads them back, fails if titles or peaks differ"""
+    preprocessing.write_mgf(spectra, out)
+    reader = preprocessing.MGF_Reader()
+    reader.load(out)
+    read = list(reader)
+    if len(read) != len(spectra):
+        raise RuntimeError("wrote {} spectra, read {}".format(len(spectra), len(read)))
+    for written, s in zip(spectra, read):
+        peaks = [p for p in written.peaks if p[1] > 0]
+        if s.getTitle() != written.getTitle() or len(s.peaks) != len(peaks):
+            raise RuntimeError("spectrum {} with {} peaks read back as {} with {} peaks".format(
+                written.getTitle(), len(peaks), s.getTitle(), len(s.peaks)))
+
+
+def run_mgf_write(state):
+    preprocessing, spectra, out = state
+    preprocessing.write_mgf(spectra, out)
+    return len(spectra)
+
+
+def setup_split_mzml(files, tmp_dir):
+    return import_preprocessing(), files["mzml"]
+
+
+def run_split_mzml(state):
+    preprocessing, mzml_file = state
+    return sum(len(v) for v in preprocessing.split_mzml(mzml_file).values())
+
+
+def setup_scores_from_filedict(files, tmp_dir):
+    with open(files["sweep_dict"]) as f:
+        return import_lib("xifdr_result_reading"), json.load(f)
+
+
+def run_scores_from_filedict(state):
+    result_reading, dct_files = state
+    df_scores = result_reading.scores_from_filedict(dct_files)
+    result_reading.build_long_min_df(df_scores)
+    return len(df_scores)
+
+
+def setup_fdr_funcs(files, tmp_dir):
+    import pandas as pd
+    return import_lib("FDR_funcs"), pd.read_csv(files["xifdr_csv"])
+
+
+def run_fdr_funcs(state):
+    fdr_funcs, df = state
+    fdr_funcs.FDR_for_mod_subsets(df)
+    fdr_funcs.count_missed_cleavage(df["Peptide1"], fdr_funcs.g_enzyme_regex_dict["trypsin"])
+    return len(df)
+
+
+# modules imported by short-lived worker processes and the heavy dependencies they must not load on import
+g_import_light_modules = [
+    ("iBAQ_FASTA_handler", ("matplotlib", "pandas")),
+    ("FDR_funcs", ("pandas",)),
+    ("search_space_estimation", ("pandas",)),
+    ("mgf_utils", ("pyteomics", "pandas")),
+    ("XiWrapper", ("pandas", "numpy")),
+    ("XiFdrWrapper", ("pandas", "numpy")),
+    ("preprocessing", ("pyteomics", "pandas", "matplotlib")),
+]
+
+g_import_child = """
+import json, sys, time
+sys.path.insert(0, {lib_dir!r})
+start = time.time()
+if {name!r} != "preprocessing":
+    __import__({name!r})
+else:
+    try:
+        import importlib.util
+        spec = importlib.util.spec_from_file_location("preprocessing", {script!r})
+        spec.loader.exec_module(importlib.util.module_from_spec(spec))
+    except ImportError:
+        import imp
+        imp.load_source("preprocessing", {script!r})
+seconds = time.time() - start
+print(json.dumps({{"seconds": seconds, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+# imports every submodule of the package as a package member, without the library directory on sys.path
+g_import_package_child = """
+import importlib, json, traceback
+import xlSearchSpaceLibs
+failed = {}
+for name in xlSearchSpaceLibs.__all__:
+    try:
+        importlib.import_module("xlSearchSpaceLibs." + name)
+    except Exception:
+        failed[name] = traceback.format_exc().strip().splitlines()[-1]
+print(json.dumps({"failed": failed}))
+"""
+
+
+def setup_import_light(files, tmp_dir):
+    return g_import_light_modules
+
+
+def run_import_light(modules):
+    """
+    imports every module in a fresh interpreter, fails if one of them loads a heavy dependency or if a submodule
+    of the package can not be imported through the package
+    """
+    out = subprocess.check_output([sys.executable, "-c", g_import_package_child], cwd=g_repo_dir)
+    failed = json.loads(out.decode("utf-8").strip().splitlines()[-1])["failed"]
+    if failed:
+        raise RuntimeError("package imports: " + "; ".join(
+            "{}: {}".format(name, error) for name, error in sorted(failed.items())))
+    leaks = []
+    for name, heavy in modules:
+        code = g_import_child.format(lib_dir=g_lib_dir, script=g_preprocessing_script, name=name, heavy=list(heavy))
+        out = subprocess.check_output([sys.executable, "-c", code], cwd=g_repo_dir)
+        loaded = json.loads(out.decode("utf-8").strip().splitlines()[-1])["loaded"]
+        if loaded:
+            leaks.append("{} loads {}".format(name, ", ".join(loaded)))
+    if leaks:
+        raise RuntimeError("heavy imports: " + "; ".join(leaks))
+    return len(modules)
+
+
+g_benchmarks = [
+    ("fasta_read", setup_fasta_read, run_fasta_read),
+    ("fasta_build", setup_fasta_build, run_fasta_build),
+    ("ibaq_read", setup_ibaq_read, run_ibaq_read),
+    ("ibaq_thresholds", setup_ibaq_thresholds, run_ibaq_thresholds),
+    ("evidence_extract", setup_evidence_extract, run_evidence_extract),
+    ("mgf_read", setup_mgf_read, run_mgf_read),
+    ("mgf_write", setup_mgf_write, run_mgf_write),
+    ("split_mzml", setup_split_mzml, run_split_mzml),
+    ("scores_from_filedict", setup_scores_from_filedict, run_scores_from_filedict),
+    ("fdr_funcs", setup_fdr_funcs, run_fdr_funcs),
+    ("import_light", setup_import_light, run_import_light),
+]
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on mac os, kilobytes on linux
+    if sys.platform == "darwin":
+        maxrss //= 1024
+    return maxrss
+
+
+def run_benchmark(name, data_dir, repeat=3):
+    """
+    runs one benchmark in the current process
+    :return: dict with the measurements
+    """
+    setup, run = [(s, r) for n, s, r in g_benchmarks if n == name][0]
+    files = input_files(data_dir)
+    tmp_dir = tempfile.mkdtemp(prefix="xl_bench_")
+    try:
+        state = setup(files, tmp_dir)
+
+        timings = []
+        n_items = 0
+        for _ in range(repeat):
+            starttime = time.time()
+            n_items = run(state)
+            timings.append(time.time() - starttime)
+        result = {
+            "seconds_best": min(timings),
+            "seconds_mean": sum(timings) / len(timings),
+            "items": n_items,
+            "items_per_second": n_items / min(timings) if min(timings) > 0 else None,
+            "peak_rss_kb": peak_rss_kb(),
+            "alloc_peak_bytes": None,
+        }
+        # separate run, tracing slows down the operation
+        if tracemalloc is not None:
+            tracemalloc.start()
+            run(state)
+            result["alloc_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return result
+
+
+def run_in_subprocess(name, data_dir, repeat):
+    cmd = [sys.executable, "-m", "benchmarks.runner", "--child", name, "--data-dir", data_dir,
+           "--repeat", str(repeat)]
+    process = subprocess.Popen(cmd, cwd=g_repo_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    if process.returncode != 0:
+        return {"error": err.decode("utf-8", "replace").strip().splitlines()[-1:]}
+    return json.loads(out.decode("utf-8").strip().splitlines()[-1])
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=g_repo_dir).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(scale, data_dir, names=None, repeat=3, seed=0):
+    sizes = g_scales[scale]
+    generate_inputs(data_dir, sizes, seed)
+    report = {
+        "meta": {
+            "scale": scale,
+            "sizes": sizes,
+            "seed": seed,
+            "repeat": repeat,
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "date": datetime.datetime.now().isoformat(),
+        },
+        "results": {},
+    }
+    for name, _, _ in g_benchmarks:
+        if names and name not in names:
+            continue
+        report["results"][name] = run_in_subprocess(name, data_dir, repeat)
+        print(format_result(name, report["results"][name]))
+    return report
+
+
+def format_result(name, result):
+    if "error" in result:
+        return "{:<22} failed: {}".format(name, " ".join(result["error"]))
+    return "{:<22} {:>10.4f} s {:>14.1f} items/s {:>10} kB RSS {:>12} B alloc".format(
+        name, result["seconds_best"], result["items_per_second"] or 0, result["peak_rss_kb"],
+        result["alloc_peak_bytes"])
+
+
+def compare_reports(old_report, new_report, tolerance=0.1):
+    """
+    compares best timings of two reports
+    :return: list of tuples (name, old seconds, new seconds, ratio, regression: bool)
+    """
+    comparison = []
+    for name, new in sorted(new_report["results"].items()):
+        old = old_report["results"].get(name)
+        if old is None or "error" in old or "error" in new:
+            continue
+        ratio = new["seconds_best"] / old["seconds_best"] if old["seconds_best"] > 0 else float("inf")
+        comparison.append((name, old["seconds_best"], new["seconds_best"], ratio, ratio > 1 + tolerance))
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmarks for the hot paths of xlSearchSpaceLibs")
+    parser.add_argument("--scale", default="small", choices=sorted(g_scales))
+    parser.add_argument("--data-dir", default=None, help="directory for the generated inputs")
+    parser.add_argument("--output", default=None, help="json file for the results")
+    parser.add_argument("--compare", default=None, help="json results of a previous run")
+    parser.add_argument("--only", default=None, help="comma separated benchmark names")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tolerance", type=float, default=0.1, help="slowdown that counts as regression")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_benchmark(args.child, args.data_dir, args.repeat)))
+        return
+
+    data_dir = args.data_dir or os.path.join(tempfile.gettempdir(), "xl_bench_data_{}".format(args.scale))
+    names = args.only.split(",") if args.only else None
+    report = run_suite(args.scale, data_dir, names, args.repeat, args.seed)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            old_report = json.load(f)
+        regressions = 0
+        for name, old_s, new_s, ratio, regression in compare_reports(old_report, report, args.tolerance):
+            regressions += regression
+            print("{:<22} {:>10.4f} s -> {:>10.4f} s  x{:.2f}{}".format(
+                name, old_s, new_s, ratio, "  REGRESSION" if regression else ""))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Stand-in for the 'java' executable that mimics the command line contract of XiSearch and xiFDR:
+
+java -Xmx1G -cp XiSearch.jar rappsilber.applications.Xi --config=.. --peaks=.. --fasta=.. --output=..
+java -Xmx1G -cp xiFDR.jar org.rappsilber.fdr.CSVinFDR --pepfdr=.. --csvOutDir=.. input.csv
+
+The behaviour is controlled by a '--stub=key:value,key:value' argument (passed via additional_parameters or
+additional_xifdr_arguments of the wrappers) or by XLSTUB_<KEY> environment variables:
+    runtime     seconds the process runs, default 0.1
+    lines       number of stdout lines, default 100
+    line_length characters per stdout line, default 80
+    rows        result rows written, default 100
+    failure     none|oom|daemonise|exit, default none
+    mem_mb      memory that is allocated step by step during the run, default 0
+"""
+import os
+import sys
+import time
+
+g_defaults = {
+    "runtime": "0.1",
+    "lines": "100",
+    "line_length": "80",
+    "rows": "100",
+    "failure": "none",
+    "mem_mb": "0",
+}
+
+g_xi_columns = ["Run", "Scan", "PeakListFileName", "ScanId", "Protein1", "Protein2", "Peptide1", "Peptide2",
+                "LinkPos1", "LinkPos2", "Charge", "PrecurserMZ", "isDecoy", "match score"]
+g_xifdr_files = ["{}_5.000000_false_summary_xiFDR1.1.25.55.csv", "{}_5.000000_false_PSM_xiFDR1.1.25.55.csv",
+                 "{}_5.000000_false_Links_xiFDR1.1.25.55.csv"]
+
+
+def parse_args(argv):
+    """
+    :return: tuple (main class, dict of --key=value arguments with lists as values, list of positional arguments)
+    """
+    main_class = None
+    options = {}
+    positional = []
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg == "-cp":
+            i += 1
+        elif arg.startswith("-X"):
+            pass
+        elif arg.startswith("--"):
+            key, _, value = arg[2:].partition("=")
+            options.setdefault(key, []).append(value)
+        elif main_class is None:
+            main_class = arg
+        else:
+            positional.append(arg)
+        i += 1
+    return main_class, options, positional
+
+
+def stub_settings(options):
+    settings = dict(g_defaults)
+    for key in settings:
+        settings[key] = os.environ.get("XLSTUB_" + key.upper(), settings[key])
+    for stub_arg in options.get("stub", []):
+        for pair in stub_arg.split(","):
+            key, _, value = pair.partition(":")
+            settings[key] = value
+    return settings
+
+
+def emit_output(settings, tool_name, failure_line=None):
+    """prints the configured stdout volume over the configured runtime, allocates mem_mb on the way"""
+    n_lines = int(settings["lines"])
+    runtime = float(settings["runtime"])
+    mem_chunks = []
+    mem_mb = int(settings["mem_mb"])
+    filler = "x" * max(0, int(settings["line_length"]) - 30)
+    for i in range(max(n_lines, 1)):
+        if i < n_lines:
+            sys.stdout.write("{} progress {} {}\n".format(tool_name, i, filler))
+            sys.stdout.flush()
+        if mem_mb:
+            mem_chunks.append(bytearray(mem_mb * 1024 * 1024 // max(n_lines, 1)))
+        if failure_line and i == n_lines // 2:
+            sys.stdout.write(failure_line + "\n")
+            sys.stdout.flush()
+        time.sleep(runtime / max(n_lines, 1))
+    return mem_chunks
+
+
+def fasta_ids(fasta_files, max_per_file=1000):
+    """protein ids of the first headers of each fasta, the file names for files without headers"""
+    ids = []
+    for filename in fasta_files:
+        file_ids = []
+        if os.path.isfile(filename):
+            with open(filename) as f:
+                for line in f:
+                    if line.startswith(">"):
+                        header = line[1:].split()[0] if line[1:].split() else ""
+                        file_ids.append(header.split("|")[1] if header.count("|") >= 2 else header)
+                        if len(file_ids) == max_per_file:
+                            break
+        ids.extend(file_ids or [os.path.splitext(os.path.basename(filename))[0]])
+    return ids or ["protein"]
+
+
+def run_xi(options, settings):
+    failure = settings["failure"]
+    failure_line = {
+        "oom": 'Exception in thread "main" java.lang.OutOfMemoryError: Java heap space',
+        "daemonise": "could not daemonise BufferedResultWriter_batchforward",
+    }.get(failure)
+    emit_output(settings, "XiSearch", failure_line)
+    if failure == "exit":
+        sys.stdout.write("XiSearch: simulated error\n")
+        return 1
+    output = options["output"][0]
+    peaks = options.get("peaks", ["peaks"])
+    proteins = fasta_ids(options.get("fasta", []))
+    with open(output, "w") as f:
+        f.write(",".join(g_xi_columns) + "\n")
+        for i in range(int(settings["rows"])):
+            decoy = i % 10 == 0
+            f.write("run,{0},{1},{0},{2}{3},{2}{4},PEPKTIDE,KPEPTIDE,4,1,3,{5},{6},{7}\n".format(
+                i + 1, os.path.basename(peaks[i % len(peaks)]), "REV_" if decoy else "",
+                proteins[i % len(proteins)], proteins[-1 - (i // 2) % len(proteins)], 400 + i % 1000,
+                str(decoy).lower(), (i * 7919) % 1000 / 100.))
+    return 0
+
+
+def run_xifdr(options, positional, settings):
+    emit_output(settings, "xiFDR")
+    if settings["failure"] == "exit":
+        return 1
+    out_dir = options["csvOutDir"][0]
+    base_name = options.get("csvBaseName", ["FDR"])[0]
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    for name in g_xifdr_files:
+        with open(os.path.join(out_dir, name.format(base_name)), "w") as f:
+            f.write("Score,isTT,isTD,isDD,fdrGroup,Protein1,Protein2\n")
+            for i in range(int(settings["rows"])):
+                f.write("{},true,false,false,{},P1,P2\n".format(i / 10., "Between" if i % 3 else "Within"))
+    return 0
+
+
+def main(argv):
+    main_class, options, positional = parse_args(argv)
+    settings = stub_settings(options)
+    if main_class == "rappsilber.applications.Xi":
+        return run_xi(options, settings)
+    elif main_class == "org.rappsilber.fdr.CSVinFDR":
+        return run_xifdr(options, positional, settings)
+    sys.stdout.write("stub_jvm: unknown main class '{}'\n".format(main_class))
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
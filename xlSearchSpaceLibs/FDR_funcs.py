@@ -1,5 +1,3 @@
-import pandas as pd
-
 g_enzyme_regex_dict = {
     "trypsin": r"[KR][^P]+"
 }
@@ -23,6 +21,7 @@ def FDR_for_mod_subsets(df, **kwargs):
     calculates FDR for modified/unmodified jpeptides separately
     kwargs are handed over to split_mod_and_unmod_peptides
     """
+    import pandas as pd
     df_super = df
     df_umod, df_mod = split_mod_and_unmod_peptides(df, **kwargs)
     col_no = "no. [TT]"
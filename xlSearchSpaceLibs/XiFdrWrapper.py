@@ -4,6 +4,11 @@ import time
 import logging
 import datetime
 
+try:
+    from xlSearchSpaceLibs import instrumentation
+except ImportError:
+    import instrumentation
+
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
@@ -78,20 +83,22 @@ class XiFdrWrapper:
                                                        additional_xifdr_arguments, xifdr_filename=xifdr_filename)
         logger.info("xiFDR arguments: {}".format(" ".join(map(str, xifdr_cmd))))
         # # # # #
-        process = subprocess.Popen(xifdr_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        # real time output of Xi messages
-        while True:
-            output = process.stdout.readline()
-            exit_code = process.poll()
-            if output == '' and exit_code is not None:
-                break
-            if output:
-                # print output.strip()
-                logger.debug("xiFDR: " + output.strip())
-        if exit_code != 0:  # if process exit code is non zero
-            raise subprocess.CalledProcessError(exit_code, " ".join(xifdr_cmd))
-        logger.info("xiFDR execution took {} for cmd: {}"
-                      .format(calculate_elapsed_time(starttime), xifdr_cmd))
+        with instrumentation.span("xifdr_execution", input_files=xifdr_input_csv, memory=memory) as s:
+            process = subprocess.Popen(xifdr_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            # real time output of Xi messages
+            while True:
+                output = process.stdout.readline()
+                exit_code = process.poll()
+                if output == '' and exit_code is not None:
+                    break
+                if output:
+                    # print output.strip()
+                    logger.debug("xiFDR: " + output.strip())
+            if exit_code != 0:  # if process exit code is non zero
+                raise subprocess.CalledProcessError(exit_code, " ".join(xifdr_cmd))
+            logger.info("xiFDR execution took {} for cmd: {}"
+                          .format(calculate_elapsed_time(starttime), xifdr_cmd))
+            s.output_files.append(xifdr_output_dir)
         # read filenames from result dir
         for rel_dir, sub_dirs, files in os.walk(xifdr_output_dir):
             list_of_results = [os.path.join(rel_dir, f) for f in files]
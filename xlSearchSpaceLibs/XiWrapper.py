@@ -6,6 +6,13 @@ import logging
 import time
 import datetime
 
+try:
+    from xlSearchSpaceLibs import instrumentation
+    from xlSearchSpaceLibs import memory_monitor
+except ImportError:
+    import instrumentation
+    import memory_monitor
+
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
@@ -106,7 +113,8 @@ class XiWrapper:
     @staticmethod
     def xi_execution(xi_config, peak_files, fasta_files, memory=None, output_file="xi_results",
                      additional_parameters=list(),
-                     xi_path="XiSearch.jar"):
+                     xi_path="XiSearch.jar", memory_monitor_interval=None, memory_warn_fraction=0.9,
+                     memory_abort_fraction=None):
         """
         Calls Xi and gives back Xi result filepath
         Xi gives back a single csv file
@@ -124,6 +132,13 @@ class XiWrapper:
         :param output_file: string
         :param additional_parameters: list of strings, optional
         :param xi_path: path to xisearch jar file, optional
+        :param memory_monitor_interval: seconds between memory samples of the Xi process, written to
+            output_file_memory.csv, i.e. 10. None (default) disables the monitor
+        :param memory_warn_fraction: warn when this fraction of memory is used or predicted to be reached soon
+        :param memory_abort_fraction: kill Xi early and raise XiSearchOutOfMemoryException when this fraction of
+            the heap is used or the trend of the heap after garbage collections predicts exhaustion within 5 minutes,
+            None disables aborting. Needs memory_monitor_interval, heap usage is read with jstat, without it memory
+            is only recorded
         :return: string: output_file.csv
         """
         assert type(peak_files) == type(fasta_files) == type(additional_parameters) == list, \
@@ -156,27 +171,48 @@ class XiWrapper:
         # call xi
         starttime = time.time()
         logger.info("XiSearch cmd: {}".format(" ".join(map(str, xi_cmd))))
-        process = subprocess.Popen(xi_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        # real time output of Xi messages
-        while True:
-            output = process.stdout.readline()
-            exit_code = process.poll()
-            if output == '' and exit_code is not None:
-                break
-            elif output:
-                # print output.strip()
-                logger.debug("XiSearch: " + output.strip())
-                if "java.lang.OutOfMemoryError" in output:
-                    process.kill()
-                    raise XiSearchOutOfMemoryException(returncode=1, cmd=xi_cmd, out_file=output_file, output=output)
-                elif "could not daemonise BufferedResultWriter_batchforward" in output:
-                    process.kill()
-                    raise XiSearchDaemoniseFailureException(
-                        returncode=1, cmd=xi_cmd, out_file=output_file, output=output
+        with instrumentation.span("xi_execution", input_files=peak_files + fasta_files, memory=memory) as s:
+            process = subprocess.Popen(xi_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            monitor = None
+            if memory_monitor_interval:
+                monitor = memory_monitor.MemoryMonitor(
+                    process, memory_monitor.parse_memory(memory), interval=memory_monitor_interval,
+                    samples_file=os.path.splitext(output_file)[0] + "_memory.csv",
+                    warn_fraction=memory_warn_fraction, abort_fraction=memory_abort_fraction)
+                monitor.start()
+            try:
+                # real time output of Xi messages
+                while True:
+                    output = process.stdout.readline()
+                    exit_code = process.poll()
+                    if output == '' and exit_code is not None:
+                        break
+                    elif output:
+                        # print output.strip()
+                        logger.debug("XiSearch: " + output.strip())
+                        if "java.lang.OutOfMemoryError" in output:
+                            process.kill()
+                            raise XiSearchOutOfMemoryException(returncode=1, cmd=xi_cmd, out_file=output_file,
+                                                               output=output)
+                        elif "could not daemonise BufferedResultWriter_batchforward" in output:
+                            process.kill()
+                            raise XiSearchDaemoniseFailureException(
+                                returncode=1, cmd=xi_cmd, out_file=output_file, output=output
+                            )
+            finally:
+                # the monitor thread must not outlive the search, also if it failed
+                if monitor:
+                    monitor.stop()
+            if monitor:
+                s.attributes["peak_rss_bytes"] = monitor.peak()
+                if monitor.abort_reason:
+                    raise XiSearchOutOfMemoryException(
+                        returncode=1, cmd=xi_cmd, out_file=output_file, output=monitor.abort_reason
                     )
 
-        if exit_code != 0:  # if process exit code is non zero
-            raise XiSearchException(exit_code, xi_cmd, output_file, 'XiSearch exited with error message!')
-        logger.info("XiSearch execution took {} for cmd: {}"
-                    .format(XiWrapper.calculate_elapsed_time(starttime), xi_cmd))
+            if exit_code != 0:  # if process exit code is non zero
+                raise XiSearchException(exit_code, xi_cmd, output_file, 'XiSearch exited with error message!')
+            logger.info("XiSearch execution took {} for cmd: {}"
+                        .format(XiWrapper.calculate_elapsed_time(starttime), xi_cmd))
+            s.output_files.append(output_file)
         return output_file
@@ -1 +1,28 @@
- 
+"""
+Libraries for the iBAQ based selection of crosslink search spaces.
+
+Importing the package loads no submodule. On python 3.7+ submodules are imported on first attribute access,
+i.e. xlSearchSpaceLibs.fasta_index, on python 2 they are imported explicitly: from xlSearchSpaceLibs import fasta_index
+
+Heavy optional dependencies (pandas, matplotlib, pyteomics) are imported by the functions that use them where the
+rest of a module does without, see benchmarks.runner import_light.
+"""
+import importlib
+
+__all__ = [
+    "FDR_funcs", "XiFdrWrapper", "XiWrapper", "adaptive_sampling", "exp_specific", "experiment_keys", "fasta_index",
+    "file_discovery", "iBAQ_FASTA_handler", "incremental_aggregation", "instrumentation", "list_files",
+    "memory_monitor", "mgf_utils", "peak_sharding", "pipeline", "quantile_sketch", "search_space_estimation",
+    "spectrum_store", "sweep", "xi_result_merging", "xi_sharding", "xifdr_reevaluation",
+    "xifdr_result_reading",
+]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,134 @@
+"""
+Adaptive choice of the database sizes to search instead of an exhaustive grid.
+
+AdaptiveSizeSampler evaluates a metric (i.e. the number of TT links or the minimum TT score after FDR) for a few
+database sizes and then bisects the intervals next to the best size found so far. Optionally it also bisects
+intervals in which the metric changes by more than a tolerance. For a unimodal curve over n candidate sizes this
+needs about 3 + 2 * log2(n) searches instead of n.
+
+The evaluation is usually a SearchSpaceSweep run for a single cutoff, see sweep_evaluator.
+"""
+import logging
+
+try:
+    from xlSearchSpaceLibs import xifdr_result_reading
+except ImportError:
+    import xifdr_result_reading
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+def tt_link_count(dict_of_files, link_type="between"):
+    """
+    mean number of TT links of link_type ('between' or 'internal') over all xiFDR summary files,
+    None if there are no files
+    """
+    counts = []
+    for files in dict_of_files.values():
+        for f in files:
+            df_between, df_internal = xifdr_result_reading.build_dfs_of_int_betw(f)
+            counts.append(len(df_between) if link_type == "between" else len(df_internal))
+    if not counts:
+        return None
+    return sum(counts) / float(len(counts))
+
+
+def min_tt_score(dict_of_files, link_type="between"):
+    """mean of the minimum TT scores of link_type over all replicates, from build_long_min_df"""
+    df_scores = xifdr_result_reading.scores_from_filedict(dict_of_files)
+    df_min = xifdr_result_reading.build_long_min_df(df_scores)
+    return df_min[df_min["link type"] == link_type]["Score"].mean()
+
+
+def failed(value):
+    """metric values of searches without result: None or nan"""
+    return value is None or value != value
+
+
+def sweep_evaluator(sweep, metric=tt_link_count):
+    """
+    :param sweep: sweep.SearchSpaceSweep, its cutoffs are replaced by the evaluated size
+    :param metric: function of the dict of result files returned by the sweep
+    :return: function that searches a database size and returns the metric
+    """
+    def evaluate(size):
+        sweep.cutoffs = [size]
+        return metric(sweep.run())
+    return evaluate
+
+
+class AdaptiveSizeSampler(object):
+    """
+    :param evaluate: function size -> metric value, the expensive search, None or nan if it failed. Failed sizes
+        are not evaluated again and not compared
+    :param sizes: candidate database sizes
+    :param maximize: whether the best size has the highest metric value, otherwise the lowest
+    :param tolerance: also bisect intervals whose metric changes by more than this, None to only refine the
+        interval around the best size
+    :param max_evaluations: maximum number of evaluations, None for no limit
+    """
+    def __init__(self, evaluate, sizes, maximize=True, tolerance=None, max_evaluations=None):
+        self.evaluate = evaluate
+        self.sizes = sorted(set(sizes))
+        self.maximize = maximize
+        self.tolerance = tolerance
+        self.max_evaluations = max_evaluations
+        self.results = {}
+
+    def value(self, size):
+        if size not in self.results:
+            self.results[size] = self.evaluate(size)
+            if failed(self.results[size]):
+                logger.warning("database size {} gave no result".format(size))
+            logger.info("database size {}: {} ({} of {} sizes evaluated)"
+                        .format(size, self.results[size], len(self.results), len(self.sizes)))
+        return self.results[size]
+
+    def best_size(self):
+        """:return: best size of the sizes that did not fail, None if there are none"""
+        valid = [size for size in self.results if not failed(self.results[size])]
+        if not valid:
+            return None
+        pick = max if self.maximize else min
+        return pick(valid, key=lambda size: (self.results[size], -size if self.maximize else size))
+
+    def next_size(self):
+        """:return: the next size to evaluate, None when done"""
+        indices = [i for i, size in enumerate(self.sizes) if size in self.results and not failed(self.results[size])]
+        for i in (0, len(self.sizes) - 1, (len(self.sizes) - 1) // 2):
+            if self.sizes[i] not in self.results:
+                return self.sizes[i]
+        if self.best_size() is None:
+            # all evaluated sizes failed, try the remaining one closest to the middle
+            pending = [k for k, size in enumerate(self.sizes) if size not in self.results]
+            if not pending:
+                return None
+            return self.sizes[min(pending, key=lambda k: abs(k - (len(self.sizes) - 1) // 2))]
+        best = self.sizes.index(self.best_size())
+        candidates = []
+        for i, j in zip(indices[:-1], indices[1:]):
+            # sizes between two valid ones that are not evaluated yet, failed ones are skipped
+            pending = [k for k in range(i + 1, j) if self.sizes[k] not in self.results]
+            if not pending:
+                continue
+            change = abs(self.results[self.sizes[j]] - self.results[self.sizes[i]])
+            next_to_best = best in (i, j)
+            if next_to_best or (self.tolerance is not None and change > self.tolerance):
+                candidates.append(((next_to_best, change, j - i), min(pending, key=lambda k: abs(k - (i + j) // 2))))
+        if not candidates:
+            return None
+        return self.sizes[max(candidates)[1]]
+
+    def run(self):
+        """
+        evaluates sizes until the best size is bracketed by evaluated neighbours or the budget is used up
+
+        :return: tuple (best size, dict size -> metric value of all evaluated sizes)
+        """
+        while self.max_evaluations is None or len(self.results) < self.max_evaluations:
+            size = self.next_size()
+            if size is None:
+                break
+            self.value(size)
+        return self.best_size(), dict(self.results)
@@ -1,4 +1,7 @@
-import re
+try:
+    from xlSearchSpaceLibs import experiment_keys
+except ImportError:
+    import experiment_keys
 
 
 def pretty_up_sample_name(smpl_str):
@@ -8,8 +11,9 @@ def pretty_up_sample_name(smpl_str):
     :param smpl_str:
     :return:
     """
-    lst_nos = re.findall(r"(\d+)", smpl_str)
-    tit = "fraction " + str(int(lst_nos.pop(0)))
-    if lst_nos:
-        tit += " to " + str(int(lst_nos.pop()))
-    return tit
+    return experiment_keys.parse_fraction_key(smpl_str)["fraction"]
+
+
+def pretty_up_sample_names(smpl_strs):
+    """pretty_up_sample_name for a Series of sample names, each unique name is parsed once"""
+    return experiment_keys.map_unique(smpl_strs, pretty_up_sample_name)
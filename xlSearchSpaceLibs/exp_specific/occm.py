@@ -5,8 +5,14 @@
 """
 
 import os
+import numpy as np
 import pandas as pd
 
+try:
+    from xlSearchSpaceLibs import fasta_index
+except ImportError:
+    import fasta_index
+
 g_dct_occm_gene_to_uniprot = {
     'ORC1': 'P54784',
     'ORC2': 'P32833',
@@ -26,39 +32,54 @@ g_dct_occm_gene_to_uniprot = {
 
 
 def occm_dict_from_fasta(fasta):
+    """gene name (the entry name without species suffix) -> uniprot accession, from the headers of fasta"""
     dct_gene_uniprot_id = dict()
-    with open(fasta) as f:
-        for l in f.readlines():
-            if l.startswith(">"):
-                _, uniprot_id, fasta_desc = l.split("|")
-                # gene = fasta_desc.split("GN=")[-1].split(" ")[0]
-                gene = fasta_desc.split("_")[0]
-                if gene not in dct_gene_uniprot_id:
-                    dct_gene_uniprot_id[gene] = uniprot_id
-                else:
-                    raise AttributeError("'{}' appears more than once in input fasta!")
+    for record in fasta_index.FastaHeaderIndex(fasta).records:
+        # gene = record.gene
+        gene = record.entry_name.split("_")[0]
+        if gene not in dct_gene_uniprot_id:
+            dct_gene_uniprot_id[gene] = record.accession
+        else:
+            raise AttributeError("'{}' appears more than once in input fasta!".format(gene))
     return dct_gene_uniprot_id
 
 # f = r"/home/henning/mnt/xitu/Data/Input/170322_OCCM_random_DB_test/fastas/occm_scerevisiae-180726/uniprot-yourlist%252525252525253AM201807268A530B6CA0138AFAA6D2B97CE8C2A92422BAE7U.fasta"
 
 
-def rename_proteins(df_xifdr, dct_gene_uniprot=g_dct_occm_gene_to_uniprot):
-    def rename_protein(protein_entry):
-        p_ret = ""
-        for i, p in enumerate(protein_entry.split(";")):
-            if i > 0:
-                p_ret += ";"
-            p = p.upper()
-            if "DECOY:" in p:
-                p = p.split("DECOY:")[-1]
-                p_ret += "DECOY:"
-            if p in dct_gene_uniprot:
-                p = dct_gene_uniprot[p]
-            p_ret += p
-        return p_ret
+def rename_protein_entry(protein_entry, dct_gene_uniprot=g_dct_occm_gene_to_uniprot):
+    """renames each ';' separated protein of an entry, keeps 'DECOY:' prefixes"""
+    p_ret = ""
+    for i, p in enumerate(protein_entry.split(";")):
+        if i > 0:
+            p_ret += ";"
+        p = p.upper()
+        if "DECOY:" in p:
+            p = p.split("DECOY:")[-1]
+            p_ret += "DECOY:"
+        if p in dct_gene_uniprot:
+            p = dct_gene_uniprot[p]
+        p_ret += p
+    return p_ret
+
 
+def rename_protein_series(series, dct_gene_uniprot=g_dct_occm_gene_to_uniprot):
+    """
+    renames every unique entry of series once and expands the result back to the full length,
+    missing values stay missing
+    """
+    codes, uniques = pd.factorize(series)
+    renamed = np.array([rename_protein_entry(u, dct_gene_uniprot) for u in uniques] + [np.nan], dtype=object)
+    # code -1 of missing values takes the trailing nan
+    return pd.Series(renamed.take(codes), index=series.index, name=series.name)
+
+
+def rename_proteins(df_xifdr, dct_gene_uniprot=g_dct_occm_gene_to_uniprot):
+    """
+    replaces gene names in Protein1 and Protein2 by the accessions in dct_gene_uniprot,
+    i.e. g_dct_occm_gene_to_uniprot or a dict from occm_dict_from_fasta
+    """
     for c in ["Protein1", "Protein2"]:
-        df_xifdr[c] = df_xifdr[c].map(rename_protein)
+        df_xifdr[c] = rename_protein_series(df_xifdr[c], dct_gene_uniprot)
     return df_xifdr
 
 
@@ -0,0 +1,103 @@
+"""
+Parse experiment keys once per unique key.
+
+Long format score frames repeat a handful of keys like 'db_100_random_200' or 'fr_03_to_06' millions of times.
+key_columns factorizes the keys (or takes the codes of a categorical), parses every unique key once and broadcasts
+the parsed fields to all rows as typed columns. The parsers are memoized across calls.
+
+db keys as written by sweep.db_key: 'db_<selected proteins>_random_<random proteins>'
+fraction keys: 'fr_03_to_06' or 'fr_03', any key whose numbers are the first and last fraction
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+
+def memoize(parser):
+    cache = {}
+
+    def memoized(key):
+        if key not in cache:
+            cache[key] = parser(key)
+        return cache[key]
+    memoized.__name__ = parser.__name__
+    memoized.__doc__ = parser.__doc__
+    memoized.cache = cache
+    return memoized
+
+
+@memoize
+def parse_db_key(key):
+    """:return: dict of the fields of a db key"""
+    _, n1, _, n2 = key.split("_")
+    return {
+        "selected proteins": int(n1),
+        "random proteins": int(n2),
+        "DB composition": n1 + "\n" + n2,
+        "total DB size": int(n1) + int(n2),
+        "sort key": float(n1) + float(n2) / 10000,
+    }
+
+
+@memoize
+def parse_fraction_key(key):
+    """:return: dict of the fields of a fraction key, 'fr_03_to_06' is 'fraction 3 to 6'"""
+    numbers = [int(n) for n in re.findall(r"(\d+)", key)]
+    fraction = "fraction " + str(numbers[0])
+    if len(numbers) > 1:
+        fraction += " to " + str(numbers[-1])
+    return {
+        "first fraction": numbers[0],
+        "last fraction": numbers[-1],
+        "fraction": fraction,
+        "sort key": numbers[0] + numbers[-1] / 10000.,
+    }
+
+
+def factorize(keys):
+    """:return: tuple (integer codes, unique keys), the categories of a categorical are used as they are"""
+    if isinstance(keys, pd.Series) and hasattr(keys, "cat"):
+        return keys.cat.codes.values, list(keys.cat.categories)
+    codes, uniques = pd.factorize(np.asarray(keys, dtype=object))
+    return codes, list(uniques)
+
+
+def map_unique(keys, func):
+    """Series.map that calls func once per unique key, missing keys stay missing"""
+    codes, uniques = factorize(keys)
+    values = pd.Series([func(k) for k in uniques] + [np.nan])
+    index = keys.index if isinstance(keys, pd.Series) else None
+    return pd.Series(values.values[codes], index=index)
+
+
+def key_columns(keys, parser=parse_db_key, columns=None):
+    """
+    :param keys: Series or sequence of experiment keys, categoricals are not converted
+    :param parser: function key -> dict of fields, i.e. parse_db_key or parse_fraction_key
+    :param columns: fields to return, all by default
+    :return: DataFrame with the index of keys and one column per field, plus 'sort order', the rank of the key by
+        its 'sort key' field if there is one
+    """
+    codes, uniques = factorize(keys)
+    index = keys.index if isinstance(keys, pd.Series) else pd.RangeIndex(len(codes))
+    if not uniques:
+        # no key to parse, the requested columns stay empty
+        return pd.DataFrame(index=index, columns=list(columns) if columns is not None else [])
+    parsed = pd.DataFrame([parser(k) for k in uniques])
+    if "sort key" in parsed:
+        parsed["sort order"] = parsed["sort key"].rank(method="dense").astype(np.int64) - 1
+    if columns is not None:
+        parsed = parsed[list(columns)]
+    if (codes >= 0).all():
+        df = parsed.iloc[codes]
+    else:
+        # rows without key get missing values
+        df = parsed.reindex(np.where(codes >= 0, codes, len(parsed)))
+    df.index = index
+    return df
+
+
+def sorted_keys(keys, parser=parse_db_key):
+    """:return: list of unique keys in order of their 'sort key'"""
+    return sorted(set(keys), key=lambda k: parser(k)["sort key"])
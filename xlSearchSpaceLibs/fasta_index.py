@@ -0,0 +1,191 @@
+"""
+Header only index of FASTA files.
+
+The file is memory mapped and scanned for '\n>' so the sequence blocks are skipped without being split into lines.
+For every entry the index keeps its byte offset and length, the header and the fields of UniProt style headers:
+
+>sp|P54784|ORC1_YEAST Origin recognition complex subunit 1 OS=Saccharomyces cerevisiae OX=559292 GN=ORC1 PE=1 SV=2
+    accession P54784, entry name ORC1_YEAST, gene ORC1, organism Saccharomyces cerevisiae
+
+The index is cached in a tab separated file next to the FASTA (<fasta>.idx.tsv), valid as long as size and mtime of
+the FASTA are unchanged. Sequences are read on demand from a memory map of the FASTA that the index opens on the
+first read and keeps until close().
+"""
+import io
+import logging
+import mmap
+import os
+import re
+from collections import namedtuple
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    # python 2
+    from collections import Mapping
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+FastaRecord = namedtuple("FastaRecord", ["offset", "length", "accession", "entry_name", "gene", "organism", "header"])
+
+g_uniprot_header_regex = re.compile(r"^(\w+)\|([^|\s]+)\|(\S+)")
+g_gene_regex = re.compile(r"\bGN=(\S+)")
+g_organism_regex = re.compile(r"\bOS=(.*?)(?=\s+[A-Z]{2}=|$)")
+
+
+def parse_header(header):
+    """:return: tuple (accession, entry name, gene, organism) of a header without '>', empty strings if missing"""
+    match = g_uniprot_header_regex.match(header)
+    if match:
+        accession, entry_name = match.group(2), match.group(3)
+    else:
+        accession = header.split()[0] if header.split() else ""
+        entry_name = ""
+    gene = g_gene_regex.search(header)
+    organism = g_organism_regex.search(header)
+    return accession, entry_name, gene.group(1) if gene else "", organism.group(1) if organism else ""
+
+
+def scan_headers(fasta_filename):
+    """:return: list of FastaRecord of all entries in file order"""
+    records = []
+    size = os.path.getsize(fasta_filename)
+    if size == 0:
+        return records
+    with open(fasta_filename, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if mm[:1] == b">":
+                pos = 0
+            else:
+                pos = mm.find(b"\n>")
+                pos = pos + 1 if pos != -1 else -1
+            while pos != -1:
+                eol = mm.find(b"\n", pos)
+                if eol == -1:
+                    eol = size
+                header = mm[pos + 1:eol].rstrip(b"\r").decode("utf-8", "replace")
+                next_header = mm.find(b"\n>", eol)
+                end = next_header + 1 if next_header != -1 else size
+                records.append(FastaRecord(pos, end - pos, *(parse_header(header) + (header,))))
+                pos = end if next_header != -1 else -1
+        finally:
+            mm.close()
+    return records
+
+
+class FastaHeaderIndex(object):
+    """
+    :param fasta_filename: FASTA file
+    :param cache_file: tab separated cache of the index, defaults to <fasta_filename>.idx.tsv, False disables it
+    """
+    version = 1
+    columns = FastaRecord._fields
+
+    def __init__(self, fasta_filename, cache_file=None):
+        self.filename = fasta_filename
+        self.cache_file = fasta_filename + ".idx.tsv" if cache_file is None else cache_file
+        self.records = self.load()
+        self._mmap = None
+
+    def __getstate__(self):
+        # memory maps can not be pickled, a copy maps the file again on its first read
+        state = dict(self.__dict__)
+        state["_mmap"] = None
+        return state
+
+    def close(self):
+        """closes the memory map of the FASTA, it is opened again by the next read"""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def signature(self):
+        stat = os.stat(self.filename)
+        return "# version={} size={} mtime={!r}".format(self.version, stat.st_size, stat.st_mtime)
+
+    def load(self):
+        signature = self.signature()
+        if self.cache_file and os.path.exists(self.cache_file):
+            with io.open(self.cache_file, encoding="utf-8") as f:
+                if f.readline().rstrip("\n") == signature:
+                    f.readline()
+                    records = []
+                    for line in f:
+                        fields = line.rstrip("\n").split("\t")
+                        records.append(FastaRecord(int(fields[0]), int(fields[1]), *fields[2:]))
+                    return records
+        records = scan_headers(self.filename)
+        if self.cache_file:
+            try:
+                self.write(records, signature)
+            except (IOError, OSError) as e:
+                logger.debug("could not write fasta index cache {}: {}".format(self.cache_file, e))
+        return records
+
+    def write(self, records, signature):
+        with io.open(self.cache_file + ".part", "w", encoding="utf-8") as f:
+            f.write(u"{}\n{}\n".format(signature, "\t".join(self.columns)))
+            for r in records:
+                f.write(u"\t".join([str(r.offset), str(r.length)] + [v.replace(u"\t", u" ") for v in r[2:]]) + u"\n")
+        if os.path.exists(self.cache_file):
+            os.remove(self.cache_file)
+        os.rename(self.cache_file + ".part", self.cache_file)
+
+    def __len__(self):
+        return len(self.records)
+
+    def ids(self, re_id_pattern):
+        """
+        :param re_id_pattern: regex with one group applied to the header line including '>', as in FastaHandler
+        :return: list of (id, record), first occurrence of each id, and list of duplicate ids
+        """
+        regex = re.compile(re_id_pattern)
+        seen = set()
+        unique = []
+        duplicates = []
+        for r in self.records:
+            match = regex.match(">" + r.header)
+            if not match:
+                continue
+            protein_id = match.group(1)
+            if protein_id in seen:
+                duplicates.append(protein_id)
+            else:
+                seen.add(protein_id)
+                unique.append((protein_id, r))
+        return unique, duplicates
+
+    def data(self):
+        """:return: read only memory map of the FASTA, shared by all reads"""
+        if self._mmap is None:
+            with open(self.filename, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def sequence(self, record):
+        """reads the sequence of a record from the FASTA"""
+        block = self.data()[record.offset:record.offset + record.length]
+        lines = block.decode("utf-8", "replace").splitlines()
+        return "".join(l.strip() for l in lines[1:])
+
+
+class LazySequenceDict(Mapping):
+    """read only dict id -> sequence that reads the sequences from the FASTA on access"""
+    def __init__(self, index, re_id_pattern):
+        self.index = index
+        unique, self.duplicates = index.ids(re_id_pattern)
+        self.records = dict(unique)
+
+    def __getitem__(self, protein_id):
+        return self.index.sequence(self.records[protein_id])
+
+    def __contains__(self, protein_id):
+        return protein_id in self.records
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
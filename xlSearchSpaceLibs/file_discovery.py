@@ -0,0 +1,156 @@
+"""
+Fast recursive file discovery for large (network mounted) result trees.
+
+Directories are listed with os.scandir, level by level with a pool of threads, so the latency of a network file
+system is paid once per level instead of once per directory. Subtrees can be pruned before they are listed with a
+glob of the relative directory path (dir_glob="*/xifdr_output" only enters the second level directories called
+xifdr_output) and a regex on directory names (skip_dir_regex).
+
+With a cache_file the listings are kept on disk. A directory whose mtime did not change since it was cached is not
+listed again, so repeated discovery over an unchanged tree costs one stat per directory.
+"""
+import fnmatch
+import json
+import logging
+import os
+import re
+from multiprocessing.pool import ThreadPool
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        # backport for python 2
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+def list_dir(path):
+    """
+    :return: tuple (list of subdirectory names, list of file names), symlinked directories are not followed
+    like os.walk does by default
+    """
+    dirs = []
+    files = []
+    if scandir is not None:
+        for entry in scandir(path):
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(entry.name)
+            elif not entry.is_dir():
+                files.append(entry.name)
+    else:
+        for name in os.listdir(path):
+            full = os.path.join(path, name)
+            if os.path.isdir(full):
+                if not os.path.islink(full):
+                    dirs.append(name)
+            else:
+                files.append(name)
+    return sorted(dirs), sorted(files)
+
+
+def glob_prefix_match(rel_parts, glob_parts):
+    """whether a directory with relative path parts can contain paths matching the glob"""
+    for part, pattern in zip(rel_parts, glob_parts):
+        if not fnmatch.fnmatchcase(part, pattern):
+            return False
+    return True
+
+
+class ListingCache(object):
+    """directory listings by relative path, valid as long as the directory mtime is unchanged"""
+    version = 1
+
+    def __init__(self, cache_file, location):
+        self.cache_file = cache_file
+        self.location = os.path.abspath(location)
+        self.listings = {}
+        self.changed = False
+        if cache_file and os.path.exists(cache_file):
+            try:
+                with open(cache_file) as f:
+                    data = json.load(f)
+                if data.get("version") == self.version and data.get("location") == self.location:
+                    self.listings = data["listings"]
+            except ValueError:
+                logger.warning("ignoring unreadable listing cache {}".format(cache_file))
+
+    def listing(self, path, rel_path):
+        """:return: tuple (dirs, files, whether the listing came from the cache)"""
+        mtime = os.stat(path).st_mtime
+        cached = self.listings.get(rel_path)
+        if cached is not None and cached["mtime"] == mtime:
+            return cached["dirs"], cached["files"], True
+        dirs, files = list_dir(path)
+        self.listings[rel_path] = {"mtime": mtime, "dirs": dirs, "files": files}
+        self.changed = True
+        return dirs, files, False
+
+    def save(self):
+        if not self.cache_file or not self.changed:
+            return
+        with open(self.cache_file + ".part", "w") as f:
+            json.dump({"version": self.version, "location": self.location, "listings": self.listings}, f)
+        if os.path.exists(self.cache_file):
+            os.remove(self.cache_file)
+        os.rename(self.cache_file + ".part", self.cache_file)
+
+
+def discover_files(location, file_regex=None, match_full_path=True, dir_glob=None, skip_dir_regex=None, nthr=8,
+                   cache_file=None):
+    """
+    searches location recursively for files
+
+    :param location: base dir from where to search recursively
+    :param file_regex: regex that files have to match, None matches all files
+    :param match_full_path: match file_regex against the full path like list_files, otherwise against the file name
+    :param dir_glob: glob of the relative directory path, subtrees that can not match it are not entered
+    :param skip_dir_regex: regex, directories with matching names are not entered
+    :param nthr: number of threads listing directories concurrently
+    :param cache_file: json file to keep the directory listings in, optional
+    :return: sorted list of file paths, joined to location like os.walk does
+    """
+    regex = re.compile(file_regex) if file_regex else None
+    skip_regex = re.compile(skip_dir_regex) if skip_dir_regex else None
+    glob_parts = dir_glob.strip("/").split("/") if dir_glob else []
+    cache = ListingCache(cache_file, location)
+    found = []
+    n_dirs = 0
+    n_cached = 0
+    pool = ThreadPool(nthr) if nthr > 1 else None
+
+    def list_one(rel_parts):
+        path = os.path.join(location, *rel_parts)
+        return rel_parts, path, cache.listing(path, "/".join(rel_parts))
+
+    try:
+        frontier = [()]
+        while frontier:
+            listings = pool.map(list_one, frontier) if pool else [list_one(rel) for rel in frontier]
+            frontier = []
+            for rel_parts, path, (dirs, files, from_cache) in listings:
+                n_dirs += 1
+                n_cached += from_cache
+                if len(rel_parts) >= len(glob_parts) or not glob_parts:
+                    for f in files:
+                        f_full = os.path.join(path, f)
+                        if regex is None or regex.match(f_full if match_full_path else f):
+                            found.append(f_full)
+                for d in dirs:
+                    if skip_regex and skip_regex.match(d):
+                        continue
+                    if not glob_prefix_match(rel_parts + (d,), glob_parts):
+                        continue
+                    frontier.append(rel_parts + (d,))
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    cache.save()
+    logger.debug("listed {} directories of '{}', {} from cache, found {} files"
+                 .format(n_dirs, location, n_cached, len(found)))
+    return sorted(found)
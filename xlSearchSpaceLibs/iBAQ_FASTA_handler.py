@@ -1,10 +1,18 @@
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import logging
+import json
 import re
 import os
 
+try:
+    from xlSearchSpaceLibs import fasta_index
+    from xlSearchSpaceLibs import instrumentation
+    from xlSearchSpaceLibs import search_space_estimation
+except ImportError:
+    import fasta_index
+    import instrumentation
+    import search_space_estimation
+
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
@@ -28,6 +36,8 @@ class IbaqExtraction:
         # read MaxQuant result file with protein ID as index
         allowed_indices = ['Protein IDs', 'Majority protein IDs']
         assert index in allowed_indices, "index needs to be in {} but is {}".format(allowed_indices, index)
+        # pandas and matplotlib are imported on use, the FastaHandler of short-lived workers does not need them
+        import pandas as pd
         raw_file = pd.read_table(self.filename)
         raw_file.index = raw_file[index]
         raw_file[['Potential contaminant', "Reverse"]] = raw_file[['Potential contaminant', "Reverse"]].astype(str)
@@ -105,6 +115,7 @@ class IbaqExtraction:
 
     def visualization(self):
         """histogram comparison of the different preprocessed iBAQ intensities"""
+        import matplotlib.pyplot as plt
         bins = 100
         vals = self.results['normIBAQ'].dropna()
         logvals = self.results[self.results['normlogIBAQ'] >= 0]['normlogIBAQ']
@@ -155,6 +166,7 @@ class IbaqExtraction:
 
 class mq_Evidence:
     def __init__(self, filename):
+        import pandas as pd
         self.filename = filename
         self.df_evidence = pd.read_table(self.filename)
 
@@ -207,7 +219,7 @@ class mq_Evidence:
         # keep only nonzero values
         df_intensity_self_calc = df_intensity_self_calc.iloc[df_intensity_self_calc.nonzero()]
         # series to df
-        df_intensity_self_calc = pd.DataFrame(df_intensity_self_calc)
+        df_intensity_self_calc = df_intensity_self_calc.to_frame()
         return df_intensity_self_calc
 
     def extract_psm_count(self, raw_file=""):
@@ -227,14 +239,30 @@ class mq_Evidence:
         # keep only nonzero values
         df = df.iloc[df.nonzero()]
         # series to df
-        df = pd.DataFrame(df)
+        df = df.to_frame()
         return df
 
 
 class FastaHandler:
-    def __init__(self, fasta_filename, re_id_pattern=r'^>.*\|(.*)\|.*'):
+    def __init__(self, fasta_filename, re_id_pattern=r'^>.*\|(.*)\|.*', lazy=False):
+        """
+        :param lazy: only index the headers (cached next to the fasta) and read sequences when they are accessed
+        """
         self.filename = fasta_filename
-        self.dict = self.read_fasta(re_id_pattern)
+        if lazy:
+            self.dict = self.index_fasta(re_id_pattern)
+        else:
+            self.dict = self.read_fasta(re_id_pattern)
+
+    def index_fasta(self, re_id_pattern):
+        """dict-like object with protein id as key that reads the sequence from self.filename on access"""
+        dct_fasta = fasta_index.LazySequenceDict(fasta_index.FastaHeaderIndex(self.filename), re_id_pattern)
+        if len(dct_fasta) == 0:
+            raise ValueError("No proteins could be extracted from fasta with the given regular expression.")
+        if dct_fasta.duplicates:
+            msg = "Duplicates in fasta file '{}': \n{}".format(self.filename, dct_fasta.duplicates)
+            logging.warning(msg)
+        return dct_fasta
 
     def read_fasta(self, re_id_pattern):
         """read self.filename fasta file into a dict with protein id as key and its sequence as value"""
@@ -250,7 +278,7 @@ class FastaHandler:
                 protein_seq_regex_hit = protein_seq_regex.match(line)
                 if protein_id_regex_hit:
                     dict_key = protein_id_regex_hit.group(1)
-                    if dict_key not in dct_fasta.keys():
+                    if dict_key not in dct_fasta:
                         dct_fasta[dict_key] = ''
                         protein_not_in_mydict = True
                     else:
@@ -268,7 +296,16 @@ class FastaHandler:
             logging.warning(msg)
         return dct_fasta
 
-    def build_fasta(self, protein_id_list, filename, max_number=None):
+    def build_fasta(self, protein_id_list, filename, max_number=None, redundant_proteins=None, digest_kwargs=None):
+        """
+        writes the proteins of protein_id_list found in the reference to filename
+
+        :param redundant_proteins: None, 'drop' or 'collapse'. Proteins whose peptides are all covered by proteins
+            earlier in protein_id_list (higher iBAQ) are left out. 'collapse' lists them with the protein that
+            represents them in filename-protein_groups.tsv. The shrinkage of the digested peptides is written
+            to filename-redundancy.json
+        :param digest_kwargs: dict of arguments for search_space_estimation.find_redundant_proteins, i.e. enzyme
+        """
         bool_unfound_protein = False
         no_found_protein = 0
         path, filename_only = os.path.split(filename)
@@ -276,22 +313,45 @@ class FastaHandler:
             os.makedirs(path)
         filename_wo_ext, ext = os.path.splitext(filename_only)
         filename_not_found = os.path.join(path, filename_wo_ext + "-not_found_in_reference" + ext)
-        with open(filename_not_found, 'w+') as f_not_found:
-            f_not_found.write(r"# all the proteins not found in the reference fasta are listed here."+'\n')
-            with open(filename, 'w+') as f:
-                for protein_id in protein_id_list:
-                    if protein_id in self.dict.keys():
-                        f.write('>' + protein_id + '\n')
-                        f.write(self.dict[protein_id] + '\n')
-                        no_found_protein += 1
-                        if max_number:
-                            if no_found_protein == max_number:
-                                break
-                    else:
-                        f_not_found.write('>' + protein_id + '\n')
-                        bool_unfound_protein = True
-                        # msg = "protein ID '{}' not in fasta file '{}'".format(protein_id, self.filename)
-                        # print msg
+        redundant = {}
+        with instrumentation.span("build_fasta", input_files=[self.filename]) as s:
+            if redundant_proteins:
+                assert redundant_proteins in ("drop", "collapse"), \
+                    "redundant_proteins needs to be 'drop' or 'collapse' but is {}".format(redundant_proteins)
+                protein_id_list = list(protein_id_list)
+                # the pass stops at max_number kept proteins, later ones are neither digested nor written
+                redundant, stats = search_space_estimation.find_redundant_proteins(
+                    protein_id_list, self.dict, max_kept=max_number, **(digest_kwargs or {}))
+                with open(os.path.join(path, filename_wo_ext + "-redundancy.json"), 'w') as f:
+                    json.dump(stats, f, indent=2, sort_keys=True)
+                if redundant_proteins == "collapse":
+                    groups = {}
+                    for protein_id, representative in redundant.items():
+                        groups.setdefault(representative, []).append(protein_id)
+                    with open(os.path.join(path, filename_wo_ext + "-protein_groups.tsv"), 'w') as f:
+                        f.write("representative\tmembers\n")
+                        for representative in sorted(groups):
+                            f.write(representative + "\t" + ";".join(sorted(groups[representative])) + "\n")
+            with open(filename_not_found, 'w+') as f_not_found:
+                f_not_found.write(r"# all the proteins not found in the reference fasta are listed here."+'\n')
+                with open(filename, 'w+') as f:
+                    for protein_id in protein_id_list:
+                        if protein_id in redundant:
+                            continue
+                        if protein_id in self.dict:
+                            f.write('>' + protein_id + '\n')
+                            f.write(self.dict[protein_id] + '\n')
+                            no_found_protein += 1
+                            if max_number:
+                                if no_found_protein == max_number:
+                                    break
+                        else:
+                            f_not_found.write('>' + protein_id + '\n')
+                            bool_unfound_protein = True
+                            # msg = "protein ID '{}' not in fasta file '{}'".format(protein_id, self.filename)
+                            # print msg
+            s.output_files.append(filename)
+            s.attributes["proteins_written"] = no_found_protein
 
         if bool_unfound_protein:
             logging.warning("some of the specified proteins were not found in {0}, please check {1}"
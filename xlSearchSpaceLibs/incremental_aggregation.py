@@ -0,0 +1,186 @@
+"""
+Incremental aggregation of xiFDR result files.
+
+ResultAggregator keeps a summary per result file in a JSON state file, together with the size and mtime of the file
+it was made from. update() only reads files that are new or changed since the last update and drops files that are
+gone, so refreshing the summary of a growing sweep costs the new results plus a stat per file.
+
+Per file and link type (between/internal, see xifdr_result_reading.split_int_betw) the summary holds the minimum TT
+score, the number of TT links and a histogram of TT scores, per fdrGroup the numbers of TT, TD and DD. The report
+functions combine the summaries in the layouts of xifdr_result_reading, with replicates numbered in natural sort
+order of the files per experiment as in scores_from_filedict.
+"""
+import json
+import logging
+import os
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+try:
+    from xlSearchSpaceLibs import experiment_keys
+    from xlSearchSpaceLibs import list_files
+    from xlSearchSpaceLibs import xifdr_result_reading
+except ImportError:
+    import experiment_keys
+    import list_files
+    import xifdr_result_reading
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+g_link_types = ("between", "internal")
+
+
+def summarize_file(f, bin_width):
+    """:return: dict summary of a xiFDR result file with columns Score, isTT, isTD, isDD and fdrGroup"""
+    df = pd.read_csv(f, usecols=["Score", "isTT", "isTD", "isDD", "fdrGroup"])
+    summary = {"link types": {}, "fdr groups": {}}
+    for group, df_group in df.groupby("fdrGroup"):
+        summary["fdr groups"][group] = dict((t, int(df_group["is" + t].sum())) for t in ("TT", "TD", "DD"))
+    df_between, df_internal = xifdr_result_reading.split_int_betw(df[df["isTT"].astype(bool)])
+    for link_type, df_link in zip(g_link_types, (df_between, df_internal)):
+        scores = df_link["Score"].dropna().values
+        bins, counts = np.unique(np.floor(scores / bin_width).astype(np.int64), return_counts=True)
+        summary["link types"][link_type] = {
+            "TT": int(len(df_link)),
+            "min TT score": float(scores.min()) if len(scores) else None,
+            "histogram": dict((str(b), int(c)) for b, c in zip(bins.tolist(), counts.tolist())),
+        }
+    return summary
+
+
+class ResultAggregator(object):
+    """
+    :param state_file: JSON file with the summaries
+    :param exp_regex: experiment of a file, the closest directory matching it, see list_files.experiment_name
+    :param bin_width: width of the score histogram bins, a changed width resummarizes all files
+    """
+    version = 1
+
+    def __init__(self, state_file, exp_regex=r"db_\d+_random_\d+", level=1, bin_width=1.):
+        self.state_file = state_file
+        self.exp_regex = exp_regex
+        self.level = level
+        self.bin_width = bin_width
+        self.state = self.load()
+
+    def load(self):
+        if os.path.exists(self.state_file):
+            with open(self.state_file) as f:
+                state = json.load(f)
+            if state.get("version") == self.version and state.get("bin_width") == self.bin_width:
+                return state
+            logger.info("summaries of {} are outdated, all files are summarized again".format(self.state_file))
+        return {"version": self.version, "bin_width": self.bin_width, "files": {}}
+
+    def save(self):
+        """writes the state atomically"""
+        with open(self.state_file + ".part", "w") as f:
+            json.dump(self.state, f, sort_keys=True)
+        if os.path.exists(self.state_file):
+            os.remove(self.state_file)
+        os.rename(self.state_file + ".part", self.state_file)
+
+    def update(self, list_of_files, prune=True):
+        """
+        summarizes the new and changed files of list_of_files, i.e. from list_files.get_list_of_files, or of a dict
+        experiment -> list of files
+
+        :param prune: drop summaries of files that are not in list_of_files
+        :return: dict of statistics, numbers of new, changed, unchanged and removed files
+        """
+        if isinstance(list_of_files, dict):
+            list_of_files = [f for files in list_of_files.values() for f in files]
+        summaries = self.state["files"]
+        stats = {"new": 0, "changed": 0, "unchanged": 0, "removed": 0}
+        paths = set()
+        for f in list_of_files:
+            path = os.path.abspath(f)
+            paths.add(path)
+            stat = os.stat(path)
+            known = summaries.get(path)
+            if known and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime:
+                stats["unchanged"] += 1
+                continue
+            stats["changed" if known else "new"] += 1
+            summary = summarize_file(path, self.bin_width)
+            summary.update(size=stat.st_size, mtime=stat.st_mtime,
+                           experiment=list_files.experiment_name(path, self.level, self.exp_regex))
+            summaries[path] = summary
+        if prune:
+            for path in set(summaries) - paths:
+                del summaries[path]
+                stats["removed"] += 1
+        if stats["new"] or stats["changed"] or stats["removed"]:
+            self.save()
+        logger.info("updated summaries of {}: {}".format(self.state_file, stats))
+        return stats
+
+    def files_by_experiment(self):
+        """:return: dict experiment -> list of summarized files in natural sort order"""
+        groups = defaultdict(list)
+        for path, summary in self.state["files"].items():
+            groups[summary["experiment"]].append(path)
+        return dict((exp, sorted(files, key=list_files.natural_sort_key)) for exp, files in groups.items())
+
+    def _replicates(self):
+        """:return: generator of (experiment, replicate number, summary) in experiment order"""
+        groups = self.files_by_experiment()
+        for exp in sorted(groups, key=list_files.natural_sort_key):
+            for i, path in enumerate(groups[exp]):
+                yield exp, i + 1, self.state["files"][path]
+
+    def link_type_frame(self):
+        """:return: DataFrame with one row per file and link type: id, replicate, link type, TT, Score (minimum)"""
+        rows = []
+        for exp, replicate, summary in self._replicates():
+            for link_type, values in sorted(summary["link types"].items()):
+                rows.append((exp, replicate, link_type, values["TT"], values["min TT score"]))
+        return pd.DataFrame(rows, columns=["id", "replicate", "link type", "TT", "Score"])
+
+    def long_min_df(self, parser=experiment_keys.parse_db_key):
+        """
+        minimum TT scores in the layout of xifdr_result_reading.build_long_min_df
+
+        :param parser: adds 'DB composition' and 'total DB size' of the experiment keys, None to leave them out
+        """
+        df = self.link_type_frame().dropna(subset=["Score"])
+        df["variable"] = ["run {}: {} TT".format(r, t) for r, t in zip(df["replicate"], df["link type"])]
+        df = df[["id", "variable", "Score", "link type"]].reset_index(drop=True)
+        if parser is not None and len(df):
+            key_columns = experiment_keys.key_columns(df["id"], parser, ["DB composition", "total DB size"])
+            df["DB composition"] = key_columns["DB composition"]
+            df["total DB size"] = key_columns["total DB size"]
+        return df
+
+    def tt_counts(self):
+        """:return: DataFrame of the number of TT links, experiments as index, 'run <i>: <link type> TT' columns"""
+        df = self.link_type_frame()
+        df["variable"] = ["run {}: {} TT".format(r, t) for r, t in zip(df["replicate"], df["link type"])]
+        df = df.pivot(index="id", columns="variable", values="TT")
+        return df.reindex(sorted(df.index, key=list_files.natural_sort_key))
+
+    def fdr_per_group(self):
+        """:return: DataFrame with one row per file and fdrGroup: id, replicate, fdrGroup, TT, TD, DD, FDR"""
+        rows = []
+        for exp, replicate, summary in self._replicates():
+            for group, counts in sorted(summary["fdr groups"].items()):
+                rows.append((exp, replicate, group, counts["TT"], counts["TD"], counts["DD"]))
+        df = pd.DataFrame(rows, columns=["id", "replicate", "fdrGroup", "TT", "TD", "DD"])
+        # (TD - DD)/TT as FDR_funcs.calc_FDR
+        df["FDR"] = (df["TD"] - df["DD"]) / df["TT"].where(df["TT"] > 0).astype(float)
+        return df
+
+    def histograms(self, link_type="between"):
+        """:return: DataFrame of TT score counts summed over replicates, lower bin edges as index, experiments as columns"""
+        counts = defaultdict(lambda: defaultdict(int))
+        for exp, _, summary in self._replicates():
+            for b, c in summary["link types"][link_type]["histogram"].items():
+                counts[exp][int(b)] += c
+        df = pd.DataFrame(dict((exp, dict(c)) for exp, c in counts.items())).fillna(0).astype(np.int64)
+        df = df.sort_index()
+        df.index = df.index * self.bin_width
+        df.index.name = "Score"
+        return df[sorted(df.columns, key=list_files.natural_sort_key)]
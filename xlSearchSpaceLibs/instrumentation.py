@@ -0,0 +1,215 @@
+"""
+Span based instrumentation of the pipeline stages.
+
+A RunReport collects nested spans. Each span records wall time, the CPU time and peak RSS of finished child
+processes (resource.getrusage(RUSAGE_CHILDREN)), optionally the peak RSS of this process and its children sampled
+with psutil, and the byte counts of its input and output files.
+
+Library functions open spans with the module level span(), which records into the report that is active in the
+current thread and costs next to nothing without one:
+
+report = RunReport("execute_pipeline")
+with activate(report):
+    with span("xi_execution", input_files=peak_files) as s:
+        ...
+        s.output_files.append(result_file)
+report.write("run_report.json")
+
+The report must be activated in every thread that records into it. Spans nest per thread, spans opened in a
+thread without an open span of that thread are top level spans of the report. RUSAGE_CHILDREN is accounted per
+process, so the child CPU times of spans that run concurrently in several threads include each other's children.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # not available on windows
+    resource = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+g_thread_state = threading.local()
+
+
+def file_bytes(paths):
+    """sum of the sizes of existing files, directories are walked"""
+    total = 0
+    for path in paths:
+        if os.path.isdir(path):
+            for rel_dir, sub_dirs, files in os.walk(path):
+                total += sum(os.path.getsize(os.path.join(rel_dir, f)) for f in files)
+        elif os.path.isfile(path):
+            total += os.path.getsize(path)
+    return total
+
+
+def children_usage():
+    """:return: dict with user and system CPU seconds and max RSS in kB of all finished child processes"""
+    if resource is None:
+        return {"cpu_user_seconds": None, "cpu_system_seconds": None, "maxrss_kb": None}
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {"cpu_user_seconds": usage.ru_utime, "cpu_system_seconds": usage.ru_stime, "maxrss_kb": usage.ru_maxrss}
+
+
+class RssSampler(threading.Thread):
+    """samples the RSS of this process plus all its children with psutil and keeps the peak"""
+    def __init__(self, interval=1.):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interval = interval
+        self.peak_rss_kb = 0
+        self.stopped = threading.Event()
+
+    def sample(self):
+        process = psutil.Process()
+        rss = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                rss += child.memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+        self.peak_rss_kb = max(self.peak_rss_kb, rss // 1024)
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.sample()
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class Span(object):
+    def __init__(self, name, input_files=(), attributes=None):
+        self.name = name
+        self.input_files = list(input_files)
+        self.output_files = []
+        self.attributes = attributes or {}
+        self.children = []
+        self.start = None
+        self.wall_seconds = None
+        self.usage_start = None
+        self.usage = {}
+        self.sampler = None
+        self.error = None
+
+    def open(self, sample_interval=None):
+        self.start = time.time()
+        self.usage_start = children_usage()
+        if sample_interval and psutil is not None:
+            self.sampler = RssSampler(sample_interval)
+            self.sampler.start()
+
+    def close(self, error=None):
+        self.wall_seconds = time.time() - self.start
+        usage_end = children_usage()
+        for key in ("cpu_user_seconds", "cpu_system_seconds"):
+            if usage_end[key] is not None:
+                self.usage["children_" + key] = usage_end[key] - self.usage_start[key]
+        self.usage["children_maxrss_kb"] = usage_end["maxrss_kb"]
+        if self.sampler is not None:
+            self.sampler.stop()
+            self.usage["sampled_peak_rss_kb"] = self.sampler.peak_rss_kb
+        if error is not None:
+            self.error = "{}: {}".format(type(error).__name__, error)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "start": self.start,
+            "wall_seconds": self.wall_seconds,
+            "usage": self.usage,
+            "input_bytes": file_bytes(self.input_files),
+            "output_bytes": file_bytes(self.output_files),
+            "input_files": self.input_files,
+            "output_files": self.output_files,
+            "attributes": self.attributes,
+            "error": self.error,
+            "children": [c.to_dict() for c in self.children],
+        }
+
+
+class RunReport(object):
+    """
+    collects the spans of one run
+
+    :param name: name of the run
+    :param sample_interval: seconds between psutil RSS samples, None to only use getrusage
+    """
+    def __init__(self, name, sample_interval=None):
+        self.name = name
+        self.sample_interval = sample_interval
+        self.spans = []
+        # thread ident -> stack of the spans open in that thread
+        self.open_spans = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, input_files=(), **attributes):
+        s = Span(name, input_files, attributes)
+        with self.lock:
+            open_spans = self.open_spans.setdefault(threading.current_thread().ident, [])
+            parent = open_spans[-1] if open_spans else None
+            (parent.children if parent else self.spans).append(s)
+            open_spans.append(s)
+        s.open(self.sample_interval)
+        try:
+            yield s
+        except BaseException as e:
+            s.close(e)
+            raise
+        else:
+            s.close()
+        finally:
+            with self.lock:
+                open_spans.remove(s)
+                if not open_spans:
+                    del self.open_spans[threading.current_thread().ident]
+
+    def to_dict(self):
+        return {"name": self.name, "spans": [s.to_dict() for s in self.spans]}
+
+    def write(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+        logger.info("run report written to {}".format(filename))
+
+
+def active_reports():
+    if not hasattr(g_thread_state, "reports"):
+        g_thread_state.reports = []
+    return g_thread_state.reports
+
+
+@contextmanager
+def activate(report):
+    """makes report the target of span() in the current thread"""
+    reports = active_reports()
+    reports.append(report)
+    try:
+        yield report
+    finally:
+        reports.remove(report)
+
+
+@contextmanager
+def span(name, input_files=(), **attributes):
+    """opens a span in the report that is active in this thread, yields an unrecorded Span without one"""
+    reports = active_reports()
+    if not reports:
+        yield Span(name, input_files, attributes)
+        return
+    with reports[-1].span(name, input_files, **attributes) as s:
+        yield s
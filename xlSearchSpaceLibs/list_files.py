@@ -1,32 +1,76 @@
-import re
 import os
+import re
+from collections import defaultdict
 
+try:
+    from xlSearchSpaceLibs import file_discovery
+except ImportError:
+    import file_discovery
 
-def get_list_of_files(location, file_regex=r".*/FDR_.*_false_summary_xiFDR(\d+\.)*csv"):
+
+def get_list_of_files(location, file_regex=r".*/FDR_.*_false_summary_xiFDR(\d+\.)*csv", dir_glob=None,
+                      skip_dir_regex=None, nthr=8, cache_file=None):
     """
     searches location recursively for files matching regex.
     regex has to match full file path.
     INPUT:
     location: base dir from where to search recursively
     file_regex: regex that files have to match
+    dir_glob, skip_dir_regex: prune directories before listing them, see file_discovery.discover_files
+    nthr: number of threads listing directories
+    cache_file: optional json file caching directory listings, revalidated by directory mtime
 
     RETURNS
     sorted list of files
     """
-    list_of_files = []
-    regex = re.compile(file_regex)
     if not os.path.exists(location):
         raise IOError("Specified location '{loc}' does not exist in filesystem.".format(loc=location))
-    for rel_dir, sub_dirs, files in os.walk(location):
-        for f in files:
-            f_full = os.path.join(rel_dir, f)
-            # print f_full
-            if regex.match(f_full):
-                list_of_files.append(f_full)
+    list_of_files = file_discovery.discover_files(location, file_regex, match_full_path=True, dir_glob=dir_glob,
+                                                  skip_dir_regex=skip_dir_regex, nthr=nthr, cache_file=cache_file)
     if len(list_of_files) == 0:
         raise Warning("No files were found in '{loc}' that match '{re}'"\
                       .format(loc=location, re=file_regex))
-    return sorted(list_of_files)
+    return list_of_files
+
+
+def natural_sort_key(path):
+    """sort key that orders numbers by value, i.e. FDR_rep2 before FDR_rep10"""
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", path)]
+
+
+def experiment_name(f, level=1, exp_regex=None):
+    """
+    name of the experiment a file belongs to
+
+    :param level: the experiment is the directory this many levels above the file, 1 is the parent directory
+    :param exp_regex: if given, the experiment is the closest directory above the file whose name matches
+    """
+    path, name = os.path.split(os.path.normpath(f))
+    if exp_regex is None:
+        for i in range(level):
+            path, name = os.path.split(path)
+        return name
+    regex = re.compile(exp_regex)
+    while True:
+        path, name = os.path.split(path)
+        if not name:
+            raise ValueError("No directory of '{}' matches '{}'".format(f, exp_regex))
+        if regex.match(name):
+            return name
+
+
+def group_files_by_experiment(list_of_files, level=1, exp_regex=None):
+    """
+    groups replicate files by experiment in one pass, independent of the order of list_of_files
+
+    :param level: see experiment_name
+    :param exp_regex: see experiment_name, for nested layouts
+    :return: dict, experiment name -> list of files in natural sort order
+    """
+    dict_of_files = defaultdict(list)
+    for f in list_of_files:
+        dict_of_files[experiment_name(f, level, exp_regex)].append(f)
+    return dict((exp, sorted(files, key=natural_sort_key)) for exp, files in dict_of_files.items())
 
 
 # # # testing
@@ -34,4 +78,4 @@ if __name__ == "__main__":
     list_files = \
         get_list_of_files(location=r"/home/henning/mnt/xitu/Data/Results/170823_Chaetomium/171020-random_decoys/",
                           file_regex=r".*/xi_output/xi_results\.csv")
-    print "\n".join(list_files)
+    print("\n".join(list_files))
@@ -0,0 +1,254 @@
+"""
+Background memory monitor for the JVM child processes of XiWrapper.
+
+Samples the RSS of the child (psutil or /proc/<pid>/status) and, when jstat is on the PATH, the used heap and the
+garbage collection counters of the JVM. The used heap is compared with the -Xmx limit and a linear trend over the most
+recent samples predicts when the limit is reached. The monitor warns when the usage or the prediction crosses its
+thresholds and optionally kills the process early instead of waiting for java.lang.OutOfMemoryError. A kill by
+prediction needs the trend of the heap right after garbage collections, the heap between collections grows with
+garbage that is collected anyway.
+
+The RSS of a JVM includes memory outside of the heap and is not comparable with -Xmx. Without heap usage only the
+RSS budget, if one is given, is checked, otherwise samples are only recorded.
+All samples are written to a csv time series for sizing later runs.
+"""
+import logging
+import os
+import re
+import subprocess
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+g_memory_units = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+g_sample_columns = ["time", "elapsed_seconds", "rss_bytes", "heap_used_bytes", "heap_capacity_bytes",
+                    "gc_count", "gc_seconds", "usage_basis", "usage_fraction", "seconds_to_limit",
+                    "seconds_to_limit_after_gc"]
+
+
+def parse_memory(memory):
+    """
+    parses a java memory setting like the value of -Xmx
+
+    :param memory: string of format int[kmgt], i.e. "30g" for 30GB of RAM
+    :return: int, number of bytes, None if memory is None
+    """
+    if memory is None:
+        return None
+    match = re.match(r"^\s*(\d+)\s*([kmgt]?)b?\s*$", str(memory).lower())
+    if not match:
+        raise ValueError("Could not parse memory setting '{}'".format(memory))
+    return int(match.group(1)) * g_memory_units[match.group(2)]
+
+
+def max_heap_from_cmd(cmd):
+    """:return: the -Xmx value of a java command line in bytes, None if there is none"""
+    for arg in cmd:
+        if arg.startswith("-Xmx"):
+            return parse_memory(arg[4:])
+    return None
+
+
+def process_rss(pid):
+    """:return: resident set size of the process in bytes, None if it does not exist (anymore)"""
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            return None
+    try:
+        with open("/proc/{}/status".format(pid)) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        return None
+    return None
+
+
+def jstat_gc(pid, jstat="jstat"):
+    """
+    reads the heap and garbage collection counters of a JVM with 'jstat -gc'
+
+    :return: dict with heap_used_bytes, heap_capacity_bytes, gc_count and gc_seconds, None if jstat failed
+    """
+    try:
+        output = subprocess.check_output([jstat, "-gc", str(pid)], stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    lines = output.decode("ascii", "replace").split("\n")
+    if len(lines) < 2:
+        return None
+    values = dict(zip(lines[0].split(), lines[1].split()))
+    try:
+        kb = dict((k, float(v)) for k, v in values.items())
+        return {
+            "heap_used_bytes": int((kb["S0U"] + kb["S1U"] + kb["EU"] + kb["OU"]) * 1024),
+            "heap_capacity_bytes": int((kb["S0C"] + kb["S1C"] + kb["EC"] + kb["OC"]) * 1024),
+            "gc_count": int(kb["YGC"] + kb["FGC"]),
+            "gc_seconds": kb["GCT"],
+        }
+    except (KeyError, ValueError):
+        return None
+
+
+def linear_trend(points):
+    """least squares slope of (x, y) points, None for less than two distinct x"""
+    n = len(points)
+    if n < 2:
+        return None
+    mean_x = sum(p[0] for p in points) / float(n)
+    mean_y = sum(p[1] for p in points) / float(n)
+    var_x = sum((p[0] - mean_x) ** 2 for p in points)
+    if var_x == 0:
+        return None
+    return sum((p[0] - mean_x) * (p[1] - mean_y) for p in points) / var_x
+
+
+class MemoryMonitor(threading.Thread):
+    """
+    samples the memory of a child process until stop() is called or the process is gone
+
+    :param process: subprocess.Popen object of the JVM
+    :param max_heap_bytes: the -Xmx limit in bytes the used heap is compared with, None only records samples
+    :param interval: seconds between samples
+    :param samples_file: csv file the samples are written to, optional
+    :param warn_fraction: warn when the used fraction of the limit exceeds this
+    :param abort_fraction: kill the process when the used fraction exceeds this, None never kills
+    :param horizon: seconds, warn when the trend of the samples reaches the limit earlier, kill (with abort_fraction
+        set) when the trend of the heap after garbage collections does
+    :param trend_samples: number of most recent samples (or garbage collections) the trend is fitted to
+    :param use_jstat: read heap usage with jstat
+    :param rss_budget_bytes: limit the RSS is compared with when there is no heap usage, i.e. without jstat.
+        None disables the checks without heap usage
+    """
+    def __init__(self, process, max_heap_bytes, interval=10., samples_file=None, warn_fraction=0.9,
+                 abort_fraction=None, horizon=300., trend_samples=12, use_jstat=True, rss_budget_bytes=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.process = process
+        self.max_heap_bytes = max_heap_bytes
+        self.interval = interval
+        self.samples_file = samples_file
+        self.warn_fraction = warn_fraction
+        self.abort_fraction = abort_fraction
+        self.horizon = horizon
+        self.trend_samples = trend_samples
+        self.use_jstat = use_jstat
+        self.rss_budget_bytes = rss_budget_bytes
+        self.samples = []
+        # (elapsed seconds, usage fraction) of the first sample after each garbage collection
+        self.gc_minima = []
+        self.warned = False
+        self.abort_reason = None
+        self.stopped = threading.Event()
+        self.start_time = time.time()
+
+    def sample(self):
+        """:return: dict of the current sample, None if the process is gone"""
+        rss = process_rss(self.process.pid)
+        if rss is None:
+            return None
+        now = time.time()
+        sample = dict.fromkeys(g_sample_columns)
+        sample.update({"time": now, "elapsed_seconds": now - self.start_time, "rss_bytes": rss})
+        if self.use_jstat:
+            gc = jstat_gc(self.process.pid)
+            if gc is None:
+                # not a JVM or no jstat available, do not try again
+                self.use_jstat = False
+            else:
+                sample.update(gc)
+        if sample["heap_used_bytes"] is not None and self.max_heap_bytes:
+            sample["usage_basis"] = "heap"
+            sample["usage_fraction"] = sample["heap_used_bytes"] / float(self.max_heap_bytes)
+        elif self.rss_budget_bytes:
+            sample["usage_basis"] = "rss"
+            sample["usage_fraction"] = rss / float(self.rss_budget_bytes)
+        if sample["usage_fraction"] is None:
+            return sample
+        points = [(s["elapsed_seconds"], s["usage_fraction"])
+                  for s in self.samples[-(self.trend_samples - 1):] + [sample]
+                  if s["usage_basis"] == sample["usage_basis"]]
+        sample["seconds_to_limit"] = self.seconds_to_limit(points, sample["usage_fraction"])
+        if sample["usage_basis"] == "heap":
+            previous = self.samples[-1]["gc_count"] if self.samples else None
+            if previous is not None and sample["gc_count"] > previous:
+                self.gc_minima.append((sample["elapsed_seconds"], sample["usage_fraction"]))
+                minima = self.gc_minima[-self.trend_samples:]
+                if len(minima) >= self.trend_samples:
+                    sample["seconds_to_limit_after_gc"] = self.seconds_to_limit(minima, minima[-1][1])
+            elif self.samples:
+                sample["seconds_to_limit_after_gc"] = self.samples[-1]["seconds_to_limit_after_gc"]
+        return sample
+
+    @staticmethod
+    def seconds_to_limit(points, fraction):
+        """:return: seconds until the linear trend of (seconds, fraction) points reaches 1, None if it does not rise"""
+        slope = linear_trend(points)
+        if slope and slope > 0:
+            return max(0., (1. - fraction) / slope)
+        return None
+
+    def check(self, sample):
+        """warns and kills according to the thresholds, samples without usage fraction are not checked"""
+        fraction = sample["usage_fraction"]
+        seconds_to_limit = sample["seconds_to_limit"]
+        if fraction is None:
+            return
+        limit = self.max_heap_bytes if sample["usage_basis"] == "heap" else self.rss_budget_bytes
+        predicted = seconds_to_limit is not None and seconds_to_limit < self.horizon \
+            and len(self.samples) >= self.trend_samples
+        predicted_after_gc = sample["seconds_to_limit_after_gc"] is not None \
+            and sample["seconds_to_limit_after_gc"] < self.horizon
+        if not self.warned and (fraction >= self.warn_fraction or predicted):
+            self.warned = True
+            logger.warning("process {} uses {:.0%} of its {} limit {}, limit reached in {} seconds"
+                           .format(self.process.pid, fraction, sample["usage_basis"], limit,
+                                   "unknown" if seconds_to_limit is None else int(seconds_to_limit)))
+        if self.abort_fraction is not None and (fraction >= self.abort_fraction or predicted_after_gc):
+            if fraction >= self.abort_fraction:
+                self.abort_reason = "{} usage {:.0%} of {} bytes".format(sample["usage_basis"], fraction, limit)
+            else:
+                self.abort_reason = "heap after garbage collection predicted to reach {} bytes in {} seconds"\
+                    .format(limit, int(sample["seconds_to_limit_after_gc"]))
+            logger.error("killing process {}: {}".format(self.process.pid, self.abort_reason))
+            self.process.kill()
+            self.stopped.set()
+
+    def run(self):
+        f = open(self.samples_file, "w") if self.samples_file else None
+        try:
+            if f:
+                f.write(",".join(g_sample_columns) + "\n")
+            # the process is not polled here, on python 2 polling from two threads can lose its exit code,
+            # sample() returns None once it is gone
+            while not self.stopped.is_set():
+                sample = self.sample()
+                if sample is None:
+                    break
+                self.samples.append(sample)
+                if f:
+                    f.write(",".join("" if sample[c] is None else str(sample[c]) for c in g_sample_columns) + "\n")
+                    f.flush()
+                self.check(sample)
+                self.stopped.wait(self.interval)
+        finally:
+            if f:
+                f.close()
+
+    def stop(self):
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
+
+    def peak(self, key="rss_bytes"):
+        values = [s[key] for s in self.samples if s[key] is not None]
+        return max(values) if values else None
@@ -0,0 +1,222 @@
+"""
+MGF spectra: the MS2_spectrum container, MGF_Reader and write_mgf.
+
+Used by preprocessing-171005.py and peak_sharding.
+"""
+import logging
+import os
+import re
+import sys
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class MS2_spectrum():
+    """
+    Class container for MS2 spectra.
+    We need the following input parameters:
+    title, RT, pepmass, pepint, charge, peaks, peakcharge=[]
+
+    Parameters:
+    -----------------------------------------
+    title: str,
+            title of the spectrum
+    RT: float,
+        retention time of the precursor
+    pepmass: float,
+              mass of the precursor
+    charge: int,
+             charge of the precursor
+    peaks: [(float, float)],
+           mass intensity
+    peakcharge: arr,
+                charge array for the peaks
+
+    """
+
+    def __init__(self, title, RT, pepmass, pepint, charge, peaks, peakcharge=[]):
+        self.title = title
+        self.RT = RT
+        self.pepmass = pepmass
+        self.pepint = pepint
+        self.charge = charge
+        self.peaks = peaks
+        self.peakcharge = peakcharge
+
+    def getPrecursorMass(self):
+        """
+        Returns the precursor mass
+        """
+        return (self.pepmass)
+
+    def getPrecursorIntensity(self):
+        """
+        Returns the precursor mass
+        """
+        return (self.pepint)
+
+    def getRT(self):
+        """
+        Returns the precursor mass
+        """
+        return (self.RT)
+
+    def getTitle(self):
+        """
+        Returns the precursor mass
+        """
+        return (self.title)
+
+    def getPeaks(self):
+        """
+        Returns the precursor mass
+        """
+        return (self.peaks)
+
+    def getMasses(self):
+        """
+        TODO:
+        Returns the precursor mass
+        """
+        return (self.peaks[:, 0])
+
+    def getIntensities(self):
+        """
+        TODO:
+        Returns the precursor mass
+        """
+        return (self.peaks[:, 1])
+
+    def getUnchargedMass(self):
+        """
+        Computs the uncharged mass of a fragment:
+        uncharged_mass = (mz * z ) - z
+        """
+        return ((self.pepmass * self.charge) - self.charge)
+
+    def printf(self):
+        print ("Title, RT, PEPMASS, PEPINT, CHARGE")
+        print (self.title, self.RT, self.pepmass, self.pepint, self.charge)
+
+    def to_mgf(self):
+        # need dummy values in case no peak charges are in the data
+        if len(self.peakcharge) == 0:
+            self.peakcharge = [""] * self.peaks.shape[0]
+        mgf_str = """
+BEGIN IONS
+TITLE=%s
+RTINSECONDS=%s
+PEPMASS=%s %s
+CHARGE=%s
+%s
+END IONS
+        """ % (self.title, self.RT, self.pepmass, self.pepint, self.charge,
+               "\r\n".join(["%s %s %s" % (i[0], i[1], j,) for i, j in zip(self.peaks, self.peakcharge)]))
+        return (mgf_str)
+
+
+# ==============================================================================
+# File Reader
+# ==============================================================================
+class MGF_Reader():
+    """A MGF_Reader is associated with a FASTA file or an open connection
+    to a file-like object with content in FASTA format.
+    It can generate an iterator over the sequences.
+
+    Usage:
+    --------------------------
+    >>reader = MGF_Reader() \r\n
+    >>reader.load(infile) \r\n
+    >>#do something \r\n
+    >>reader.store(outfile, outspectra) \r\n
+    """
+
+    def load(self, infile, getpeakcharge=False):
+        """
+        Function to set the input file for the MGF file.
+
+        Parameters:
+        -----------------------------
+        infile: str,
+                file location
+
+
+
+        """
+        self.infile = infile
+        self.peakcharge = getpeakcharge
+
+    def __iter__(self):
+        with open(self.infile, "rU" if sys.version_info[0] < 3 else "r") as mgf_file:
+            for spectrum in self._parse(mgf_file):
+                yield spectrum
+
+    def _parse(self, mgf_file):
+        """lines are read with universal newlines, peaks may be separated by \\r, \\n or \\r\\n"""
+        found_ions = False
+        for line in mgf_file:
+            if len(line.strip()) == 0:
+                continue
+            if line.startswith("BEGIN IONS"):
+                # init arrays for peaks
+                found_ions = True
+                mass = []
+                intensity = []
+                peakcharge = []
+            elif line.startswith("TITLE"):
+                title = re.search("TITLE=(.*)", line).groups()[0]
+
+            elif line.startswith("RTINSECONDS"):
+                RT = float(re.search("RTINSECONDS=(.*)", line).groups()[0])
+
+            elif line.startswith("PEPMASS"):
+                precursor = re.search("PEPMASS=(.*)", line).groups()[0].split()
+                pep_mass = float(precursor[0])
+                try:
+                    pep_int = float(precursor[1])
+                except:
+                    pep_int = -1.0
+
+            elif line.startswith("CHARGE"):
+                charge = float(re.search("CHARGE=(\d)", line).groups()[0])
+
+            elif line.startswith("MASS="):
+                # mass type of the peak list as written by write_mgf, the masses are read as they are
+                continue
+
+            elif "=" in line:
+                logger.debug("unhandled parameter: %s" % (line.strip()))
+
+            elif line.startswith("END IONS"):
+                ms = MS2_spectrum(title, RT, pep_mass, pep_int, charge, np.array(list(zip(mass, intensity))), peakcharge)
+                yield ms
+            else:
+                if found_ions is True:
+                    peak = line.split()
+                    mass.append(float(peak[0]))
+                    intensity.append(float(peak[1]))
+                    if self.peakcharge:
+                        if len(peak) > 2:
+                            peakcharge.append(peak[2])
+
+
+def write_mgf(spectra, outfile, mode="w"):
+    """writes spectra to outfile, mode "a" appends to an existing file"""
+    with open(os.path.join(outfile), mode) as out_writer:
+        for spectrum in spectra:
+            stavrox_mgf = """
+MASS=Monoisotopic
+BEGIN IONS
+TITLE={}
+PEPMASS={}
+CHARGE={}+
+RTINSECONDS={}
+{}
+END IONS     """.format(spectrum.getTitle(),
+                                spectrum.getPrecursorMass(),
+                                int(spectrum.charge), spectrum.getRT(),
+                                "\n".join(["%s %s" % (i[0], i[1]) for i in spectrum.peaks if i[1] > 0]))
+            out_writer.write(stavrox_mgf)
@@ -0,0 +1,111 @@
+"""
+Split MGF peak files into shards that are searched by concurrent XiSearch runs.
+
+shard_peak_files streams the spectra of all peak files with MGF_Reader and assigns every spectrum to the shard with
+the lowest load so far. The load of a spectrum is its number of peaks plus spectrum_weight, so shards are balanced
+by spectrum count times peak count. Every shard gets one MGF per input file with the file name of the input, so Run
+and PeakListFileName of the xi results are the same as for an unsharded search. The MGF of the j-th input is written
+to its own sub directory shard_<i>/<j>, so inputs with the same file name from different directories don't collide.
+
+run_sharded_peak_search searches all shards against the same FASTA files, nthr JVMs at a time, each with its own
+heap size, and recombines the results with xi_result_merging.merge_xi_results. Every spectrum is in exactly one
+shard, the merged file keeps the best match per spectrum as a search with TOPMATCHESONLY does.
+"""
+import heapq
+import logging
+import os
+from multiprocessing.pool import ThreadPool
+
+try:
+    from xlSearchSpaceLibs.XiWrapper import XiWrapper
+    from xlSearchSpaceLibs.mgf_utils import MGF_Reader, write_mgf
+    from xlSearchSpaceLibs import xi_result_merging
+except ImportError:
+    from XiWrapper import XiWrapper
+    from mgf_utils import MGF_Reader, write_mgf
+    import xi_result_merging
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+def shard_peak_files(peak_files, n_shards, out_dir, spectrum_weight=10, batch_size=1000):
+    """
+    distributes the spectra of peak_files over n_shards shards, only batch_size spectra per shard are held in memory
+
+    :param peak_files: list of MGF files
+    :param out_dir: the shards are written to out_dir/shard_<i>/<input index>/<peak file name>
+    :param spectrum_weight: load of a spectrum in addition to its peaks
+    :return: tuple (list of lists of MGF files per shard, list of dicts with spectra, peaks and load per shard),
+        shards without spectra are left out
+    """
+    shard_dirs = [os.path.join(out_dir, "shard_{}".format(i)) for i in range(n_shards)]
+    for d in shard_dirs:
+        if not os.path.exists(d):
+            os.makedirs(d)
+    stats = [{"spectra": 0, "peaks": 0, "load": 0} for _ in range(n_shards)]
+    shard_files = [[] for _ in range(n_shards)]
+    heap = [(0, i) for i in range(n_shards)]
+
+    def flush(i, filename, batch):
+        mode = "a" if filename in shard_files[i] else "w"
+        if mode == "w":
+            shard_files[i].append(filename)
+            if not os.path.exists(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+        write_mgf(batch, filename, mode=mode)
+
+    for j, peak_file in enumerate(peak_files):
+        reader = MGF_Reader()
+        reader.load(peak_file)
+        out_files = [os.path.join(d, str(j), os.path.basename(peak_file)) for d in shard_dirs]
+        batches = [[] for _ in range(n_shards)]
+        for spectrum in reader:
+            load, i = heapq.heappop(heap)
+            n_peaks = len(spectrum.peaks)
+            load += n_peaks + spectrum_weight
+            heapq.heappush(heap, (load, i))
+            stats[i]["spectra"] += 1
+            stats[i]["peaks"] += n_peaks
+            stats[i]["load"] = load
+            batches[i].append(spectrum)
+            if len(batches[i]) >= batch_size:
+                flush(i, out_files[i], batches[i])
+                batches[i] = []
+        for i, batch in enumerate(batches):
+            if batch:
+                flush(i, out_files[i], batch)
+    logger.info("sharded spectra of {} peak files into {} shards: {}".format(len(peak_files), n_shards, stats))
+    return [files for files in shard_files if files], [s for s in stats if s["spectra"]]
+
+
+def run_sharded_peak_search(shard_files, xi_config, fasta_files, out_dir, nthr=1, memory=None,
+                            merged_file=None, **xi_kwargs):
+    """
+    runs one XiSearch per peak file shard, nthr searches at a time, and merges the results
+
+    :param shard_files: list of lists of MGF files, i.e. from shard_peak_files
+    :param memory: heap size of every search, string of format int[gm] or a list with one per shard
+    :param merged_file: merged xi results, defaults to out_dir/xi_results.csv
+    :param xi_kwargs: further arguments for XiWrapper.xi_execution, i.e. xi_path
+    :return: tuple (merged file, list of xi result files per shard, merge statistics)
+    """
+    if not isinstance(memory, (list, tuple)):
+        memory = [memory] * len(shard_files)
+    if len(memory) != len(shard_files):
+        raise ValueError("Got {} heap sizes for {} shards".format(len(memory), len(shard_files)))
+
+    def search(i):
+        return XiWrapper.xi_execution(
+            xi_config=xi_config, peak_files=list(shard_files[i]), fasta_files=list(fasta_files), memory=memory[i],
+            output_file=os.path.join(out_dir, "shard_{}".format(i), "xi_results.csv"), **xi_kwargs)
+
+    pool = ThreadPool(nthr)
+    try:
+        result_files = pool.map(search, range(len(shard_files)), chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    merged_file = merged_file or os.path.join(out_dir, "xi_results.csv")
+    stats = xi_result_merging.merge_xi_results(result_files, merged_file)
+    return merged_file, result_files, stats
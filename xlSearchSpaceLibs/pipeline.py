@@ -14,8 +14,14 @@ import logging
 import os
 import time
 
-import XiWrapper
-from XiFdrWrapper import XiFdrWrapper
+try:
+    from xlSearchSpaceLibs import XiWrapper
+    from xlSearchSpaceLibs.XiFdrWrapper import XiFdrWrapper
+    from xlSearchSpaceLibs import instrumentation
+except ImportError:
+    import XiWrapper
+    from XiFdrWrapper import XiFdrWrapper
+    import instrumentation
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
@@ -167,12 +173,16 @@ def execute_pipeline(
         # optional xifdr settings
         pepfdr="5", xifdr_memory="1G", reportfactor="10000",
         additional_xifdr_arguments=list(),
-        xifdr_filename="xiFDRDB.jar"
+        xifdr_filename="xiFDRDB.jar",
+        # optional instrumentation settings
+        run_report="run_report.json", report_sample_interval=None
 ):
     """
     This pipeline executes:
     xiSeqrch
     and Xifdr
+    Wall time, child CPU time, peak RSS and file sizes of both stages are written to
+    output_basedir/run_report (None to disable), report_sample_interval enables psutil RSS sampling.
     RETURNS:
         Xi result file: str
         XiFDR result files: list of str
@@ -188,33 +198,40 @@ def execute_pipeline(
     for directory in pre_list_of_dirs:
         list_of_dirs.append(os.path.join(output_basedir, directory))
     fun_makedirs(list_of_dirs)
-    # call xisearch
-    # starttime = time.time()
-    xi_result = XiWrapper.XiWrapper.xi_execution(
-        xi_path=xi_path,
-        xi_config=xi_config,
-        peak_files=peak_files,
-        fasta_files=list_of_fasta_dbs,
-        memory=xi_memory,
-        output_file=os.path.join(list_of_dirs[0], "xi_results.csv"),
-        additional_parameters=additional_xi_parameters)
-    # logger.info("xi search execution for '{}' took {}"
-    #             .format(list_of_dirs[0], calculate_elapsed_time(starttime)))
-    # xi_result is a string but xifdr needs a list as input
-    xifdr_input = [xi_result]
-    # call xifdr
-    starttime = time.time()
-    xifdr_results = XiFdrWrapper.xifdr_execution(
-        xifdr_input_csv=xifdr_input,
-        xifdr_output_dir=list_of_dirs[1],
-        pepfdr=pepfdr,
-        memory=xifdr_memory,
-        reportfactor=reportfactor,
-        additional_xifdr_arguments=additional_xifdr_arguments,
-        xifdr_filename=xifdr_filename
-    )
-    # logger.info("xifdr execution for '{}' took {}"
-    #             .format(list_of_dirs[1], calculate_elapsed_time(starttime)))
+    report = instrumentation.RunReport("execute_pipeline", sample_interval=report_sample_interval)
+    try:
+        with instrumentation.activate(report), \
+                instrumentation.span("execute_pipeline", input_files=peak_files + list_of_fasta_dbs,
+                                     output_basedir=output_basedir):
+            # call xisearch
+            # starttime = time.time()
+            xi_result = XiWrapper.XiWrapper.xi_execution(
+                xi_path=xi_path,
+                xi_config=xi_config,
+                peak_files=peak_files,
+                fasta_files=list_of_fasta_dbs,
+                memory=xi_memory,
+                output_file=os.path.join(list_of_dirs[0], "xi_results.csv"),
+                additional_parameters=additional_xi_parameters)
+            # logger.info("xi search execution for '{}' took {}"
+            #             .format(list_of_dirs[0], calculate_elapsed_time(starttime)))
+            # xi_result is a string but xifdr needs a list as input
+            xifdr_input = [xi_result]
+            # call xifdr
+            xifdr_results = XiFdrWrapper.xifdr_execution(
+                xifdr_input_csv=xifdr_input,
+                xifdr_output_dir=list_of_dirs[1],
+                pepfdr=pepfdr,
+                memory=xifdr_memory,
+                reportfactor=reportfactor,
+                additional_xifdr_arguments=additional_xifdr_arguments,
+                xifdr_filename=xifdr_filename
+            )
+            # logger.info("xifdr execution for '{}' took {}"
+            #             .format(list_of_dirs[1], calculate_elapsed_time(starttime)))
+    finally:
+        if run_report:
+            report.write(os.path.join(output_basedir, run_report))
     return xi_result, xifdr_results
 
 
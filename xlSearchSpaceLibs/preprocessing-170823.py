@@ -11,7 +11,6 @@ from gooey import Gooey, GooeyParser
 # import pyopenms as oms
 
 import re
-from pyteomics import mzml
 
 
 def split_mzml(mzml_file):
@@ -28,6 +27,7 @@ def split_mzml(mzml_file):
 
     """
 
+    from pyteomics import mzml
     mzml_reader = mzml.read(mzml_file)
     ordered_ms2_spectra = {
         "CID": [],
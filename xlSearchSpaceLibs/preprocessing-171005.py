@@ -1,12 +1,19 @@
 import os
 import numpy as np
 import subprocess
+import json
+import hashlib
+import shutil
 from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 import sys
 import re
 import getopt
-from pyteomics import mzml
 from functools import partial
+try:
+    from xlSearchSpaceLibs.mgf_utils import MS2_spectrum, MGF_Reader, write_mgf
+except ImportError:
+    from mgf_utils import MS2_spectrum, MGF_Reader, write_mgf
 
 
 def read_cmdline():
@@ -40,46 +47,161 @@ def read_cmdline():
     return input_arg, outdir, config
 
 
-def split_mzml(mzml_file, detector="all"):
+class FilterStringClassifier():
     """
-    function to split a mzML file into dict of MS2_Spectra objects (can be written to mgf format)
-    by fragmentation method
+    Memoizing classifier for thermo scan filter strings.
+    A run only contains a few dozen distinct filter strings, so each of them is parsed once
+    and every further lookup is a dict access.
 
-    Parameters:
-    -----------------------------------------
-    mzml_file: str,
-            path to mzML file
+    Usage:
+    --------------------------
+    >>classifier = FilterStringClassifier() \r\n
+    >>detector_str, frag_class = classifier.classify(filter_str) \r\n
+    >>classifier.counts \r\n
+    """
+    detector_regex = re.compile("^(FT|IT)")
+    frag_regex = re.compile("@([A-z]+)([0-9.]+)")
+    frag_classes = ["CID", "HCD", "ETD", "ETciD", "EThcD", "unknown"]
+
+    def __init__(self):
+        # {filter string: (detector, fragmentation class)}
+        self.mapping = {}
+        # {(detector, fragmentation class): number of classified scans}
+        self.counts = {}
+
+    @classmethod
+    def parse(cls, filter_str):
+        """
+        Parses detector and fragmentation class from a filter string without using the cache.
 
-    Return: dict {fragMethod: list(MS2_spectrum)
+        Parameters:
+        -----------------------------------------
+        filter_str: str,
+                scan filter string, i.e. "FTMS + p NSI d Full ms2 1000.00@hcd30.00 [100.00-2000.00]"
+
+        Return: tuple (detector, fragMethod)
+        """
+        try:
+            detector_str = cls.detector_regex.search(filter_str).groups()[0]
+        except AttributeError:
+            raise StandardError("filter string parse error: %s" % filter_str)
+        frag_methods = [f[0] for f in cls.frag_regex.findall(filter_str)]
+
+        if "etd" in frag_methods:
+            if "cid" in frag_methods:
+                frag_class = "ETciD"
+            elif "hcd" in frag_methods:
+                frag_class = "EThcD"
+            else:
+                frag_class = "ETD"
+        elif "cid" in frag_methods:
+            frag_class = "CID"
+        elif "hcd" in frag_methods:
+            frag_class = "HCD"
+        else:
+            frag_class = "unknown"
+        return detector_str, frag_class
+
+    def classify(self, filter_str):
+        """
+        Returns (detector, fragMethod) of a filter string and counts the classified scan.
+        """
+        try:
+            classification = self.mapping[filter_str]
+        except KeyError:
+            classification = self.parse(filter_str)
+            self.mapping[filter_str] = classification
+        self.counts[classification] = self.counts.get(classification, 0) + 1
+        return classification
+
+    def class_counts(self, detector="all"):
+        """
+        Returns dict {fragMethod: number of classified scans}, optionally restricted to one detector.
+        """
+        dct_counts = dict.fromkeys(self.frag_classes, 0)
+        for (detector_str, frag_class), n in self.counts.items():
+            if detector == "all" or detector == detector_str:
+                dct_counts[frag_class] += n
+        return dct_counts
+
+
+def parse_ms2denoise(mscon_settings):
+    """
+    reads the parameters of a msconvert 'MS2Denoise [<peaks_in_window> [<window_width_Da> [multicharge_fragment_relaxation]]]'
+    filter, missing values get the msconvert defaults
 
+    Return: tuple (peaks_in_window, window_width, relax) or None if the filter is not set
+    """
+    for setting in mscon_settings:
+        fields = setting.split()
+        if fields and fields[0] == "MS2Denoise":
+            peaks_in_window = int(fields[1]) if len(fields) > 1 else 6
+            window_width = float(fields[2]) if len(fields) > 2 else 30.
+            relax = fields[3].lower() == "true" if len(fields) > 3 else True
+            return peaks_in_window, window_width, relax
+    return None
+
+
+def denoise_ms2_peaks(mz, intensity, precursor_mz, charge, peaks_in_window=20, window_width=100., relax=False):
+    """
+    in-process approximation of the msconvert MS2Denoise filter for centroided spectra:
+    keeps the peaks_in_window most intense peaks in each window_width m/z window and removes peaks above
+    the precursor m/z. With relax, peaks up to the singly charged precursor mass are kept for multiply
+    charged precursors.
+    The windows are fixed bins starting at m/z 0 and the relax limit is an estimate, the result is not
+    verified to be identical to msconvert output.
+
+    Return: tuple (mz array, intensity array) of the kept peaks, in m/z order
     """
+    mz = np.asarray(mz, dtype=float)
+    intensity = np.asarray(intensity, dtype=float)
+    if relax and charge > 1:
+        mz_limit = precursor_mz * charge - (charge - 1) * 1.00727646688
+    else:
+        mz_limit = precursor_mz
+    below_limit = np.flatnonzero(mz <= mz_limit)
+    windows = np.floor(mz[below_limit] / window_width).astype(int)
+    # peaks sorted by window, then by decreasing intensity; the rank within its window decides
+    order = np.lexsort((-intensity[below_limit], windows))
+    sorted_windows = windows[order]
+    rank = np.arange(len(order)) - np.searchsorted(sorted_windows, sorted_windows, side='left')
+    kept = np.sort(below_limit[order[rank < peaks_in_window]])
+    return mz[kept], intensity[kept]
+
+
+def split_spectra(spectra, title_prefix, detector="all", classifier=None, denoise=None):
+    """
+    sorts pyteomics mzML spectrum dicts into lists of MS2_spectrum objects by fragmentation method
 
-    mzml_reader = mzml.read(mzml_file)
-    ordered_ms2_spectra = {
-        "CID": [],
-        "HCD": [],
-        "ETD": [],
-        "ETciD": [],
-        "EThcD": [],
-        "unknown": []
-    }
+    Parameters:
+    -----------------------------------------
+    spectra: iterable of dict,
+            spectra as returned by pyteomics.mzml
+    title_prefix: str,
+            prefix for the spectrum titles, usually the run name
+    detector: str,
+            "FT", "IT" or "all"
+    classifier: FilterStringClassifier,
+            optional, reuse the filter string mapping
+    denoise: tuple,
+            optional, (peaks_in_window, window_width, relax) for denoise_ms2_peaks, spectra need to be centroided
+
+    Return: dict {fragMethod: list(MS2_spectrum)}, includes empty lists
+    """
+    if classifier is None:
+        classifier = FilterStringClassifier()
+    ordered_ms2_spectra = {frag_class: [] for frag_class in classifier.frag_classes}
 
-    n = 0
-    for spectrum in mzml_reader:
+    for spectrum in spectra:
         if spectrum['ms level'] == 2:
-            n += 1
             filter_str = spectrum['scanList']['scan'][0]['filter string']
-            try:
-                detector_str = re.search("^(FT|IT)", filter_str).groups()[0]
-                frag_groups = re.findall("@([A-z]+)([0-9.]+)", filter_str)
-            except AttributeError:
-                raise StandardError("filter string parse error: %s" % filter_str)
+            detector_str, frag_class = classifier.classify(filter_str)
 
             if not detector == "all":
                 if not detector == detector_str:
                     continue
 
-            title = os.path.split(mzml_file)[1].split('.mzML')[0] + " " + spectrum['id']
+            title = title_prefix + spectrum['id']
             rt = spectrum['scanList']['scan'][0]['scan start time'] * 60
             precursor = spectrum['precursorList']['precursor'][0]['selectedIonList']['selectedIon'][0]
             pre_mz = precursor['selected ion m/z']
@@ -88,215 +210,126 @@ def split_mzml(mzml_file, detector="all"):
             except KeyError:
                 pre_int = 0
             pre_z = precursor['charge state']
-            peaks = zip(spectrum['m/z array'], spectrum['intensity array'])
+            if denoise is None:
+                peaks = zip(spectrum['m/z array'], spectrum['intensity array'])
+            else:
+                if 'centroid spectrum' not in spectrum:
+                    raise ValueError("in-process denoising requires centroided spectra: %s" % spectrum['id'])
+                peaks = zip(*denoise_ms2_peaks(spectrum['m/z array'], spectrum['intensity array'],
+                                               pre_mz, pre_z, *denoise))
 
             ms2class_spectrum = MS2_spectrum(title, rt, pre_mz, pre_int, pre_z, peaks)
+            ordered_ms2_spectra[frag_class].append(ms2class_spectrum)
+    return ordered_ms2_spectra
 
-            frag_methods = [f[0] for f in frag_groups]
-
-            if "etd" in frag_methods:
-                if "cid" in frag_methods:
-                    ordered_ms2_spectra['ETciD'].append(ms2class_spectrum)
-                elif "hcd" in frag_methods:
-                    ordered_ms2_spectra['EThcD'].append(ms2class_spectrum)
-                else:
-                    ordered_ms2_spectra['ETD'].append(ms2class_spectrum)
-            elif "cid" in frag_methods:
-                ordered_ms2_spectra['CID'].append(ms2class_spectrum)
-            elif "hcd" in frag_methods:
-                ordered_ms2_spectra['HCD'].append(ms2class_spectrum)
-            else:
-                ordered_ms2_spectra['unknown'].append(ms2class_spectrum)
-    if len(ordered_ms2_spectra['unknown']) > 0:
-        raise Warning("The fragmentation method of %i spectra could not be identified" % len(ordered_ms2_spectra['unkown']))
 
-    return {k: v for k, v in ordered_ms2_spectra.items() if len(v) > 0}
+def shard_mzml(mzml_file, n_shards):
+    """
+    splits the spectrum offset index of a mzML file into contiguous scan ranges
 
+    Return: list of (start, stop) positions in the spectrum index
+    """
+    # pyteomics is imported on use, the MGF utilities of this script do not need it
+    from pyteomics import mzml
+    with mzml.PreIndexedMzML(mzml_file) as reader:
+        n_spectra = len(reader.index['spectrum'])
+    n_shards = max(1, min(n_shards, n_spectra))
+    bounds = np.linspace(0, n_spectra, n_shards + 1).astype(int)
+    return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
 
-class MS2_spectrum():
+
+def split_mzml_range(spectrum_range, mzml_file, detector="all", denoise=None):
+    """
+    worker function: decodes the spectra in spectrum_range = (start, stop) of the mzML offset index
+    and splits them by fragmentation method
+
+    Return: tuple (dict {fragMethod: list(MS2_spectrum)}, FilterStringClassifier)
+    """
+    from pyteomics import mzml
+    start, stop = spectrum_range
+    classifier = FilterStringClassifier()
+    title_prefix = os.path.split(mzml_file)[1].split('.mzML')[0] + " "
+    with mzml.PreIndexedMzML(mzml_file) as reader:
+        spectrum_ids = list(reader.index['spectrum'].keys())[start:stop]
+        spectra = (reader.get_by_id(spectrum_id) for spectrum_id in spectrum_ids)
+        ordered_ms2_spectra = split_spectra(spectra, title_prefix, detector, classifier, denoise)
+    return ordered_ms2_spectra, classifier
+
+
+def split_mzml(mzml_file, detector="all", classifier=None, nthr=1, n_shards=None, denoise=None):
     """
-    Class container for MS2 spectra.
-    We need the following input parameters:
-    title, RT, pepmass, pepint, charge, peaks, peakcharge=[]
+    function to split a mzML file into dict of MS2_Spectra objects (can be written to mgf format)
+    by fragmentation method
+
+    With nthr > 1 the file is sharded by its spectrum offset index into scan ranges that are decoded
+    in worker processes. The per-method lists are merged in scan order.
 
     Parameters:
     -----------------------------------------
-    title: str,
-            title of the spectrum
-    RT: float,
-        retention time of the precursor
-    pepmass: float,
-              mass of the precursor
-    charge: int,
-             charge of the precursor
-    peaks: [(float, float)],
-           mass intensity
-    peakcharge: arr,
-                charge array for the peaks
-
-    """
-
-    def __init__(self, title, RT, pepmass, pepint, charge, peaks, peakcharge=[]):
-        self.title = title
-        self.RT = RT
-        self.pepmass = pepmass
-        self.pepint = pepint
-        self.charge = charge
-        self.peaks = peaks
-        self.peakcharge = peakcharge
-
-    def getPrecursorMass(self):
-        """
-        Returns the precursor mass
-        """
-        return (self.pepmass)
-
-    def getPrecursorIntensity(self):
-        """
-        Returns the precursor mass
-        """
-        return (self.pepint)
+    mzml_file: str,
+            path to mzML file
+    detector: str,
+            "FT", "IT" or "all"
+    classifier: FilterStringClassifier,
+            optional, reuse the filter string mapping across files
+    nthr: int,
+            number of worker processes for decoding
+    n_shards: int,
+            number of scan ranges, default is 4 * nthr
+    denoise: tuple,
+            optional, (peaks_in_window, window_width, relax), see parse_ms2denoise
 
-    def getRT(self):
-        """
-        Returns the precursor mass
-        """
-        return (self.RT)
+    Return: dict {fragMethod: list(MS2_spectrum)
 
-    def getTitle(self):
-        """
-        Returns the precursor mass
-        """
-        return (self.title)
+    """
+    if classifier is None:
+        classifier = FilterStringClassifier()
 
-    def getPeaks(self):
-        """
-        Returns the precursor mass
-        """
-        return (self.peaks)
+    if nthr > 1:
+        ranges = shard_mzml(mzml_file, n_shards or 4 * nthr)
+        pool = Pool(processes=nthr)
+        shard_results = pool.map(partial(split_mzml_range, mzml_file=mzml_file, detector=detector, denoise=denoise), ranges)
+        pool.close()
+        pool.join()
 
-    def getMasses(self):
-        """
-        TODO:
-        Returns the precursor mass
-        """
-        return (self.peaks[:, 0])
+        return merge_split_results(shard_results, classifier)
 
-    def getIntensities(self):
-        """
-        TODO:
-        Returns the precursor mass
-        """
-        return (self.peaks[:, 1])
+    from pyteomics import mzml
+    title_prefix = os.path.split(mzml_file)[1].split('.mzML')[0] + " "
+    ordered_ms2_spectra = split_spectra(mzml.read(mzml_file), title_prefix, detector, classifier, denoise)
+    return merge_split_results([(ordered_ms2_spectra, classifier)])
 
-    def getUnchargedMass(self):
-        """
-        Computs the uncharged mass of a fragment:
-        uncharged_mass = (mz * z ) - z
-        """
-        return ((self.pepmass * self.charge) - self.charge)
-
-    def printf(self):
-        print ("Title, RT, PEPMASS, PEPINT, CHARGE")
-        print (self.title, self.RT, self.pepmass, self.pepint, self.charge)
-
-    def to_mgf(self):
-        # need dummy values in case no peak charges are in the data
-        if len(self.peakcharge) == 0:
-            self.peakcharge = [""] * self.peaks.shape[0]
-        mgf_str = """
-BEGIN IONS
-TITLE=%s
-RTINSECONDS=%s
-PEPMASS=%s %s
-CHARGE=%s
-%s
-END IONS
-        """ % (self.title, self.RT, self.pepmass, self.pepint, self.charge,
-               "\r\n".join(["%s %s %s" % (i[0], i[1], j,) for i, j in zip(self.peaks, self.peakcharge)]))
-        return (mgf_str)
-
-
-# ==============================================================================
-# File Reader
-# ==============================================================================
-class MGF_Reader():
-    """A MGF_Reader is associated with a FASTA file or an open connection
-    to a file-like object with content in FASTA format.
-    It can generate an iterator over the sequences.
 
-    Usage:
-    --------------------------
-    >>reader = MGF_Reader() \r\n
-    >>reader.load(infile) \r\n
-    >>#do something \r\n
-    >>reader.store(outfile, outspectra) \r\n
+def merge_split_results(shard_results, classifier=None):
     """
+    concatenates the per-method spectra lists of scan range shards
 
-    def load(self, infile, getpeakcharge=False):
-        """
-        Function to set the input file for the MGF file.
-
-        Parameters:
-        -----------------------------
-        infile: str,
-                file location
+    Parameters:
+    -----------------------------------------
+    shard_results: list of tuple (dict {fragMethod: list(MS2_spectrum)}, FilterStringClassifier),
+            in scan order, as returned by split_mzml_range
+    classifier: FilterStringClassifier,
+            optional, collects mapping and counts of the shard classifiers
 
+    Return: dict {fragMethod: list(MS2_spectrum)
+    """
+    ordered_ms2_spectra = {frag_class: [] for frag_class in FilterStringClassifier.frag_classes}
+    for shard_spectra, shard_classifier in shard_results:
+        for frag_class in shard_spectra:
+            ordered_ms2_spectra[frag_class].extend(shard_spectra[frag_class])
+        if classifier is not None and classifier is not shard_classifier:
+            classifier.mapping.update(shard_classifier.mapping)
+            for classification, n in shard_classifier.counts.items():
+                classifier.counts[classification] = classifier.counts.get(classification, 0) + n
 
+    if len(ordered_ms2_spectra['unknown']) > 0:
+        raise Warning("The fragmentation method of %i spectra could not be identified" % len(ordered_ms2_spectra['unknown']))
 
-        """
-        self.infile = infile
-        self.peakcharge = getpeakcharge
-
-    def __iter__(self):
-        mgf_file = open(self.infile, "r")
-        found_ions = False
-        for line in mgf_file:
-            if len(line.strip()) == 0:
-                continue
-            if line.startswith("BEGIN IONS"):
-                # init arrays for peaks
-                found_ions = True
-                mass = []
-                intensity = []
-                peakcharge = []
-            elif line.startswith("TITLE"):
-                title = re.search("TITLE=(.*)", line).groups()[0]
-
-            elif line.startswith("RTINSECONDS"):
-                RT = float(re.search("RTINSECONDS=(.*)", line).groups()[0])
-
-            elif line.startswith("PEPMASS"):
-                precursor = re.search("PEPMASS=(.*)", line).groups()[0].split()
-                pep_mass = float(precursor[0])
-                try:
-                    pep_int = float(precursor[1])
-                except:
-                    pep_int = -1.0
-
-            elif line.startswith("CHARGE"):
-                charge = float(re.search("CHARGE=(\d)", line).groups()[0])
-
-            elif "=" in line:
-                print ("unhandled paramter: %s" % (line))
-
-            elif line.startswith("END IONS"):
-                ms = MS2_spectrum(title, RT, pep_mass, pep_int, charge, np.array(zip(mass, intensity)), peakcharge)
-                yield ms
-            else:
-                if found_ions is True:
-                    peak = line.split()
-                    mass.append(float(peak[0]))
-                    intensity.append(float(peak[1]))
-                    if self.peakcharge:
-                        if len(peak) > 2:
-                            peakcharge.append(peak[2])
+    return {k: v for k, v in ordered_ms2_spectra.items() if len(v) > 0}
 
 
 def mscon_cmd(filepath, outdir, settings, mgf):
-    filename = os.path.split(filepath)[1]
-
-    if (filename[:filename.rfind('.')] in [x[:x.rfind('.')] for x in os.listdir(outdir)]) or (os.path.isdir(filepath)):
+    if os.path.isdir(filepath):
         return []
 
     filter_formatted = []
@@ -312,42 +345,342 @@ def mscon_cmd(filepath, outdir, settings, mgf):
     return cmd_list
 
 
-def write_mgf(spectra, outfile):
-    out_writer = open(os.path.join(outfile), "w")
-    for spectrum in spectra:
-        stavrox_mgf = """
-MASS=Monoisotopic
-BEGIN IONS
-TITLE={}
-PEPMASS={}
-CHARGE={}+
-RTINSECONDS={}
-{}
-END IONS     """.format(spectrum.getTitle(),
-                            spectrum.getPrecursorMass(),
-                            int(spectrum.charge), spectrum.getRT(),
-                            "\r".join(["%s %s" % (i[0], i[1]) for i in spectrum.peaks if i[1] > 0]))
-        out_writer.write(stavrox_mgf)
-
-
-def process_file(filepath, outdir, mscon_settings, split_acq, detector_filter, mscon_exe):
-    if not os.path.exists(outdir):
-        os.makedirs(outdir)
+def replace_file(src, dst):
+    """atomically renames src to dst, overwriting dst"""
+    try:
+        os.replace(src, dst)
+    except AttributeError:
+        # python 2: os.rename can not overwrite on windows
+        if os.name == 'nt' and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+class PreprocessingManifest():
+    """
+    Records for every processed input its size, mtime and content hash, the settings it was processed with
+    and the produced outputs. Stored as json in <outdir>/preprocessing_manifest.json.
+    Outputs are only moved into outdir once they are complete, so an output listed in the manifest is never partial.
+
+    Usage:
+    --------------------------
+    >>manifest = PreprocessingManifest(outdir) \r\n
+    >>if not manifest.is_current(filepath, settings): \r\n
+    >>    # process, then \r\n
+    >>    manifest.record(filepath, settings, outputs) \r\n
+    >>    manifest.save() \r\n
+    """
+    filename = "preprocessing_manifest.json"
+
+    def __init__(self, outdir):
+        self.outdir = outdir
+        self.path = os.path.join(outdir, self.filename)
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def file_hash(filepath, block_size=2 ** 20):
+        """sha1 of the file content"""
+        sha1 = hashlib.sha1()
+        with open(filepath, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                sha1.update(block)
+        return sha1.hexdigest()
+
+    @classmethod
+    def fingerprint(cls, filepath):
+        """dict with size, mtime and sha1 of filepath"""
+        stat = os.stat(filepath)
+        return {"size": stat.st_size, "mtime": stat.st_mtime, "sha1": cls.file_hash(filepath)}
+
+    def is_current(self, filepath, settings):
+        """
+        True if filepath was processed with the same settings, is unchanged and all of its outputs exist.
+        The content hash is only computed if size matches but mtime differs.
+        """
+        entry = self.entries.get(os.path.abspath(filepath))
+        if entry is None or entry["settings"] != settings:
+            return False
+        if not all(os.path.exists(os.path.join(self.outdir, f)) for f in entry["outputs"]):
+            return False
+        stat = os.stat(filepath)
+        if stat.st_size != entry["size"]:
+            return False
+        if stat.st_mtime != entry["mtime"]:
+            if self.file_hash(filepath) != entry["sha1"]:
+                return False
+            # touched but unchanged
+            entry["mtime"] = stat.st_mtime
+        return True
+
+    def record(self, filepath, settings, outputs, fingerprint=None):
+        """
+        Parameters:
+        -----------------------------------------
+        filepath: str,
+                input file
+        settings: dict,
+                json serializable processing settings
+        outputs: list of str,
+                file names of the outputs in outdir
+        fingerprint: dict,
+                optional, fingerprint of the input taken before processing
+
+        Outputs of a previous entry of filepath that are not produced anymore, i.e. the mzML of msconvert or
+        mgfs of other settings, are removed unless another entry lists them.
+        """
+        key = os.path.abspath(filepath)
+        previous = self.entries.get(key)
+        if previous is not None:
+            listed = set(f for k, e in self.entries.items() if k != key for f in e["outputs"])
+            for f in sorted(set(previous["outputs"]) - set(outputs) - listed):
+                stale_path = os.path.join(self.outdir, f)
+                if os.path.exists(stale_path):
+                    os.remove(stale_path)
+                    print("removed output of a previous run: %s" % stale_path)
+        entry = dict(fingerprint or self.fingerprint(filepath))
+        entry["settings"] = settings
+        entry["outputs"] = sorted(outputs)
+        self.entries[key] = entry
+
+    def save(self):
+        tmp_path = self.path + ".part"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        replace_file(tmp_path, self.path)
+
+
+def processing_settings(mscon_settings, split_acq, detector_filter, inprocess_filters=False):
+    """settings that determine the preprocessing outputs, as recorded in the manifest"""
+    return {"mscon_settings": list(mscon_settings), "split_acq": split_acq, "detector_filter": detector_filter,
+            "inprocess_filters": inprocess_filters}
+
+
+# msconvert filters that have an in-process equivalent, peakPicking is implied for centroided mzML.
+# titleMaker is not applied in-process, inputs with a titleMaker filter are converted with msconvert
+g_inprocess_filter_names = ("peakPicking", "msLevel", "MS2Denoise")
+
+
+def use_inprocess_filters(inprocess_filters, mscon_settings):
+    """
+    inprocess_filters unless mscon_settings contain a filter without in-process equivalent,
+    then all inputs fall back to msconvert
+    """
+    if not inprocess_filters:
+        return False
+    unsupported = [s for s in mscon_settings if s.split() and s.split()[0] not in g_inprocess_filter_names]
+    if unsupported:
+        print("filters without in-process equivalent, converting with msconvert: %s" % ", ".join(unsupported))
+        return False
+    return True
 
-    conv_cmds = mscon_cmd(filepath=filepath, outdir=outdir, settings=mscon_settings, mgf=not split_acq)
+
+def is_inprocess_input(filepath, split_acq, inprocess_filters):
+    """
+    True if filepath is split without msconvert: mzML input is filtered in-process,
+    the msLevel filter is implied by split_mzml and MS2Denoise is applied by denoise_ms2_peaks
+    inprocess_filters has to be checked against the msconvert settings with use_inprocess_filters
+    """
+    return inprocess_filters and split_acq and filepath.lower().endswith('.mzml')
+
+
+def convert_file(filepath, outdir, mscon_settings, split_acq, mscon_exe):
+    """
+    first preprocessing stage: converts filepath with msconvert
+    msconvert writes into a temporary directory, outputs are moved into outdir once it finished successfully
+
+    Return: list of output file names in outdir, None if msconvert failed
+    """
+    filename = os.path.split(filepath)[1]
+    tmp_dir = os.path.join(outdir, "." + filename + ".part")
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    conv_cmds = mscon_cmd(filepath=filepath, outdir=tmp_dir, settings=mscon_settings, mgf=not split_acq)
 
     if len(conv_cmds) > 0:
         msconvert = subprocess.Popen([mscon_exe] + conv_cmds)
         msconvert.communicate()
+        if msconvert.returncode != 0:
+            print("msconvert failed with exit code %i for: %s" % (msconvert.returncode, filepath))
+            shutil.rmtree(tmp_dir)
+            return None
+
+    outputs = os.listdir(tmp_dir)
+    for f in outputs:
+        replace_file(os.path.join(tmp_dir, f), os.path.join(outdir, f))
+    shutil.rmtree(tmp_dir)
+    return outputs
+
+
+def convert_task(filepath, inprocess_filters=False, **kwargs):
+    """
+    worker function of the conversion stage, fingerprints the input before converting it
+    mzML inputs are not converted if inprocess_filters is set
+    Return: tuple (filepath, fingerprint, outputs)
+    """
+    fingerprint = PreprocessingManifest.fingerprint(filepath)
+    if is_inprocess_input(filepath, kwargs["split_acq"], inprocess_filters):
+        return filepath, fingerprint, []
+    return filepath, fingerprint, convert_file(filepath, **kwargs)
+
+
+def converted_mzml(filepath, outdir):
+    """path of the mzML file msconvert writes for filepath"""
+    filename = os.path.split(filepath)[1]
+    return os.path.join(outdir, filename[:filename.rfind('.')] + '.mzML')
+
+
+def write_split_mgfs(splitted_spectra, filepath, outdir):
+    """
+    writes one mgf per fragmentation method: <outdir>/<fragMethod>_<run>.mgf
+    Return: list of output file names
+    """
+    filename = os.path.split(filepath)[1]
+    outputs = []
+    for acq in splitted_spectra:
+        outfile = acq + '_' + filename[:filename.rfind('.')] + '.mgf'
+        write_mgf(spectra=splitted_spectra[acq], outfile=os.path.join(outdir, outfile + ".part"))
+        replace_file(os.path.join(outdir, outfile + ".part"), os.path.join(outdir, outfile))
+        outputs.append(outfile)
+    return outputs
+
+
+def process_file(filepath, outdir, mscon_settings, split_acq, detector_filter, mscon_exe, split_nthr=1,
+                 inprocess_filters=False):
+    inprocess_filters = use_inprocess_filters(inprocess_filters, mscon_settings)
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    manifest = PreprocessingManifest(outdir)
+    settings = processing_settings(mscon_settings, split_acq, detector_filter, inprocess_filters)
+    if manifest.is_current(filepath, settings):
+        return
+
+    fingerprint = PreprocessingManifest.fingerprint(filepath)
+    if is_inprocess_input(filepath, split_acq, inprocess_filters):
+        outputs = []
+        mzml_file = filepath
+        denoise = parse_ms2denoise(mscon_settings)
+    else:
+        outputs = convert_file(filepath, outdir, mscon_settings, split_acq, mscon_exe)
+        mzml_file = converted_mzml(filepath, outdir)
+        denoise = None
+    if outputs is None:
+        return
 
     if split_acq:
-        filename = os.path.split(filepath)[1]
-        mzml_file = os.path.join(outdir, filename[:filename.rfind('.')]+'.mzML')
-        splitted_spectra = split_mzml(mzml_file, detector_filter)
+        splitted_spectra = split_mzml(mzml_file, detector_filter, nthr=split_nthr, denoise=denoise)
+        outputs += write_split_mgfs(splitted_spectra, filepath, outdir)
+    manifest.record(filepath, settings, outputs, fingerprint)
+    manifest.save()
+
+
+def order_by_size(full_paths):
+    """sorts files largest first, so that big runs do not end up in the tail of the schedule"""
+    return sorted(full_paths, key=lambda x: os.path.getsize(x) if os.path.isfile(x) else 0, reverse=True)
+
+
+def split_task(task, detector_filter):
+    """
+    worker function of the splitting stage
+    task: tuple (filepath, mzml_file, shard_no, n_shards, spectrum_range, denoise)
+    """
+    filepath, mzml_file, shard_no, n_shards, spectrum_range, denoise = task
+    return filepath, shard_no, n_shards, split_mzml_range(spectrum_range, mzml_file, detector_filter, denoise)
+
 
-        for acq in splitted_spectra:
-            write_mgf(spectra=splitted_spectra[acq],
-                      outfile=os.path.join(outdir, acq + '_' + filename[:filename.rfind('.')]+'.mgf'))
+def generate_split_tasks(converted, outdir, split_nthr, converted_info, inprocess_filters=False, denoise=None,
+                         shard_size=256 * 1024 ** 2):
+    """
+    expands each converted file into scan range tasks as soon as its conversion is finished
+    the number of shards grows with the mzML size, up to 4 * split_nthr
+    fingerprint and conversion outputs are stored in converted_info {filepath: (fingerprint, outputs)}
+    denoise is applied to inputs that were not converted (see is_inprocess_input)
+    """
+    for filepath, fingerprint, outputs in converted:
+        if outputs is None:
+            continue
+        converted_info[filepath] = (fingerprint, outputs)
+        if is_inprocess_input(filepath, True, inprocess_filters):
+            mzml_file = filepath
+            file_denoise = denoise
+        else:
+            mzml_file = converted_mzml(filepath, outdir)
+            file_denoise = None
+        n_shards = max(1, min(4 * split_nthr, int(os.path.getsize(mzml_file) // shard_size)))
+        ranges = shard_mzml(mzml_file, n_shards)
+        for shard_no, spectrum_range in enumerate(ranges):
+            yield filepath, mzml_file, shard_no, len(ranges), spectrum_range, file_denoise
+
+
+def schedule_files(full_paths, outdir, mscon_settings, split_acq, detector_filter, mscon_exe,
+                   mscon_nthr=1, split_nthr=1, inprocess_filters=False):
+    """
+    Two stage preprocessing scheduler.
+    Files are converted largest first by up to mscon_nthr concurrent msconvert processes. Finished conversions
+    are streamed into a separate pool of split_nthr processes that splits them in scan range shards,
+    so idle splitting workers pick up shards of whichever file is converted next.
+    Files that the manifest in outdir lists as processed with the same settings are skipped.
+    With inprocess_filters and split_acq, centroided mzML inputs skip msconvert and are denoised while splitting,
+    unless mscon_settings contain filters without in-process equivalent (see use_inprocess_filters).
+
+    Return: generator of processed filepaths, in order of completion
+    """
+    inprocess_filters = use_inprocess_filters(inprocess_filters, mscon_settings)
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    manifest = PreprocessingManifest(outdir)
+    settings = processing_settings(mscon_settings, split_acq, detector_filter, inprocess_filters)
+    full_paths = [f for f in full_paths if not manifest.is_current(f, settings)]
+    if len(full_paths) == 0:
+        manifest.save()
+        return
+
+    # fork the splitting workers before any conversion thread is running
+    split_pool = Pool(processes=split_nthr) if split_acq else None
+    # msconvert runs as a subprocess, threads are sufficient to limit its concurrency
+    conv_pool = ThreadPool(processes=mscon_nthr)
+    try:
+        converted = conv_pool.imap_unordered(
+            partial(convert_task, inprocess_filters=inprocess_filters, outdir=outdir, mscon_settings=mscon_settings,
+                    split_acq=split_acq, mscon_exe=mscon_exe),
+            order_by_size(full_paths))
+
+        if not split_acq:
+            for filepath, fingerprint, outputs in converted:
+                if outputs is None:
+                    continue
+                manifest.record(filepath, settings, outputs, fingerprint)
+                manifest.save()
+                yield filepath
+        else:
+            pending_shards = {}
+            converted_info = {}
+            for filepath, shard_no, n_shards, shard_result in split_pool.imap_unordered(
+                    partial(split_task, detector_filter=detector_filter),
+                    generate_split_tasks(converted, outdir, split_nthr, converted_info, inprocess_filters,
+                                         parse_ms2denoise(mscon_settings))):
+                pending_shards.setdefault(filepath, {})[shard_no] = shard_result
+                if len(pending_shards[filepath]) == n_shards:
+                    shards = pending_shards.pop(filepath)
+                    splitted_spectra = merge_split_results([shards[i] for i in range(n_shards)])
+                    fingerprint, outputs = converted_info.pop(filepath)
+                    outputs = outputs + write_split_mgfs(splitted_spectra, filepath, outdir)
+                    manifest.record(filepath, settings, outputs, fingerprint)
+                    manifest.save()
+                    yield filepath
+            split_pool.close()
+            split_pool.join()
+        conv_pool.close()
+        conv_pool.join()
+    finally:
+        # also if a stage failed or the generator was closed early, no worker outlives it
+        conv_pool.terminate()
+        if split_pool is not None:
+            split_pool.terminate()
 
 
 if __name__ == '__main__':
@@ -364,8 +697,14 @@ if __name__ == '__main__':
     else:
         full_paths = [input_arg]
 
-    pool = Pool(processes=nthr)
-    pool.map(partial(process_file, outdir=outdir, mscon_settings=mscon_settings, split_acq=split_acq,
-                     detector_filter=detector_filter, mscon_exe=msconvert_exe), full_paths)
-    pool.close()
-    pool.join()
+    # msconvert concurrency defaults to the number of splitting processes
+    if 'mscon_nthr' not in locals():
+        mscon_nthr = nthr
+    if 'inprocess_filters' not in locals():
+        inprocess_filters = False
+
+    for processed_file in schedule_files(full_paths, outdir=outdir, mscon_settings=mscon_settings,
+                                         split_acq=split_acq, detector_filter=detector_filter,
+                                         mscon_exe=msconvert_exe, mscon_nthr=mscon_nthr, split_nthr=nthr,
+                                         inprocess_filters=inprocess_filters):
+        print("processed: %s" % processed_file)
@@ -1,5 +1,12 @@
 msconvert_exe = 'C:/Program Files/ProteoWizard/ProteoWizard 3.0.9740/msconvert.exe'
 mscon_settings = ['peakPicking true 2-', 'msLevel 2-', 'MS2Denoise 20 100 false', 'titleMaker <RunId>.<ScanNumber>.<ScanNumber>.<ChargeState>']
 split_acq = False
+# opt-in, off by default: split centroided mzML inputs without msconvert, MS2Denoise of mscon_settings is
+# approximated in-process and the output is not identical to msconvert output.
+# inputs are converted with msconvert if mscon_settings contain other filters than peakPicking, msLevel and
+# MS2Denoise, i.e. titleMaker
+inprocess_filters = False
 detector_filter = 'all'
 nthr = 2
+# concurrent msconvert processes, defaults to nthr
+mscon_nthr = 2
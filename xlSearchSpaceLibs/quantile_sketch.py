@@ -0,0 +1,236 @@
+"""
+Mergeable quantile sketches of xiFDR score distributions.
+
+TDigest summarizes a distribution by at most about compression / 2 weighted centroids. Values are buffered and
+compressed in vectorized passes: the centroids are sorted and merged within unit steps of the scale function
+k(q) = compression / (2 pi) * asin(2q - 1), which keeps centroids near the tails small. Quantile estimates have a rank
+error in the order of 1 / compression in the middle of the distribution and less towards the tails. Digests merge by
+compressing their centroids together, so per file digests combine to replicates, link types and experiments.
+
+file_sketches reads a xiFDR result file in chunks and builds one digest of TT scores per link type. It is stored
+in a sidecar file next to the results (<result file>.sketch.json) and recomputed when size or mtime change.
+"""
+import json
+import logging
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    from xlSearchSpaceLibs import list_files
+    from xlSearchSpaceLibs import xifdr_result_reading
+except ImportError:
+    import list_files
+    import xifdr_result_reading
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+g_link_types = ("between", "internal")
+
+
+class TDigest(object):
+    """
+    :param compression: accuracy parameter, the number of centroids is about compression / 2
+    :param buffer_size: number of values buffered before they are compressed into the centroids
+    """
+    def __init__(self, compression=200., buffer_size=10000):
+        self.compression = float(compression)
+        self.buffer_size = buffer_size
+        self.means = np.zeros(0)
+        self.weights = np.zeros(0)
+        self.min = float("inf")
+        self.max = float("-inf")
+        self._buffer = []
+        self._buffered = 0
+
+    def __len__(self):
+        """number of values summarized"""
+        self.compress()
+        return int(self.weights.sum())
+
+    def k(self, q):
+        return self.compression / (2 * math.pi) * np.arcsin(2 * np.clip(q, 0., 1.) - 1)
+
+    def update(self, values, weights=None):
+        """adds values, nan values are ignored"""
+        values = np.asarray(values, dtype=float).ravel()
+        weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=float).ravel()
+        keep = ~np.isnan(values)
+        values, weights = values[keep], weights[keep]
+        if not len(values):
+            return self
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self._buffer.append((values, weights))
+        self._buffered += len(values)
+        if self._buffered >= self.buffer_size:
+            self.compress()
+        return self
+
+    def compress(self):
+        if not self._buffer:
+            return
+        means = np.concatenate([self.means] + [v for v, _ in self._buffer])
+        weights = np.concatenate([self.weights] + [w for _, w in self._buffer])
+        self._buffer = []
+        self._buffered = 0
+        order = np.argsort(means, kind="mergesort")
+        means, weights = means[order], weights[order]
+        cum = np.cumsum(weights)
+        # centroids whose centers fall into the same unit step of k are merged
+        bins = np.floor(self.k((cum - weights / 2.) / cum[-1])).astype(np.int64)
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(bins)) + 1])
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+
+    def merge(self, other):
+        """adds the centroids of another digest"""
+        other.compress()
+        if len(other.means):
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+            self._buffer.append((other.means, other.weights))
+            self._buffered += len(other.means)
+            self.compress()
+        return self
+
+    @classmethod
+    def merged(cls, digests, compression=None):
+        """:return: new TDigest of all digests"""
+        digests = list(digests)
+        if compression is None:
+            compression = digests[0].compression if digests else 200.
+        result = cls(compression)
+        for d in digests:
+            result.merge(d)
+        return result
+
+    def _knots(self):
+        """cumulative weights of the centroid centers, with min and max at the ends"""
+        self.compress()
+        cum = np.cumsum(self.weights)
+        total = cum[-1]
+        positions = np.concatenate([[0.], cum - self.weights / 2., [total]])
+        values = np.concatenate([[self.min], self.means, [self.max]])
+        return positions, values, total
+
+    def quantile(self, q):
+        """:return: estimated q quantile, q may be an array"""
+        if not len(self.means) and not self._buffer:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else float("nan")
+        positions, values, total = self._knots()
+        result = np.interp(np.asarray(q, dtype=float) * total, positions, values)
+        return result if np.ndim(q) else float(result)
+
+    def cdf(self, x):
+        """:return: estimated fraction of values <= x, x may be an array"""
+        if not len(self.means) and not self._buffer:
+            return np.full(np.shape(x), np.nan) if np.ndim(x) else float("nan")
+        positions, values, total = self._knots()
+        result = np.interp(np.asarray(x, dtype=float), values, positions / total, left=0., right=1.)
+        return result if np.ndim(x) else float(result)
+
+    def to_dict(self):
+        self.compress()
+        return {"compression": self.compression, "min": self.min, "max": self.max,
+                "means": self.means.tolist(), "weights": self.weights.tolist()}
+
+    @classmethod
+    def from_dict(cls, d):
+        digest = cls(d["compression"])
+        digest.means = np.asarray(d["means"], dtype=float)
+        digest.weights = np.asarray(d["weights"], dtype=float)
+        digest.min = float(d["min"]) if d["means"] else float("inf")
+        digest.max = float(d["max"]) if d["means"] else float("-inf")
+        return digest
+
+
+def signature(f):
+    stat = os.stat(f)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def compute_file_sketches(f, compression=200., chunksize=100000):
+    """:return: dict link type -> TDigest of the TT scores of a xiFDR result file, read in chunks"""
+    digests = dict((t, TDigest(compression)) for t in g_link_types)
+    for chunk in pd.read_csv(f, usecols=["Score", "isTT", "fdrGroup"], chunksize=chunksize):
+        df_between, df_internal = xifdr_result_reading.split_int_betw(chunk[chunk["isTT"].astype(bool)])
+        digests["between"].update(df_between["Score"].values)
+        digests["internal"].update(df_internal["Score"].values)
+    return digests
+
+
+def file_sketches(f, compression=200., sidecar=True):
+    """
+    :return: dict link type -> TDigest of a xiFDR result file, from its sidecar <f>.sketch.json if that is current
+    :param sidecar: read and write the sidecar file
+    """
+    sketch_file = f + ".sketch.json"
+    if sidecar and os.path.exists(sketch_file):
+        with open(sketch_file) as fh:
+            stored = json.load(fh)
+        if stored.get("signature") == signature(f) and stored.get("compression") == compression:
+            return dict((t, TDigest.from_dict(d)) for t, d in stored["sketches"].items())
+    digests = compute_file_sketches(f, compression)
+    if sidecar:
+        stored = {"signature": signature(f), "compression": compression,
+                  "sketches": dict((t, d.to_dict()) for t, d in digests.items())}
+        try:
+            with open(sketch_file + ".part", "w") as fh:
+                json.dump(stored, fh)
+            if os.path.exists(sketch_file):
+                os.remove(sketch_file)
+            os.rename(sketch_file + ".part", sketch_file)
+        except (IOError, OSError) as e:
+            logger.debug("could not write sketch file {}: {}".format(sketch_file, e))
+    return digests
+
+
+def sketches_from_filedict(dct_f, compression=200., exp_regex=r"db_\d+_random_\d+", combine_replicates=True):
+    """
+    counterpart of xifdr_result_reading.scores_from_filedict that keeps sketches instead of all scores
+
+    :param dct_f: dict experiment -> list of replicate files, or a list of files grouped by exp_regex
+    :return: dict (experiment, variable) -> TDigest, variable is the link type if combine_replicates, otherwise
+        'run <i>: <link type> TT'
+    """
+    if isinstance(dct_f, (list, tuple)):
+        dct_f = list_files.group_files_by_experiment(dct_f, exp_regex=exp_regex)
+    sketches = {}
+    for exp in sorted(dct_f, key=list_files.natural_sort_key):
+        for i, f in enumerate(dct_f[exp]):
+            for link_type, digest in file_sketches(f, compression).items():
+                if combine_replicates:
+                    key = (exp, link_type)
+                    if key in sketches:
+                        sketches[key].merge(digest)
+                    else:
+                        sketches[key] = digest
+                else:
+                    sketches[(exp, "run {}: {} TT".format(i + 1, link_type))] = digest
+    return sketches
+
+
+def combine_link_types(sketches):
+    """:return: dict experiment -> TDigest over all link types of the result of sketches_from_filedict"""
+    combined = {}
+    for (exp, _), digest in sorted(sketches.items()):
+        combined[exp] = combined[exp].merge(digest) if exp in combined else TDigest.merged([digest])
+    return combined
+
+
+def quantile_frame(sketches, quantiles=np.linspace(0, 1, 101)):
+    """
+    :param sketches: result of sketches_from_filedict
+    :return: long DataFrame with columns id, variable, quantile and Score, i.e. for distribution plots
+    """
+    frames = []
+    for (exp, variable), digest in sorted(sketches.items()):
+        frames.append(pd.DataFrame({"id": exp, "variable": variable, "quantile": quantiles,
+                                    "Score": digest.quantile(np.asarray(quantiles))}))
+    if not frames:
+        return pd.DataFrame(columns=["id", "variable", "quantile", "Score"])
+    return pd.concat(frames, ignore_index=True)[["id", "variable", "quantile", "Score"]]
@@ -0,0 +1,274 @@
+"""
+Estimate the search space of a FASTA subset before it is searched.
+
+The proteins are digested in silico with the cleavage rules of FDR_funcs.g_enzyme_regex_dict. Peptide masses are
+computed with numpy from cumulative residue masses. Unique peptides with a linkable residue are histogrammed by
+mass, and the histogram convolved with itself gives the number of cross-linked peptide pairs per precursor mass
+bin. Large databases are digested across processes.
+
+The number of peptides and pairs drives runtime and memory of XiSearch, suggest_xmx turns it into a -Xmx value.
+"""
+import logging
+import re
+from collections import Counter
+from multiprocessing import Pool
+
+import numpy as np
+
+try:
+    from xlSearchSpaceLibs.FDR_funcs import g_enzyme_regex_dict
+except ImportError:
+    from FDR_funcs import g_enzyme_regex_dict
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+g_water_mass = 18.0105646837
+g_proton_mass = 1.00727646677
+g_bs3_mass = 138.06808
+g_monoisotopic_residue_masses = {
+    "G": 57.02146, "A": 71.03711, "S": 87.03203, "P": 97.05276, "V": 99.06841, "T": 101.04768, "C": 103.00919,
+    "L": 113.08406, "I": 113.08406, "N": 114.04293, "D": 115.02694, "Q": 128.05858, "K": 128.09496,
+    "E": 129.04259, "M": 131.04049, "H": 137.05891, "F": 147.06841, "U": 150.95364, "R": 156.10111,
+    "Y": 163.06333, "W": 186.07931, "O": 237.14773,
+}
+
+
+def cleavage_regex(enzyme="trypsin"):
+    """
+    turns an enzyme pattern of g_enzyme_regex_dict, i.e. '[KR][^P]+' (a cleavage site followed by residues),
+    into a regex whose matches end at the cleavage positions: '[KR](?=[^P])'
+    """
+    pattern = g_enzyme_regex_dict.get(enzyme, enzyme)
+    match = re.match(r"^(\[[^\]]+\]|\w)(\[[^\]]+\]|\w)\+?$", pattern)
+    if not match:
+        raise ValueError("Can not derive cleavage sites from enzyme pattern '{}'".format(pattern))
+    return re.compile("{}(?={})".format(match.group(1), match.group(2)))
+
+
+def residue_mass_table(fixed_modifications=None):
+    """:return: numpy array of residue masses indexed by ascii code, nan for unknown residues"""
+    table = np.full(256, np.nan)
+    for aa, mass in g_monoisotopic_residue_masses.items():
+        table[ord(aa)] = mass + (fixed_modifications or {}).get(aa, 0.)
+    return table
+
+
+def digest(sequence, site_regex, mass_table, linkable_table, missed_cleavages=2, min_length=5, max_length=40):
+    """
+    :return: tuple (array of start positions, array of end positions, array of masses, bool array linkable)
+        of all peptides of sequence, peptides with unknown residues are left out
+    """
+    n = len(sequence)
+    sites = np.unique(np.array([0] + [m.end() for m in site_regex.finditer(sequence)] + [n]))
+    starts = []
+    ends = []
+    for k in range(1, missed_cleavages + 2):
+        starts.append(sites[:-k])
+        ends.append(sites[k:])
+    starts = np.concatenate(starts)
+    ends = np.concatenate(ends)
+    lengths = ends - starts
+    keep = (lengths >= min_length) & (lengths <= max_length)
+    starts, ends = starts[keep], ends[keep]
+
+    codes = np.frombuffer(sequence.upper().encode("ascii", "replace"), dtype=np.uint8)
+    residue_masses = mass_table[codes]
+    unknown = np.isnan(residue_masses)
+    # unknown residues count 0 in the mass sum and are counted separately, so they only drop the peptides spanning them
+    cum_mass = np.concatenate([[0.], np.cumsum(np.where(unknown, 0., residue_masses))])
+    cum_unknown = np.concatenate([[0], np.cumsum(unknown)])
+    masses = cum_mass[ends] - cum_mass[starts] + g_water_mass
+    # a linkable residue at the c-terminal cleavage site is not available for linking, the protein n-terminus is
+    cum_linkable = np.concatenate([[0], np.cumsum(linkable_table[codes])])
+    c_term_site = ends < n
+    linkable = (cum_linkable[ends - c_term_site] - cum_linkable[starts] > 0) | (starts == 0)
+    known = cum_unknown[ends] == cum_unknown[starts]
+    return starts[known], ends[known], masses[known], linkable[known]
+
+
+def _digest_chunk(args):
+    """digests a list of sequences, :return: dict peptide -> (mass, linkable)"""
+    sequences, enzyme, missed_cleavages, min_length, max_length, fixed_modifications, linkable_residues = args
+    site_regex = cleavage_regex(enzyme)
+    mass_table = residue_mass_table(fixed_modifications)
+    linkable_table = np.zeros(256, dtype=np.int64)
+    for aa in linkable_residues:
+        linkable_table[ord(aa)] = 1
+    peptides = {}
+    for sequence in sequences:
+        starts, ends, masses, linkable = digest(sequence, site_regex, mass_table, linkable_table,
+                                                missed_cleavages, min_length, max_length)
+        for s, e, m, l in zip(starts.tolist(), ends.tolist(), masses.tolist(), linkable.tolist()):
+            peptide = sequence[s:e]
+            if peptide in peptides:
+                l = l or peptides[peptide][1]
+            peptides[peptide] = (m, l)
+    return peptides
+
+
+def self_convolution(hist):
+    """convolution of an integer histogram with itself via FFT, exact after rounding for realistic counts"""
+    n = 2 * len(hist) - 1
+    size = 1 << (n - 1).bit_length()
+    spectrum = np.fft.rfft(hist.astype(float), size)
+    return np.rint(np.fft.irfft(spectrum * spectrum, size)[:n]).astype(np.int64)
+
+
+def find_redundant_proteins(protein_ids, sequences, enzyme="trypsin", missed_cleavages=2, min_length=5,
+                            max_length=40, max_kept=None):
+    """
+    finds proteins whose peptides all belong to proteins ranked before them, i.e. isoforms and paralogs of
+    proteins with higher iBAQ
+
+    :param protein_ids: protein ids ordered by rank, i.e. from IbaqExtraction.get_top_no
+    :param sequences: dict protein id -> sequence, i.e. FastaHandler(...).dict
+    :param max_kept: stop after this many proteins that are not redundant, the rest of protein_ids is not digested
+    :return: tuple (dict redundant protein id -> kept protein sharing most of its peptides, dict of statistics)
+    """
+    site_regex = cleavage_regex(enzyme)
+    mass_table = residue_mass_table()
+    linkable_table = np.zeros(256, dtype=np.int64)
+    peptide_owner = {}
+    redundant = {}
+    seen = set()
+    digested = 0
+    digested_kept = 0
+    for protein_id in protein_ids:
+        if max_kept and len(seen) - len(redundant) >= max_kept:
+            break
+        if protein_id not in sequences or protein_id in seen:
+            continue
+        seen.add(protein_id)
+        sequence = sequences[protein_id]
+        starts, ends, _, _ = digest(sequence, site_regex, mass_table, linkable_table, missed_cleavages,
+                                    min_length, max_length)
+        peptides = set(sequence[s:e] for s, e in zip(starts.tolist(), ends.tolist()))
+        digested += len(peptides)
+        if peptides and all(p in peptide_owner for p in peptides):
+            redundant[protein_id] = Counter(peptide_owner[p] for p in peptides).most_common(1)[0][0]
+        else:
+            digested_kept += len(peptides)
+            for p in peptides:
+                peptide_owner.setdefault(p, protein_id)
+    stats = {
+        "proteins": len(seen),
+        "redundant_proteins": len(redundant),
+        "unique_peptides": len(peptide_owner),
+        "digested_peptides": digested,
+        "digested_peptides_without_redundant": digested_kept,
+        "digested_peptides_shrinkage": 1 - digested_kept / float(digested) if digested else 0.,
+    }
+    logger.info("redundant proteins: {}".format(stats))
+    return redundant, stats
+
+
+class SearchSpaceEstimate(object):
+    """
+    peptide and cross-link pair counts of a database
+
+    pair_counts[i] is the number of unordered pairs of linkable peptides (including homo-pairs) whose precursor
+    mass, crosslinker included, falls into bin i or i + 1: [bin_edges[i], bin_edges[i] + 2 * bin_width).
+    The convolution adds the bins of the two peptides, the fractional parts of their masses add up to up to two
+    bins, so a pair is counted up to one bin below its mass.
+    """
+    def __init__(self, n_proteins, peptide_masses, linkable, crosslinker_mass, bin_width):
+        self.n_proteins = n_proteins
+        self.n_peptides = len(peptide_masses)
+        self.n_linkable_peptides = int(linkable.sum())
+        self.n_pairs = self.n_linkable_peptides * (self.n_linkable_peptides + 1) // 2
+        self.bin_width = bin_width
+        masses = peptide_masses[linkable]
+        if len(masses):
+            offset = 2 * masses.min() + crosslinker_mass
+            bins = ((masses - masses.min()) / bin_width).astype(np.int64)
+            hist = np.bincount(bins)
+            ordered = self_convolution(hist)
+            # ordered pairs count every hetero pair twice and every homo pair once
+            homo = np.bincount(2 * bins, minlength=len(ordered))
+            self.pair_counts = (ordered + homo) // 2
+        else:
+            offset = 0.
+            self.pair_counts = np.zeros(0, dtype=np.int64)
+        self.bin_edges = offset + bin_width * np.arange(len(self.pair_counts) + 1)
+
+    def pairs_in_window(self, precursor_mass, tolerance_ppm=10.):
+        """
+        number of candidate pairs for a precursor (neutral mass) within the tolerance, rounded to whole bins and
+        widened by the bin below, so that all pairs within the tolerance are counted
+        """
+        delta = precursor_mass * tolerance_ppm * 1e-6
+        first = max(0, int(np.searchsorted(self.bin_edges, precursor_mass - delta, side="right")) - 2)
+        last = int(np.searchsorted(self.bin_edges, precursor_mass + delta, side="left"))
+        return int(self.pair_counts[first:last].sum())
+
+    def max_pairs_in_window(self, window=1.):
+        """highest number of pairs in any precursor mass window of the given width in Da, precise to one bin"""
+        n_bins = max(1, int(round(window / self.bin_width)))
+        if len(self.pair_counts) == 0:
+            return 0
+        cum = np.concatenate([[0], np.cumsum(self.pair_counts)])
+        return int((cum[n_bins:] - cum[:-n_bins]).max()) if len(cum) > n_bins else int(cum[-1])
+
+    def to_dict(self):
+        return {
+            "proteins": self.n_proteins,
+            "peptides": self.n_peptides,
+            "linkable_peptides": self.n_linkable_peptides,
+            "pairs": self.n_pairs,
+            "max_pairs_per_da": self.max_pairs_in_window(1.),
+        }
+
+
+def estimate_search_space(sequences, enzyme="trypsin", missed_cleavages=2, min_length=5, max_length=40,
+                          fixed_modifications=None, linkable_residues="K", crosslinker_mass=g_bs3_mass,
+                          bin_width=0.01, nproc=1, chunk_size=500):
+    """
+    :param sequences: dict protein id -> sequence, i.e. FastaHandler(...).dict, or a list of sequences
+    :param enzyme: key of FDR_funcs.g_enzyme_regex_dict or a pattern of the same form
+    :param fixed_modifications: dict residue -> mass shift, i.e. {"C": 57.021464} for carbamidomethylation
+    :param linkable_residues: residues the crosslinker reacts with, the protein n-terminus always is linkable
+    :param bin_width: width of the precursor mass bins in Da
+    :param nproc: number of processes digesting chunks of chunk_size proteins
+    :return: SearchSpaceEstimate
+    """
+    if hasattr(sequences, "values"):
+        sequences = list(sequences.values())
+    chunks = [(sequences[i:i + chunk_size], enzyme, missed_cleavages, min_length, max_length,
+               fixed_modifications, linkable_residues) for i in range(0, len(sequences), chunk_size)]
+    if nproc > 1 and len(chunks) > 1:
+        pool = Pool(nproc)
+        try:
+            results = pool.map(_digest_chunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_digest_chunk(c) for c in chunks]
+    peptides = results[0] if len(results) == 1 else {}
+    if len(results) > 1:
+        for result in results:
+            for peptide, (mass, linkable) in result.items():
+                if peptide in peptides:
+                    linkable = linkable or peptides[peptide][1]
+                peptides[peptide] = (mass, linkable)
+    masses = np.array([v[0] for v in peptides.values()], dtype=float)
+    linkable = np.array([v[1] for v in peptides.values()], dtype=bool)
+    estimate = SearchSpaceEstimate(len(sequences), masses, linkable, crosslinker_mass, bin_width)
+    logger.info("search space of {} proteins: {}".format(len(sequences), estimate.to_dict()))
+    return estimate
+
+
+def suggest_xmx(estimate, base_mb=1024, kb_per_peptide=4., kb_per_linkable_peptide=8.):
+    """
+    suggests a -Xmx value for XiSearch, i.e. for XiWrapper.xi_execution(memory=...)
+
+    The coefficients are rough defaults, they should be fitted to the peak memory recorded by memory_monitor
+    for databases of known size.
+    :return: string of format int[gm], i.e. '6G'
+    """
+    mb = base_mb + (estimate.n_peptides * kb_per_peptide
+                    + estimate.n_linkable_peptides * kb_per_linkable_peptide) / 1024.
+    if mb >= 1024:
+        return "{}G".format(int(np.ceil(mb / 1024.)))
+    return "{}M".format(int(np.ceil(mb)))
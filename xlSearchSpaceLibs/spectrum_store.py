@@ -0,0 +1,217 @@
+"""
+Spectra sorted by precursor neutral mass with a binned index for mass range queries.
+
+SpectrumStore keeps the spectra of MS2_spectrum objects in numpy arrays sorted by MS2_spectrum.getUnchargedMass:
+one array per precursor field and the peaks of all spectra concatenated, with offsets per spectrum. The binned index
+holds the position of the first spectrum of every mass bin, a range query looks up the bins of its bounds and
+bisects only within them. Filtering for many mass windows at once is vectorized.
+
+Stores are saved to and loaded from .npz files and exported as mass sorted MGF shards with mgf_utils.write_mgf.
+"""
+import logging
+import os
+
+import numpy as np
+
+try:
+    from xlSearchSpaceLibs.mgf_utils import MGF_Reader, MS2_spectrum, write_mgf
+    from xlSearchSpaceLibs.search_space_estimation import g_proton_mass
+except ImportError:
+    from mgf_utils import MGF_Reader, MS2_spectrum, write_mgf
+    from search_space_estimation import g_proton_mass
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+def uncharged_masses(pepmass, charge):
+    """vectorized MS2_spectrum.getUnchargedMass, subtracts 1 Da instead of the proton mass per charge"""
+    return pepmass * charge - charge
+
+
+def peak_positions(starts, counts):
+    """:return: positions of the peaks of spectra given by peak start positions and counts, in the given order"""
+    new_starts = np.cumsum(counts) - counts
+    return np.repeat(starts - new_starts, counts) + np.arange(counts.sum(), dtype=np.int64)
+
+
+class SpectrumStore(object):
+    """
+    :param titles, rt, pepmass, pepint, charge: arrays with one entry per spectrum
+    :param peaks: array of shape (n, 2), m/z and intensity of the peaks of all spectra
+    :param peak_offsets: array of len(titles) + 1, the peaks of spectrum i are peaks[peak_offsets[i]:peak_offsets[i+1]]
+    :param bin_width: width of the bins of the mass index in Da
+    """
+    def __init__(self, titles, rt, pepmass, pepint, charge, peaks, peak_offsets, bin_width=1.):
+        pepmass = np.asarray(pepmass, dtype=float)
+        charge = np.asarray(charge, dtype=float)
+        masses = uncharged_masses(pepmass, charge)
+        order = np.argsort(masses, kind="mergesort")
+        self.masses = masses[order]
+        self.titles = np.asarray(titles, dtype=object)[order]
+        self.rt = np.asarray(rt, dtype=float)[order]
+        self.pepmass = pepmass[order]
+        self.pepint = np.asarray(pepint, dtype=float)[order]
+        self.charge = charge[order]
+        peaks = np.asarray(peaks, dtype=float).reshape(-1, 2)
+        peak_offsets = np.asarray(peak_offsets, dtype=np.int64)
+        starts = peak_offsets[:-1][order]
+        counts = np.diff(peak_offsets)[order]
+        self.peak_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        if np.any(order != np.arange(len(order))):
+            self.peaks = peaks[peak_positions(starts, counts)]
+        else:
+            self.peaks = peaks
+        self.bin_width = bin_width
+        self.build_index()
+
+    @classmethod
+    def from_spectra(cls, spectra, bin_width=1.):
+        """:param spectra: iterable of MS2_spectrum, i.e. an MGF_Reader"""
+        titles, rt, pepmass, pepint, charge, peaks, counts = [], [], [], [], [], [], []
+        for s in spectra:
+            titles.append(s.getTitle())
+            rt.append(s.getRT())
+            pepmass.append(s.getPrecursorMass())
+            pepint.append(s.getPrecursorIntensity())
+            charge.append(s.charge)
+            p = np.asarray(list(s.peaks) if not isinstance(s.peaks, np.ndarray) else s.peaks, dtype=float)
+            p = p.reshape(-1, 2)
+            peaks.append(p)
+            counts.append(len(p))
+        peaks = np.concatenate(peaks) if peaks else np.zeros((0, 2))
+        offsets = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)])
+        return cls(titles, rt, pepmass, pepint, charge, peaks, offsets, bin_width)
+
+    @classmethod
+    def from_mgf(cls, mgf_files, bin_width=1.):
+        def spectra():
+            for f in mgf_files:
+                reader = MGF_Reader()
+                reader.load(f)
+                for s in reader:
+                    yield s
+        return cls.from_spectra(spectra(), bin_width)
+
+    def build_index(self):
+        """bin_starts[b] is the position of the first spectrum with mass >= min_mass + b * bin_width"""
+        if len(self.masses):
+            self.min_mass = np.floor(self.masses[0] / self.bin_width) * self.bin_width
+            n_bins = int((self.masses[-1] - self.min_mass) // self.bin_width) + 2
+        else:
+            self.min_mass = 0.
+            n_bins = 1
+        edges = self.min_mass + self.bin_width * np.arange(n_bins)
+        self.bin_starts = np.searchsorted(self.masses, edges, side="left")
+
+    def __len__(self):
+        return len(self.masses)
+
+    def _bound(self, mass, side):
+        """searchsorted that looks up the bin of mass in the index and only bisects within it"""
+        b = int(np.floor((mass - self.min_mass) / self.bin_width))
+        if b < 0:
+            return 0
+        if b >= len(self.bin_starts) - 1:
+            return len(self.masses)
+        lo, hi = self.bin_starts[b], self.bin_starts[b + 1]
+        return int(lo + np.searchsorted(self.masses[lo:hi], mass, side=side))
+
+    def range_slice(self, min_mass, max_mass):
+        """:return: slice of the spectra with min_mass <= neutral mass <= max_mass"""
+        start = self._bound(min_mass, "left")
+        return slice(start, max(start, self._bound(max_mass, "right")))
+
+    def window_mask(self, min_masses, max_masses):
+        """:return: bool array, True for spectra within any of the mass windows [min_masses[i], max_masses[i]]"""
+        starts = np.searchsorted(self.masses, np.asarray(min_masses, dtype=float), side="left")
+        stops = np.searchsorted(self.masses, np.asarray(max_masses, dtype=float), side="right")
+        # +1 at every window start, -1 at every window end, positive running sum inside any window
+        delta = np.zeros(len(self.masses) + 1, dtype=np.int64)
+        np.add.at(delta, starts, 1)
+        np.add.at(delta, stops, -1)
+        return np.cumsum(delta[:-1]) > 0
+
+    def search_space_mask(self, estimate, tolerance_ppm=10.):
+        """
+        :param estimate: search_space_estimation.SearchSpaceEstimate
+        :return: bool array, True for spectra with at least one candidate pair within the precursor tolerance
+        """
+        occupied = estimate.pair_counts > 0
+        if not occupied.any():
+            return np.zeros(len(self), dtype=bool)
+        bins = np.flatnonzero(occupied)
+        # neighbouring occupied bins are joined into one window
+        breaks = np.flatnonzero(np.diff(bins) > 1)
+        first = bins[np.concatenate([[0], breaks + 1])]
+        last = bins[np.concatenate([breaks, [len(bins) - 1]])]
+        lows = estimate.bin_edges[first] / (1 + tolerance_ppm * 1e-6)
+        # pairs counted in bin i have masses up to the end of bin i + 1, see SearchSpaceEstimate
+        highs = (estimate.bin_edges[last + 1] + estimate.bin_width) / (1 - tolerance_ppm * 1e-6)
+        # a spectrum matches a window if it is within the tolerance of it. The store masses subtract 1 Da per charge
+        # and are charge * (proton mass - 1) above the neutral masses of the estimate, so the windows are shifted
+        # per charge
+        mask = np.zeros(len(self), dtype=bool)
+        for charge in np.unique(self.charge):
+            offset = charge * (g_proton_mass - 1.)
+            mask |= self.window_mask(lows + offset, highs + offset) & (self.charge == charge)
+        return mask
+
+    def spectrum(self, i):
+        """:return: MS2_spectrum at position i"""
+        return MS2_spectrum(self.titles[i], self.rt[i], self.pepmass[i], self.pepint[i], self.charge[i],
+                            self.peaks[self.peak_offsets[i]:self.peak_offsets[i + 1]])
+
+    def spectra(self, selection=slice(None)):
+        """:return: generator of MS2_spectrum of a slice, bool mask or index array, in mass order"""
+        for i in np.arange(len(self))[selection].tolist():
+            yield self.spectrum(i)
+
+    def query(self, min_mass, max_mass):
+        """:return: list of MS2_spectrum with min_mass <= neutral mass <= max_mass"""
+        return list(self.spectra(self.range_slice(min_mass, max_mass)))
+
+    def subset(self, selection):
+        """:return: SpectrumStore of a slice, bool mask or index array"""
+        index = np.arange(len(self))[selection]
+        counts = np.diff(self.peak_offsets)[index]
+        peaks = self.peaks[peak_positions(self.peak_offsets[:-1][index], counts)]
+        return SpectrumStore(self.titles[index], self.rt[index], self.pepmass[index], self.pepint[index],
+                             self.charge[index], peaks,
+                             np.concatenate([[0], np.cumsum(counts)]), self.bin_width)
+
+    def save(self, filename):
+        np.savez(filename, titles=self.titles.astype(str), rt=self.rt, pepmass=self.pepmass, pepint=self.pepint,
+                 charge=self.charge, peaks=self.peaks, peak_offsets=self.peak_offsets,
+                 bin_width=np.array(self.bin_width))
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            return cls(data["titles"].astype(object), data["rt"], data["pepmass"], data["pepint"], data["charge"],
+                       data["peaks"], data["peak_offsets"], float(data["bin_width"]))
+
+    def write_mgf_shards(self, out_dir, n_shards=None, max_spectra=None, basename="spectra", batch_size=1000):
+        """
+        writes the spectra in mass order into MGF files of consecutive mass ranges
+
+        :param n_shards: number of shards with equal number of spectra, or
+        :param max_spectra: maximal number of spectra per shard
+        :return: list of (MGF file, lowest neutral mass, highest neutral mass)
+        """
+        if n_shards is None:
+            n_shards = max(1, int(np.ceil(len(self) / float(max_spectra)))) if max_spectra else 1
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        bounds = np.linspace(0, len(self), n_shards + 1).astype(int)
+        shards = []
+        for i, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+            if start == stop:
+                continue
+            filename = os.path.join(out_dir, "{}_{}.mgf".format(basename, i))
+            for batch_start in range(start, stop, batch_size):
+                write_mgf(self.spectra(slice(batch_start, min(stop, batch_start + batch_size))), filename,
+                          mode="w" if batch_start == start else "a")
+            shards.append((filename, float(self.masses[start]), float(self.masses[stop - 1])))
+        logger.info("wrote {} spectra into {} mass sorted MGF files".format(len(self), len(shards)))
+        return shards
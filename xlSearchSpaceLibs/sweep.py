@@ -0,0 +1,283 @@
+"""
+Search space sweep: iBAQ based protein selection -> sub database FASTA -> XiSearch and xiFDR, end to end.
+
+For every cutoff, number of added random proteins and replicate the sweep selects proteins with IbaqExtraction,
+writes the database with FastaHandler.build_fasta and searches it with pipeline.execute_pipeline. Databases are
+built and searched nthr at a time.
+Databases with identical content are only searched once, they are stored as fasta/<sha1>.fasta and searched in
+search/<sha1>/. The xiFDR results are linked into the layout that xifdr_reevaluation and xifdr_result_reading
+expect:
+
+output_dir/results/db_<number of selected proteins>_random_<number of random proteins>/FDR_rep<i>_..._summary_...csv
+
+The progress is kept in output_dir/sweep_state.json, a restarted sweep continues where it stopped. The spans of
+all database builds and searches are written to output_dir/sweep_report.json, every search additionally writes the
+run report of execute_pipeline to its search dir.
+"""
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import threading
+from multiprocessing.pool import ThreadPool
+
+try:
+    from xlSearchSpaceLibs import instrumentation, pipeline
+    from xlSearchSpaceLibs.iBAQ_FASTA_handler import IbaqExtraction, FastaHandler
+except ImportError:
+    import instrumentation
+    import pipeline
+    from iBAQ_FASTA_handler import IbaqExtraction, FastaHandler
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# selection methods of IbaqExtraction a sweep can use, cutoff is their only argument
+g_selection_methods = ["top_no", "perc_higher_than", "rel_log_higher_than", "top_quant"]
+
+
+def file_sha1(filename, chunk_size=1024 * 1024):
+    sha1 = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def db_key(n_selected, n_random):
+    """experiment key as parsed by xifdr_result_reading"""
+    return "db_{}_random_{}".format(n_selected, n_random)
+
+
+def link_or_copy(src, dst):
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except (OSError, AttributeError):
+        shutil.copy2(src, dst)
+
+
+class SearchSpaceSweep(object):
+    """
+    :param protein_groups_file: MaxQuant proteinGroups.txt the proteins are selected from
+    :param reference_fasta: FASTA the sequences and the random proteins are taken from
+    :param xi_config: XiSearch config
+    :param peak_files: list of peak files
+    :param output_dir: base dir of the sweep
+    :param cutoffs: list of cutoffs for the selection method, i.e. protein numbers for 'top_no'
+    :param method: one of g_selection_methods
+    :param n_random: list of numbers of random reference proteins added to each selection
+    :param replicates: number of replicates of each database, replicates differ in their random proteins
+    :param seed: seed of the random protein selection
+    :param nthr: number of concurrent database builds and searches
+    :param pipeline_kwargs: dict of further arguments for pipeline.execute_pipeline, i.e. xi_memory
+    :param run_report: file name of the run report in output_dir, None to disable
+    :param report_sample_interval: seconds between psutil RSS samples of the run report spans
+    """
+    state_filename = "sweep_state.json"
+
+    def __init__(self, protein_groups_file, reference_fasta, xi_config, peak_files, output_dir, cutoffs,
+                 method="top_no", n_random=(0,), replicates=1, seed=0, nthr=1, pipeline_kwargs=None,
+                 ibaq_index="Majority protein IDs", keep_contaminants=False, re_id_pattern=r'^>.*\|(.*)\|.*',
+                 run_report="sweep_report.json", report_sample_interval=None):
+        assert method in g_selection_methods, \
+            "method needs to be in {} but is {}".format(g_selection_methods, method)
+        self.protein_groups_file = protein_groups_file
+        self.reference_fasta = reference_fasta
+        self.xi_config = xi_config
+        self.peak_files = list(peak_files)
+        self.output_dir = output_dir
+        self.cutoffs = list(cutoffs)
+        self.method = method
+        self.n_random = list(n_random)
+        self.replicates = replicates
+        self.seed = seed
+        self.nthr = nthr
+        self.pipeline_kwargs = pipeline_kwargs or {}
+        self.ibaq_index = ibaq_index
+        self.keep_contaminants = keep_contaminants
+        self.re_id_pattern = re_id_pattern
+        self.run_report = run_report
+        self.report_sample_interval = report_sample_interval
+        self.fasta_dir = os.path.join(output_dir, "fasta")
+        self.search_dir = os.path.join(output_dir, "search")
+        self.results_dir = os.path.join(output_dir, "results")
+        self.state_lock = threading.Lock()
+        self.state = self.load_state()
+        self._ibaq = None
+        self._fasta = None
+
+    @property
+    def ibaq(self):
+        if self._ibaq is None:
+            self._ibaq = IbaqExtraction(self.protein_groups_file, keep_contaminants=self.keep_contaminants,
+                                        index=self.ibaq_index)
+        return self._ibaq
+
+    @property
+    def fasta(self):
+        if self._fasta is None:
+            self._fasta = FastaHandler(self.reference_fasta, self.re_id_pattern)
+        return self._fasta
+
+    def load_state(self):
+        state_file = os.path.join(self.output_dir, self.state_filename)
+        if os.path.exists(state_file):
+            with open(state_file) as f:
+                return json.load(f)
+        return {"databases": {}, "searches": {}, "results": {}}
+
+    def save_state(self):
+        """writes the state atomically, call with state_lock held"""
+        state_file = os.path.join(self.output_dir, self.state_filename)
+        with open(state_file + ".part", "w") as f:
+            json.dump(self.state, f, indent=2, sort_keys=True)
+        if os.path.exists(state_file):
+            os.remove(state_file)
+        os.rename(state_file + ".part", state_file)
+
+    def select(self, cutoff):
+        return getattr(self.ibaq, "get_" + self.method)(cutoff)
+
+    def random_proteins(self, selected, n, replicate, key):
+        if n == 0:
+            return []
+        selected = set(selected)
+        candidates = sorted(p for p in self.fasta.dict if p not in selected)
+        rng = random.Random(int(hashlib.sha1("{}_{}_{}".format(self.seed, key, replicate).encode())
+                                .hexdigest(), 16))
+        return rng.sample(candidates, min(n, len(candidates)))
+
+    def plan(self):
+        """
+        :return: list of dicts with db_key, replicate and the protein ids of each database of the sweep
+        """
+        planned = []
+        keys = set()
+        for cutoff in self.cutoffs:
+            selected = self.select(cutoff)
+            for n in self.n_random:
+                key = db_key(len(selected), n)
+                if key in keys:
+                    # different cutoffs leading to the same selection
+                    continue
+                keys.add(key)
+                for replicate in range(1, self.replicates + 1):
+                    proteins = list(selected) + self.random_proteins(selected, n, replicate, key)
+                    planned.append({"db_key": key, "replicate": replicate, "proteins": proteins})
+        return planned
+
+    def build_database(self, entry):
+        """writes the database of a plan entry unless identical content exists, :return: sha1 of its content"""
+        id_key = "{}/rep{}".format(entry["db_key"], entry["replicate"])
+        content_hash = self.state["databases"].get(id_key)
+        if content_hash and os.path.exists(os.path.join(self.fasta_dir, content_hash + ".fasta")):
+            return content_hash
+        tmp_fasta = os.path.join(self.fasta_dir, ".{}_rep{}.fasta".format(entry["db_key"], entry["replicate"]))
+        with instrumentation.span("build_database", db_key=entry["db_key"], replicate=entry["replicate"]) as s:
+            self.fasta.build_fasta(entry["proteins"], tmp_fasta)
+            content_hash = file_sha1(tmp_fasta)
+            s.attributes["sha1"] = content_hash
+        with self.state_lock:
+            # concurrent builds of identical content move their files under the lock
+            for suffix in ("", "-not_found_in_reference"):
+                src = os.path.splitext(tmp_fasta)[0] + suffix + ".fasta"
+                dst = os.path.join(self.fasta_dir, content_hash + suffix + ".fasta")
+                if os.path.exists(dst):
+                    os.remove(src)
+                else:
+                    os.rename(src, dst)
+            self.state["databases"][id_key] = content_hash
+            self.save_state()
+        return content_hash
+
+    def search(self, content_hash):
+        """runs xi and xifdr for one database, :return: (content_hash, error message or None)"""
+        if content_hash in self.state["searches"]:
+            return content_hash, None
+        fasta_file = os.path.join(self.fasta_dir, content_hash + ".fasta")
+        try:
+            with instrumentation.span("search", input_files=self.peak_files + [fasta_file], sha1=content_hash) as s:
+                xi_result, xifdr_results = pipeline.execute_pipeline(
+                    list_of_fasta_dbs=[fasta_file], xi_config=self.xi_config, peak_files=self.peak_files,
+                    output_basedir=os.path.join(self.search_dir, content_hash), **self.pipeline_kwargs)
+                s.output_files.extend([xi_result] + sorted(xifdr_results))
+        except Exception as e:
+            logger.error("search of database {} failed: {}".format(content_hash, e))
+            return content_hash, "{}: {}".format(type(e).__name__, e)
+        with self.state_lock:
+            self.state["searches"][content_hash] = {"xi_result": xi_result, "xifdr_results": sorted(xifdr_results)}
+            self.save_state()
+        return content_hash, None
+
+    def link_results(self, entry, content_hash):
+        """links the xiFDR results of a database into results/<db_key> with the replicate in the file name"""
+        id_key = "{}/rep{}".format(entry["db_key"], entry["replicate"])
+        linked = self.state["results"].get(id_key)
+        if linked and all(os.path.exists(f) for f in linked):
+            return linked
+        out_dir = os.path.join(self.results_dir, entry["db_key"])
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        linked = []
+        for f in self.state["searches"][content_hash]["xifdr_results"]:
+            name = re.sub(r"^FDR", "FDR_rep{}".format(entry["replicate"]), os.path.basename(f))
+            if name == os.path.basename(f):
+                name = "FDR_rep{}_{}".format(entry["replicate"], name)
+            link_or_copy(f, os.path.join(out_dir, name))
+            linked.append(os.path.join(out_dir, name))
+        with self.state_lock:
+            self.state["results"][id_key] = linked
+            self.save_state()
+        return linked
+
+    def run(self):
+        """
+        builds, searches and links all databases of the sweep
+
+        :return: dict, db_key -> list of xiFDR summary files ordered by replicate,
+            the input of xifdr_result_reading.scores_from_filedict
+        """
+        for directory in (self.output_dir, self.fasta_dir, self.search_dir, self.results_dir):
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+        planned = self.plan()
+        # loaded once here, the database builds of the pool share the reference
+        self.fasta
+        report = instrumentation.RunReport("sweep", sample_interval=self.report_sample_interval)
+
+        def in_report(func):
+            # the report is active per thread, the pool threads activate it themselves
+            def wrapped(arg):
+                with instrumentation.activate(report):
+                    return func(arg)
+            return wrapped
+
+        pool = ThreadPool(self.nthr)
+        try:
+            hashes = pool.map(in_report(self.build_database), planned, chunksize=1)
+            unique_hashes = sorted(set(hashes))
+            logger.info("sweep of {} databases, {} with unique content, {} already searched"
+                        .format(len(planned), len(unique_hashes),
+                                len([h for h in unique_hashes if h in self.state["searches"]])))
+            failed = dict((h, error) for h, error in pool.imap_unordered(in_report(self.search), unique_hashes)
+                          if error)
+        finally:
+            pool.close()
+            pool.join()
+            if self.run_report:
+                report.write(os.path.join(self.output_dir, self.run_report))
+        dict_of_files = {}
+        for entry, content_hash in zip(planned, hashes):
+            if content_hash in failed:
+                continue
+            summaries = [f for f in self.link_results(entry, content_hash) if "_summary_" in os.path.basename(f)]
+            dict_of_files.setdefault(entry["db_key"], []).extend(summaries)
+        if failed:
+            logger.warning("{} of {} searches failed, rerun the sweep to retry them: {}"
+                           .format(len(failed), len(unique_hashes), failed))
+        return dict_of_files
@@ -0,0 +1,269 @@
+"""
+Merge xi_results.csv files of searches split across peak files or FASTA shards with bounded memory.
+
+The inputs are read in chunks of chunk_rows rows. Every chunk is reduced to the best match per spectrum, sorted by
+spectrum and written to a temporary run file. The runs are merged with heapq.merge, which holds one row per run in
+memory, and of all matches of a spectrum only the one with the highest 'match score' is written. More than
+max_open_runs runs are merged in several passes. Rows without value in one of the spectrum columns can not be assigned
+to a spectrum, they are all written after the spectra.
+
+The merged file has the union of the input columns plus the input file of every row. It is written as csv, or as
+parquet if the output file ends with .parquet and pyarrow is available.
+"""
+import csv
+import heapq
+import io
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+g_spectrum_columns = ("Run", "Scan")
+g_score_column = "match score"
+g_source_column = "source file"
+
+
+def open_csv(filename, mode="r"):
+    """opens a file for the csv module on python 2 and 3"""
+    if sys.version_info[0] < 3:
+        return open(filename, mode + "b")
+    return io.open(filename, mode, newline="")
+
+
+def read_header(filename):
+    with open_csv(filename) as f:
+        return next(csv.reader(f), [])
+
+
+def union_header(filenames, extra_columns=()):
+    """:return: list of all columns of the csv files in order of first appearance"""
+    header = []
+    for f in filenames:
+        for column in read_header(f):
+            if column not in header:
+                header.append(column)
+    for column in extra_columns:
+        if column not in header:
+            header.append(column)
+    return header
+
+
+def parse_score(value):
+    """scores that are missing or not a number rank below all others"""
+    try:
+        score = float(value)
+    except (TypeError, ValueError):
+        return float("-inf")
+    return score if score == score else float("-inf")
+
+
+class _Merger(object):
+    """external sort state shared by the steps of merge_xi_results"""
+    def __init__(self, header, tmp_dir, spectrum_columns, score_column):
+        self.header = header
+        self.tmp_dir = tmp_dir
+        self.spectrum_columns = spectrum_columns
+        self.score_column = score_column
+        self.n_runs = 0
+
+    def key(self, row, order):
+        """
+        (0, spectrum) of rows with all spectrum columns, (1, input order) of rows without, these are unique and
+        passed through without deduplication after all spectra
+        """
+        spectrum = tuple(row.get(c) or "" for c in self.spectrum_columns)
+        if all(spectrum):
+            return 0, spectrum
+        return 1, order
+
+    def decorate(self, row, order):
+        """sort tuple: spectrum, best score first, then input order so ties keep the first match"""
+        return self.key(row, order), -parse_score(row.get(self.score_column)), order
+
+    def write_run(self, decorated_rows):
+        filename = os.path.join(self.tmp_dir, "run_{}.csv".format(self.n_runs))
+        self.n_runs += 1
+        with open_csv(filename, "w") as f:
+            writer = csv.writer(f)
+            for (_, _, order), row in decorated_rows:
+                writer.writerow([order] + [row.get(c, "") for c in self.header])
+        return filename
+
+    def read_run(self, filename):
+        with open_csv(filename) as f:
+            for values in csv.reader(f):
+                row = dict(zip(self.header, values[1:]))
+                yield self.decorate(row, int(values[0])), row
+
+    def sorted_chunk(self, rows):
+        """sorts a chunk and keeps the best match of every spectrum"""
+        rows.sort(key=lambda item: item[0])
+        return list(best_per_spectrum(rows))
+
+    def merge_runs(self, run_files):
+        """:return: generator of (decoration, row) over the best match per spectrum of all runs"""
+        # heapq.merge has no key argument on python 2, the rows are decorated with their sort tuple
+        return best_per_spectrum(heapq.merge(*[self.read_run(f) for f in run_files]))
+
+
+def best_per_spectrum(decorated_rows):
+    """first row of every spectrum of rows sorted by (spectrum, -score, input order)"""
+    last_key = None
+    for item in decorated_rows:
+        key = item[0][0]
+        if key != last_key:
+            last_key = key
+            yield item
+
+
+def iter_input_rows(filenames, source_column):
+    """:return: generator of rows of all csv files, with the input file in source_column"""
+    for filename in filenames:
+        with open_csv(filename) as f:
+            for row in csv.DictReader(f):
+                if source_column:
+                    row[source_column] = filename
+                yield filename, row
+
+
+class CsvRowWriter(object):
+    def __init__(self, filename, header):
+        self.f = open_csv(filename, "w")
+        self.writer = csv.DictWriter(self.f, header, extrasaction="ignore")
+        self.writer.writeheader()
+
+    def write(self, row):
+        self.writer.writerow(row)
+
+    def close(self):
+        self.f.close()
+
+
+class ParquetRowWriter(object):
+    """writes rows as string columns in row groups of batch_rows rows"""
+    def __init__(self, filename, header, batch_rows=100000):
+        if pyarrow is None:
+            raise ImportError("writing parquet files requires pyarrow")
+        self.header = header
+        self.batch_rows = batch_rows
+        self.schema = pyarrow.schema([(c, pyarrow.string()) for c in header])
+        self.writer = pyarrow.parquet.ParquetWriter(filename, self.schema)
+        self.batch = []
+
+    def write(self, row):
+        self.batch.append(row)
+        if len(self.batch) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            columns = [pyarrow.array([row.get(c) for row in self.batch], type=pyarrow.string())
+                       for c in self.header]
+            self.writer.write_table(pyarrow.Table.from_arrays(columns, schema=self.schema))
+            self.batch = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def merge_xi_results(input_files, output_file, chunk_rows=200000, max_open_runs=64, tmp_dir=None,
+                     spectrum_columns=g_spectrum_columns, score_column=g_score_column,
+                     source_column=g_source_column):
+    """
+    merges xi result csv files into one file with the best scoring match per spectrum
+
+    :param input_files: xi_results.csv files, i.e. of XiWrapper.xi_execution runs on peak file or FASTA shards
+    :param output_file: csv, or parquet if it ends with .parquet
+    :param chunk_rows: rows held in memory while sorting
+    :param max_open_runs: runs merged at once, more runs are merged in several passes
+    :param tmp_dir: directory for the temporary run files, defaults to the directory of output_file
+    :param spectrum_columns: columns identifying a spectrum
+    :param source_column: column that receives the input file of every row, None to leave it out
+    :return: dict of statistics
+    """
+    input_files = list(input_files)
+    header = union_header(input_files, [source_column] if source_column else ())
+    return merge_rows(iter_input_rows(input_files, source_column), input_files, header, output_file, chunk_rows,
+                      max_open_runs, tmp_dir, spectrum_columns, score_column, source_column)
+
+
+def merge_rows(rows, sources, header, output_file, chunk_rows=200000, max_open_runs=64, tmp_dir=None,
+               spectrum_columns=g_spectrum_columns, score_column=g_score_column, source_column=g_source_column):
+    """
+    writes the best scoring row per spectrum of rows, see merge_xi_results
+
+    :param rows: iterable of (source, row dict), every source in sources
+    :param header: columns of the output file
+    :param source_column: column of the rows that holds their source, used to count the rows written per source
+    :return: dict of statistics, the per source counts are named per file as in merge_xi_results
+    """
+    out_dir = os.path.dirname(os.path.abspath(output_file))
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    tmp_dir = tempfile.mkdtemp(prefix="xi_merge_", dir=tmp_dir or out_dir)
+    merger = _Merger(header, tmp_dir, spectrum_columns, score_column)
+    stats = {"input_files": len(sources), "rows_read": 0, "rows_written": 0, "rows_without_spectrum": 0, "runs": 0,
+             "merge_passes": 0,
+             "rows_read_per_file": dict((f, 0) for f in sources),
+             "rows_written_per_file": dict((f, 0) for f in sources)}
+    try:
+        run_files = []
+        chunk = []
+        for order, (source, row) in enumerate(rows):
+            stats["rows_read_per_file"][source] += 1
+            chunk.append((merger.decorate(row, order), row))
+            if len(chunk) >= chunk_rows:
+                run_files.append(merger.write_run(merger.sorted_chunk(chunk)))
+                chunk = []
+        stats["rows_read"] = sum(stats["rows_read_per_file"].values())
+        if chunk and run_files:
+            run_files.append(merger.write_run(merger.sorted_chunk(chunk)))
+            chunk = []
+        # no runs if everything fit into one chunk
+        stats["runs"] = len(run_files)
+
+        while len(run_files) > max_open_runs:
+            stats["merge_passes"] += 1
+            run_files = [merger.write_run(merger.merge_runs(run_files[i:i + max_open_runs]))
+                         for i in range(0, len(run_files), max_open_runs)]
+        if run_files:
+            stats["merge_passes"] += 1
+            merged = merger.merge_runs(run_files)
+        else:
+            merged = merger.sorted_chunk(chunk)
+
+        if output_file.endswith(".parquet"):
+            writer = ParquetRowWriter(output_file, header)
+        else:
+            writer = CsvRowWriter(output_file, header)
+        try:
+            for decoration, row in merged:
+                writer.write(row)
+                stats["rows_written"] += 1
+                if decoration[0][0]:
+                    stats["rows_without_spectrum"] += 1
+                if source_column:
+                    stats["rows_written_per_file"][row[source_column]] += 1
+        finally:
+            writer.close()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    stats["duplicates_dropped"] = stats["rows_read"] - stats["rows_written"]
+    if stats["rows_without_spectrum"]:
+        logger.warning("{} rows without {} were written without deduplication".format(
+            stats["rows_without_spectrum"], " and ".join(spectrum_columns)))
+    logger.info("merged {} rows of {} inputs into {} spectra in {}, {} runs in {} passes".format(
+        stats["rows_read"], stats["input_files"], stats["rows_written"], output_file, stats["runs"],
+        stats["merge_passes"]))
+    return stats
@@ -0,0 +1,145 @@
+"""
+Split a FASTA into shards for XiSearch runs that do not fit into the memory of one JVM.
+
+shard_fasta distributes the proteins of a FastaHandler over n shards, balanced by residue count (largest protein
+to the currently smallest shard). run_sharded_search runs one XiSearch per shard and one per pair of shards, the
+pair searches provide the links between proteins of different shards. merge_sharded_results combines the
+xi_results.csv files into one file for xiFDR: from pair searches only the links across the two shards are kept,
+everything else was already found by the single shard searches, and of the remaining matches of a spectrum the best
+scoring one is written (see xi_result_merging). Decoy proteins are assigned to the shard of their target protein and
+every row gets the shards of both proteins and the search it comes from.
+"""
+import csv
+import heapq
+import itertools
+import logging
+import os
+import re
+from multiprocessing.pool import ThreadPool
+
+try:
+    from xlSearchSpaceLibs import xi_result_merging
+    from xlSearchSpaceLibs.XiWrapper import XiWrapper
+    from xlSearchSpaceLibs.xi_result_merging import open_csv
+except ImportError:
+    import xi_result_merging
+    from XiWrapper import XiWrapper
+    from xi_result_merging import open_csv
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+g_decoy_prefix_regex = re.compile(r"^(REV_|DECOY:|decoy:|rev_)+")
+
+
+def shard_fasta(fasta_handler, n_shards, out_dir, basename="shard"):
+    """
+    writes the proteins of fasta_handler into n_shards FASTA files with similar numbers of residues
+
+    :param fasta_handler: iBAQ_FASTA_handler.FastaHandler
+    :return: tuple (list of shard FASTA files, dict protein id -> shard index)
+    """
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    proteins = sorted(fasta_handler.dict.items(), key=lambda item: (-len(item[1]), item[0]))
+    heap = [(0, i) for i in range(n_shards)]
+    assignment = {}
+    for protein_id, sequence in proteins:
+        residues, i = heapq.heappop(heap)
+        assignment[protein_id] = i
+        heapq.heappush(heap, (residues + len(sequence), i))
+    shard_files = [os.path.join(out_dir, "{}_{}.fasta".format(basename, i)) for i in range(n_shards)]
+    handles = [open(f, "w") for f in shard_files]
+    try:
+        for protein_id, sequence in proteins:
+            f = handles[assignment[protein_id]]
+            f.write(">" + protein_id + "\n")
+            f.write(sequence + "\n")
+    finally:
+        for f in handles:
+            f.close()
+    logger.info("sharded {} proteins into {} shards with {} residues"
+                .format(len(proteins), n_shards, sorted(residues for residues, i in heap)))
+    return shard_files, assignment
+
+
+def shard_tasks(shard_files, between_shards=True):
+    """:return: list of (task name, tuple of shard indices), one per shard and one per pair of shards"""
+    tasks = [("shard_{}".format(i), (i,)) for i in range(len(shard_files))]
+    if between_shards:
+        tasks.extend(("shards_{}_{}".format(i, j), (i, j))
+                     for i, j in itertools.combinations(range(len(shard_files)), 2))
+    return tasks
+
+
+def run_sharded_search(shard_files, xi_config, peak_files, out_dir, nthr=1, between_shards=True, **xi_kwargs):
+    """
+    runs XiSearch for every shard and every pair of shards, nthr searches at a time
+
+    :param xi_kwargs: further arguments for XiWrapper.xi_execution, i.e. memory and xi_path
+    :return: dict task name -> (tuple of shard indices, xi result file)
+    """
+    def search(task):
+        name, shards = task
+        result = XiWrapper.xi_execution(
+            xi_config=xi_config, peak_files=list(peak_files), fasta_files=[shard_files[i] for i in shards],
+            output_file=os.path.join(out_dir, name, "xi_results.csv"), **xi_kwargs)
+        return name, shards, result
+
+    pool = ThreadPool(nthr)
+    try:
+        results = pool.map(search, shard_tasks(shard_files, between_shards), chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return dict((name, (shards, result)) for name, shards, result in results)
+
+
+def protein_shard(protein_field, assignment):
+    """shard of the first protein of a ';' separated protein field, decoys belong to the shard of their target"""
+    for protein in protein_field.split(";"):
+        protein = g_decoy_prefix_regex.sub("", protein.strip())
+        if protein in assignment:
+            return assignment[protein]
+    return None
+
+
+def merge_sharded_results(search_results, assignment, output_file, protein_columns=("Protein1", "Protein2"),
+                          chunk_rows=200000, tmp_dir=None):
+    """
+    merges the results of run_sharded_search into one csv with the best scoring match per spectrum, rows are
+    streamed and sorted externally by xi_result_merging.merge_rows
+
+    :param search_results: dict task name -> (tuple of shard indices, xi result file)
+    :param assignment: dict protein id -> shard index from shard_fasta
+    :param chunk_rows: rows held in memory while sorting
+    :param tmp_dir: directory for the temporary sort files, defaults to the directory of output_file
+    :return: dict of statistics per task: rows read, kept after the cross-shard filter and written
+    """
+    names = sorted(search_results, key=lambda n: (len(search_results[n][0]), n))
+    read = dict((name, 0) for name in names)
+
+    def cross_shard_rows():
+        for name in names:
+            shards, result_file = search_results[name]
+            with open_csv(result_file) as f_in:
+                for row in csv.DictReader(f_in):
+                    read[name] += 1
+                    shard1 = protein_shard(row.get(protein_columns[0]) or "", assignment)
+                    shard2 = protein_shard(row.get(protein_columns[1]) or "", assignment)
+                    if len(shards) == 2 and (shard1 is None or shard2 is None or shard1 == shard2):
+                        # linear or within shard matches are found by the single shard searches
+                        continue
+                    row["shard search"] = name
+                    row["Protein1 shard"] = "" if shard1 is None else shard1
+                    row["Protein2 shard"] = "" if shard2 is None else shard2
+                    yield name, row
+
+    header = xi_result_merging.union_header([search_results[name][1] for name in names],
+                                            ["shard search", "Protein1 shard", "Protein2 shard"])
+    merge_stats = xi_result_merging.merge_rows(cross_shard_rows(), names, header, output_file,
+                                               chunk_rows=chunk_rows, tmp_dir=tmp_dir, source_column="shard search")
+    stats = dict((name, {"read": read[name], "kept": merge_stats["rows_read_per_file"][name],
+                         "written": merge_stats["rows_written_per_file"][name]}) for name in names)
+    logger.info("merged sharded results into {}: {}".format(output_file, stats))
+    return stats
@@ -3,42 +3,31 @@ Evaluate results of ribosome fraction 14.
 To do so, use pipeline for xifdr analysis.
 """
 
-from XiFdrWrapper import XiFdrWrapper
+try:
+    from xlSearchSpaceLibs.XiFdrWrapper import XiFdrWrapper
+    from xlSearchSpaceLibs import file_discovery
+    from xlSearchSpaceLibs import list_files
+except ImportError:
+    from XiFdrWrapper import XiFdrWrapper
+    import file_discovery
+    import list_files
 import os
 import logging
 import sys
 import re
 
 
-def get_list_of_files(location, file_regex=r"xi_results.csv"):
+def get_list_of_files(location, file_regex=r"xi_results.csv", nthr=8, cache_file=None):
     """generates a list of files, that satisfy specific conditions, such as filename and location
     INPUT: constraints
-    RETURNS a list with all the experiment files as values"""
-    list_of_files = []
-    regex = re.compile(file_regex)
-    for rel_dir, sub_dirs, files in os.walk(location):
-        for f in files:
-            if regex.match(f):
-                list_of_files.append(os.path.join(rel_dir, f))
-    return list_of_files
-
-
-def convert_list_to_dict_of_files(list_of_files):
-    """groups replicates as lists in dict value for experiment key"""
-    exp_name_last_run = ""
-    dict_of_files = {}
-    for f in list_of_files:
-        # read out folder of experiment
-        result_path = f
-        for i in range(1):
-            result_path = os.path.split(result_path)[0]
-        exp_name_this_run = os.path.split(result_path)[1]
-        if exp_name_this_run == exp_name_last_run:
-            dict_of_files[exp_name_this_run].append(f)
-        else:
-            dict_of_files[exp_name_this_run] = [f]
-        exp_name_last_run = exp_name_this_run
-    return dict_of_files
+    RETURNS a sorted list with all the experiment files as values"""
+    return file_discovery.discover_files(location, file_regex, match_full_path=False, nthr=nthr,
+                                         cache_file=cache_file)
+
+
+def convert_list_to_dict_of_files(list_of_files, level=1, exp_regex=None):
+    """groups replicates as lists in dict value for experiment key, the parent directory by default"""
+    return list_files.group_files_by_experiment(list_of_files, level=level, exp_regex=exp_regex)
 
 
 # get list of files for input
@@ -85,11 +74,10 @@ if __name__ == "__main__":
 
     # print help message if script is called without argument
     if len(sys.argv) != 2:
-        print \
-"""
+        print("""
 Script has to be called with config file as argument.
 The directory of the config file will be the output dir.
-"""
+""")
         sys.exit(1)
 
     rel_config_file = sys.argv[1]
@@ -1,12 +1,25 @@
 import pandas as pd
 
+try:
+    from xlSearchSpaceLibs import experiment_keys
+    from xlSearchSpaceLibs import list_files
+except ImportError:
+    import experiment_keys
+    import list_files
+
 
 def build_dfs_of_int_betw(f):
     """
     :returns df_between and df_internal, only containing TT links
     """
     df = pd.read_csv(f)
-    df = df[df['isTT']]
+    return split_int_betw(df[df['isTT']])
+
+
+def split_int_betw(df):
+    """
+    :returns df_between and df_internal of a xiFDR result frame, by fdrGroup
+    """
     df_internal = df[df['fdrGroup'].str.contains('Within|[Ii]nternal')]
     df_between = df[df['fdrGroup'].str.contains('[Bb]etween')]
     if not len(df) == len(df_internal) + len(df_between):
@@ -14,12 +27,16 @@ def build_dfs_of_int_betw(f):
     return df_between, df_internal
 
 
-def scores_from_filedict(dct_f):
-    def f(key):
-        _, n1, _, n2 = key.split("_")
-        return float(n1) + float(n2 ) /10000
+def scores_from_filedict(dct_f, exp_regex=r"db_\d+_random_\d+"):
+    """
+    :param dct_f: dict db key -> list of replicate xiFDR summary files, or a list of such files that is grouped
+        by the closest directory matching exp_regex
+    """
+    if isinstance(dct_f, (list, tuple)):
+        dct_f = list_files.group_files_by_experiment(dct_f, exp_regex=exp_regex)
+
     df_scores = pd.DataFrame()
-    for db in sorted(dct_f, key=f):
+    for db in experiment_keys.sorted_keys(dct_f):
         files = dct_f[db]
         #         print db
         for i, f in enumerate(files):
@@ -38,7 +55,7 @@ def scores_from_filedict(dct_f):
             df_sc_int["id"] = idx
             df_sc_int["variable"] = var_int
             df_scores = df_scores.append([df_sc_int, df_sc_bet], ignore_index=True)
-    df_scores["link type"] = df_scores["variable"].map(lambda x: x.split(": ")[1])
+    df_scores["link type"] = experiment_keys.map_unique(df_scores["variable"], lambda x: x.split(": ")[1])
     return df_scores
 
 
@@ -57,20 +74,9 @@ def build_long_min_df(df_scores):
     df_wide["id"] = df_wide.index
     df_sc_min_long = df_wide.melt(id_vars="id", value_name="Score").dropna()
 
-    def f(string):
-        return string.split(" ")[2]
-
-    df_sc_min_long["link type"] = df_sc_min_long["variable"].map(f)
-
-    def f(key):
-        _, n1, _, n2 = key.split("_")
-        return n1 + "\n" + n2
-
-    df_sc_min_long["DB composition"] = df_sc_min_long["id"].map(f)
-
-    def f(key):
-        _, n1, _, n2 = key.split("_")
-        return int(n1) + int(n2)
-
-    df_sc_min_long["total DB size"] = df_sc_min_long["id"].map(f)
+    df_sc_min_long["link type"] = experiment_keys.map_unique(df_sc_min_long["variable"],
+                                                             lambda x: x.split(" ")[2])
+    key_columns = experiment_keys.key_columns(df_sc_min_long["id"], columns=["DB composition", "total DB size"])
+    df_sc_min_long["DB composition"] = key_columns["DB composition"]
+    df_sc_min_long["total DB size"] = key_columns["total DB size"]
     return df_sc_min_long